@@ -9,7 +9,8 @@ from ...member.fhir_custom_formats import (dt_address,
                                            dt_medicationreference,
                                            dt_referencerange,
                                            dt_reference,
-                                           dt_valuequantity)
+                                           dt_valuequantity,
+                                           has_display)
 from ...member.fhir_utils import (find_key_value_in_list,
                                   filter_list,
                                   path_extract
@@ -46,10 +47,11 @@ def friendlyfield(value, resource):
 
 
 @register.filter
-def valueformat(value, format_list):
+def valueformat(value, format_list, graph=None):
     """
     Receive value and name of field.
     Check for special formatting for Name, Address or Telecom otherwise return value
+    References are named from graph (the bundle's ReferenceGraph), if given, when they have no display.
 
     format_list = "member." + member_id + "." + resourceType + "." + key
     key is a field name or is a resourceType.key structure.
@@ -99,7 +101,7 @@ def valueformat(value, format_list):
             # concat_key should have a resource name
             # print("\n\nRESOURCE:", resource)
             # print("calling dt_medicationreference with Resource:", resource, ", value:", value)
-            return dt_medicationreference(value, member_id, resource)
+            return dt_medicationreference(value, member_id, resource, graph)
         elif key.lower() == 'dataabsentreason':
             if isinstance(value, dict):
                 return value['coding'][0]['display']
@@ -115,28 +117,28 @@ def valueformat(value, format_list):
         elif key.lower() == 'referencerange':
             return dt_referencerange(value)
         elif key.lower() == 'requester':
-            if 'display' in value['agent']:
-                return dt_reference(value['agent'], member_id)
+            if has_display(value['agent'], graph):
+                return dt_reference(value['agent'], member_id, graph)
         elif key.lower() == 'practitioner':
-            if 'display' in value:
-                return dt_reference(value, member_id)
+            if has_display(value, graph):
+                return dt_reference(value, member_id, graph)
         elif key.lower() == 'organization':
-            if 'display' in value:
-                return dt_reference(value, member_id)
+            if has_display(value, graph):
+                return dt_reference(value, member_id, graph)
         # elif key.lower() == "result":
         #     return dt_reference(value[0], member_id)
         elif key.lower() == 'practitioner':
-            if 'display' in value:
-                return dt_reference(value, member_id)
+            if has_display(value, graph):
+                return dt_reference(value, member_id, graph)
         elif key.lower() == 'organization':
-            if 'display' in value:
-                return dt_reference(value, member_id)
+            if has_display(value, graph):
+                return dt_reference(value, member_id, graph)
         elif key.lower() == 'participant':
-            if 'display' in value[0]['individual']:
-                return dt_reference(value[0]['individual'], member_id)
+            if has_display(value[0]['individual'], graph):
+                return dt_reference(value[0]['individual'], member_id, graph)
         elif key.lower() == 'location':
-            if 'display' in value[0]['location']:
-                return dt_reference(value[0]['location'], member_id)
+            if has_display(value[0]['location'], graph):
+                return dt_reference(value[0]['location'], member_id, graph)
         elif key.lower() == 'communication':
             return dt_communication(value)
         else:
@@ -144,6 +146,19 @@ def valueformat(value, format_list):
             return value
 
 
+@register.simple_tag
+def graphvalueformat(value, format_list, graph=None):
+    """
+    valueformat, for templates: a filter takes one argument
+    {% graphvalueformat value format_list graph %}
+    :param value:
+    :param format_list:
+    :param graph: the bundle's ReferenceGraph, to name references without a display
+    :return: value | formatted value based on key
+    """
+    return valueformat(value, format_list, graph)
+
+
 @register.filter
 def repeat_resourceview(resource, member_id):
     """
@@ -155,7 +170,7 @@ def repeat_resourceview(resource, member_id):
 
 
 @register.filter
-def resourceview(resource, member_id, changed=True):
+def resourceview(resource, member_id, changed=True, graph=None):
     """
     Take a resource and display it
     use RECORDS_STU3 to control display
@@ -180,6 +195,7 @@ def resourceview(resource, member_id, changed=True):
     :param resource:
     :param member_id:
     :param changed: 0 | 1
+    :param graph: the bundle's ReferenceGraph, to name references without a display
     :param viewer:
     :return: None or html_output string
     """
@@ -252,7 +268,7 @@ def resourceview(resource, member_id, changed=True):
             if key != 'id':
                 # We want to process the field
                 # print("KEY:", key, ":", value)
-                html_output += "<td>{result}</td>".format(result=valueformat(value, str(member_id) + '.' + resourceType + '.' + key))
+                html_output += "<td>{result}</td>".format(result=valueformat(value, str(member_id) + '.' + resourceType + '.' + key, graph))
                 # print("Here is html_output:", html_output)
                 # if "{member_id}" in html_output:
                 #     print("got to replace {member_id} with ", member_id)
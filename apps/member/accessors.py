@@ -0,0 +1,196 @@
+# Compiled jsonpath accessors for the record profiles and the timeline
+#
+# The record profiles (RECORDS_STU3) and TIMELINE name the fields they show,
+# group, sort and de-duplicate on with jsonpath expressions. fhir_utils used
+# to parse an expression with jsonpath_ng for every resource it looked at,
+# which took longer than everything else done to a record. An expression is
+# now compiled once, by compile_path(), into an Accessor; every expression in
+# the profiles and the timeline is compiled when this module is imported.
+#
+# The expressions are nearly all simple paths, e.g. '$.code.coding[*].display':
+# those compile to plain Python steps that return exactly what jsonpath_ng
+# returns, including its quirks ('[*]' over an object or a string matches the
+# value itself, '[0]' over an empty or null value matches nothing). Anything
+# else (filters, slices, unions, ...) is still found by jsonpath_ng, parsed
+# only once.
+import functools
+import re
+import time
+
+from jsonpath_ng import parse
+
+from .constants import RECORDS_STU3, TIMELINE
+from .fhir_index import BundleIndex
+
+SIMPLE_PATH = re.compile(r'\$((?:\.\w+|\[(?:\*|\d+)\])*)')
+SIMPLE_STEP = re.compile(r'\.(\w+)|\[(\*|\d+)\]')
+
+
+def field_step(name):
+    """
+    :param name: field name
+    :return: step matching the name field of each value (jsonpath_ng Fields)
+    """
+    def step(values):
+        matches = []
+        for value in values:
+            try:
+                matches.append(value[name])
+            except (TypeError, KeyError, AttributeError):
+                pass
+        return matches
+    return step
+
+
+def index_step(index):
+    """
+    :param index: list index
+    :return: step matching the index item of each value (jsonpath_ng Index)
+    """
+    def step(values):
+        return [value[index] for value in values if value and len(value) > index]
+    return step
+
+
+def each_step(values):
+    """
+    Match the items of each value, or an object or scalar value itself
+    (jsonpath_ng Slice, '[*]')
+    """
+    matches = []
+    for value in values:
+        if not value:
+            continue
+        if isinstance(value, list):
+            matches.extend(value)
+        elif isinstance(value, (dict, int, str)):
+            matches.append(value)
+        else:
+            matches.extend(value[i] for i in range(len(value)))
+    return matches
+
+
+class Accessor(object):
+    """A compiled jsonpath expression"""
+
+    def __init__(self, expr):
+        """
+        :param expr: jsonpath expression, e.g. '$.code.coding[*].display'
+        Raises the jsonpath_ng parser's errors if expr is not a valid expression.
+        """
+        self.expr = expr
+        match = SIMPLE_PATH.fullmatch(expr)
+        if match:
+            self.steps = [
+                field_step(name) if name else each_step if index == '*' else index_step(int(index))
+                for name, index in SIMPLE_STEP.findall(match.group(1))
+            ]
+            self.path = None
+        else:
+            self.steps = None
+            self.path = parse(expr)
+
+    @property
+    def simple(self):
+        """Whether expr compiled to plain Python steps"""
+        return self.steps is not None
+
+    def find(self, value):
+        """
+        :param value: decoded JSON, e.g. a resource
+        :return: list of the values matched in value, as jsonpath_ng finds them
+        """
+        if self.path is not None:
+            return [match.value for match in self.path.find(value)]
+        values = [value]
+        for step in self.steps:
+            values = step(values)
+            if not values:
+                break
+        return values
+
+    def first(self, value, default=None):
+        """
+        :param value: decoded JSON, e.g. a resource
+        :return: the first value matched in value, or default
+        """
+        values = self.find(value)
+        return values[0] if values else default
+
+    def __repr__(self):
+        return '<Accessor %s%s>' % (self.expr, '' if self.simple else ' (jsonpath_ng)')
+
+
+@functools.lru_cache(maxsize=None)
+def compile_path(expr):
+    """
+    :param expr: jsonpath expression
+    :return: its Accessor, compiled once per process
+    """
+    return Accessor(expr)
+
+
+def profile_paths(profiles=RECORDS_STU3, timeline=TIMELINE):
+    """
+    :param profiles: record profiles
+    :param timeline: timeline definitions
+    :return: {jsonpath expression: set of the resource types it is used on}
+    """
+    paths = {}
+    for profile in profiles:
+        exprs = [field_format['detail'] for field_format in profile.get('field_formats', ())]
+        exprs += list(profile.get('group', ())) + list(profile.get('unique', ()))
+        for expr in exprs:
+            if expr:
+                paths.setdefault(expr, set()).update(profile.get('resources', ()))
+    for item in timeline:
+        if item['datefield']:
+            paths.setdefault(item['datefield'], set()).add(item['name'])
+    return paths
+
+
+PROFILE_ACCESSORS = {expr: compile_path(expr) for expr in profile_paths()}
+
+
+def measure(bundles, repeat=3):
+    """
+    Compare finding the profile and timeline paths in the resources of bundles
+    by parsing each expression for each resource (as fhir_utils used to), and
+    with the compiled accessors
+    :param bundles: iterable of FHIR Bundle dicts (or BundleIndex)
+    :param repeat: timings are the best of repeat runs
+    :return: dict of the number of lookups, times in milliseconds, the speedup,
+        and the expressions whose results differ (there should be none)
+    """
+    lookups = [
+        (expr, resource)
+        for bundle in bundles
+        for expr, resource_types in sorted(profile_paths().items())
+        for resource in BundleIndex.of(bundle).resources(sorted(resource_types))
+    ]
+
+    def best(function):
+        times = []
+        for i in range(repeat):
+            start = time.perf_counter()
+            value = function()
+            times.append(time.perf_counter() - start)
+        return value, round(min(times) * 1000, 2)
+
+    parsed, parse_ms = best(lambda: [
+        [match.value for match in parse(expr).find(resource)] for expr, resource in lookups
+    ])
+    compiled, compiled_ms = best(lambda: [
+        compile_path(expr).find(resource) for expr, resource in lookups
+    ])
+    return {
+        'paths': len({expr for expr, resource in lookups}),
+        'simple_paths': len({expr for expr, resource in lookups if compile_path(expr).simple}),
+        'lookups': len(lookups),
+        'parse_ms': parse_ms,
+        'compiled_ms': compiled_ms,
+        'speedup': round(parse_ms / compiled_ms, 1) if compiled_ms else None,
+        'mismatches': sorted({
+            expr for (expr, resource), old, new in zip(lookups, parsed, compiled) if old != new
+        }),
+    }
@@ -0,0 +1,10 @@
+from django.contrib import admin
+
+from .models import MemberDataRefresh
+
+
+@admin.register(MemberDataRefresh)
+class MemberDataRefreshAdmin(admin.ModelAdmin):
+    search_fields = ('member__username',)
+    list_display = ('id', 'member', 'provider', 'status', 'created', 'finished', 'resource_count')
+    list_filter = ('provider', 'status')
@@ -0,0 +1,477 @@
+# Shared cache for member data fetched from the data providers (sharemyhealth)
+#
+# Member data lives in the settings.MEMBER_DATA_CACHE_ALIAS cache, not the
+# per-process default cache, so that every worker (and, with a memcached or
+# database backend, every node) sees the same entries and an invalidation by
+# one worker applies to all of them. Concurrent misses for the same member are
+# coalesced (see singleflight.py), so that only one of them fetches, and stale
+# entries are served while they are refreshed in the background.
+#
+# Every cache key of data derived from a member (member_cache_key) includes the
+# member's generation number. Invalidating a member (invalidate_member) bumps
+# that one number, and with it every key: the member's bundles, the resources
+# cached by type, and anything computed from them, on every node at once. The
+# old entries are no longer read, and expire.
+import contextlib
+import functools
+import logging
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+
+from . import codec
+from .constants import RESOURCES
+from .fhir_index import BundleIndex
+from .lru import ByteBudgetLRU
+from .singleflight import DatabaseLocks, SingleFlight
+
+logger = logging.getLogger('smhapp_.%s' % __name__)
+
+
+class MemberDataCacheProxy(object):
+    """Look the cache up per access, as django.core.cache.cache does for 'default'."""
+
+    def __getattr__(self, name):
+        return getattr(caches[settings.MEMBER_DATA_CACHE_ALIAS], name)
+
+
+member_data_cache = MemberDataCacheProxy()
+
+# the locks are in the database: the file-based cache's add() is not atomic
+member_data_flight = SingleFlight(
+    DatabaseLocks(),
+    lock_timeout=settings.MEMBER_DATA_FETCH_LOCK_TIMEOUT,
+    wait_timeout=settings.MEMBER_DATA_FETCH_WAIT_TIMEOUT,
+)
+
+# this worker's most recently decoded member data (see lru.py)
+member_data_memory = ByteBudgetLRU(settings.MEMBER_DATA_MEMORY_CACHE_BYTES)
+
+# threads that refresh stale entries in the background
+revalidator = ThreadPoolExecutor(
+    max_workers=settings.MEMBER_DATA_REVALIDATE_WORKERS,
+    thread_name_prefix='member-data-revalidate',
+)
+
+
+def member_generation(member):
+    """
+    :param member: User
+    :return: the member's cache generation number
+    """
+    key = 'member_generation:%s' % member.pk
+    generation = member_data_cache.get(key)
+    if generation is None:
+        # generations start from the clock, so that a generation number that
+        # was evicted from the cache does not start over at an old number
+        generation = int(time.time() * 1000)
+        if not member_data_cache.add(key, generation, None):
+            generation = member_data_cache.get(key, generation)
+    return generation
+
+
+def invalidate_member(member):
+    """
+    Invalidate everything cached for the member, by bumping their generation
+    :param member: User
+    :return: the new generation number
+    """
+    key = 'member_generation:%s' % member.pk
+    try:
+        return member_data_cache.incr(key)
+    except ValueError:
+        generation = int(time.time() * 1000)
+        member_data_cache.set(key, generation, None)
+        return generation
+
+
+def member_cache_key(member, *parts, generation=None):
+    """
+    Each call reads the member's generation from the cache: compute a key
+    once per request (or fetch) and pass it on, rather than again where it is used.
+    :param member: User
+    :param parts: what is cached, e.g. ('member_data', 'sharemyhealth')
+    :param generation: the member's generation, if known (e.g. from invalidate_member())
+    :return: cache key of data derived from the member, in their current generation
+    """
+    if generation is None:
+        generation = member_generation(member)
+    return 'member:%s:%s:%s' % (member.pk, generation, ':'.join(str(part) for part in parts))
+
+
+def member_data_key(member, provider, generation=None):
+    """
+    :param member: User
+    :param provider: provider name, e.g. 'sharemyhealth'
+    :param generation: the member's generation, if known
+    :return: cache key of the member's data from provider
+    """
+    return member_cache_key(member, 'member_data', provider, generation=generation)
+
+
+def member_type_keys(key, resource_types):
+    """
+    :param key: member_data_key()
+    :return: {cache key: resource_type} of the member's resources of each of
+        resource_types from provider, fetched without the rest of the bundle
+    """
+    return {'%s:type:%s' % (key, resource_type): resource_type for resource_type in resource_types}
+
+
+def pack_member_data(result):
+    """
+    :param result: member data to cache
+    :return: the result as stored in a cache entry: encoded (see codec.py),
+        unless MEMBER_DATA_CACHE_CODEC is 'pickle'
+    """
+    if settings.MEMBER_DATA_CACHE_CODEC == 'pickle':
+        return result
+    try:
+        return codec.encode(result)
+    except TypeError:
+        logger.warning('member data not encodable, caching it pickled', exc_info=True)
+        return result
+
+
+def unpack_member_data(data, key=None):
+    """
+    :param data: the 'data' of a cache entry, from pack_member_data()
+    :param key: the entry's cache key: the decoded data is kept in this
+        worker's member_data_memory, and reused while the entry is unchanged
+    :return: member data, or None if it can't be decoded (e.g. it was encoded
+        with another dictionary)
+    """
+    if not isinstance(data, bytes):
+        return data
+    version = (len(data), zlib.crc32(data))
+    if key is not None:
+        result = member_data_memory.get(key, version)
+        if result is not None:
+            return result
+    try:
+        result, size = codec.decode_sized(data)
+    except ValueError:
+        logger.info('dropping undecodable member data', exc_info=True)
+        return None
+    if key is not None:
+        member_data_memory.set(key, version, result, size)
+    return result
+
+
+def get_entry(key):
+    """
+    :param key: member_data_key()
+    :return: the cache entry {'data': member data, 'fetched_at': ...} for key, or None
+    """
+    entry = member_data_cache.get(key)
+    if entry is None:
+        return None
+    data = unpack_member_data(entry['data'], key)
+    if data is None:
+        return None
+    return dict(entry, data=data)
+
+
+def make_entry(result, fetched_at):
+    """
+    :return: the cache entry of result, fetched at fetched_at. It is 'complete'
+        unless result is a first page, or the last good data of a failed fetch.
+    """
+    return {
+        'data': pack_member_data(result),
+        'fetched_at': fetched_at,
+        'complete': not result.get('partial') and not result.get('stale'),
+    }
+
+
+def load_member_type_data(key, resource_types):
+    """
+    :param key: member_data_key()
+    :param resource_types: list of resourceType names
+    :return: {resourceType: {'fhir_data': BundleIndex, 'updated_at': ...}} for those that are cached
+    """
+    keys = member_type_keys(key, resource_types)
+    entries = {}
+    for key, data in member_data_cache.get_many(list(keys)).items():
+        data = unpack_member_data(data, key)
+        if data is not None:
+            entries[keys[key]] = data
+    return entries
+
+
+def store_member_type_data(key, resource_types, result):
+    """
+    Cache the resources of each of resource_types in result on its own, for
+    MEMBER_DATA_CACHE_TIMEOUT seconds. A type with no resources is cached too.
+    :param key: member_data_key()
+    :param resource_types: the resourceType names that result was fetched for
+    :param result: member data, with 'fhir_data' as a BundleIndex
+    :return: {resourceType: {'fhir_data': BundleIndex, 'updated_at': ...}}
+    """
+    entries = {
+        t: {'fhir_data': BundleIndex(), 'updated_at': result.get('updated_at')}
+        for t in resource_types
+    }
+    for resource in result['fhir_data'].resources(resource_types):
+        entries[resource['resourceType']]['fhir_data'].add(resource)
+    member_data_cache.set_many(
+        {type_key: pack_member_data(entries[t]) for type_key, t in member_type_keys(key, entries).items()},
+        settings.MEMBER_DATA_CACHE_TIMEOUT,
+    )
+    return entries
+
+
+def load_member_data(key):
+    """
+    :param key: member_data_key()
+    :return: the cached member data, else the result of a failed fetch that is
+        still being backed off from, else None
+    """
+    entry = get_entry(key)
+    if entry is not None:
+        return entry['data']
+    failure = load_member_data_failure(key)
+    if failure is not None:
+        return failure['result']
+    return None
+
+
+def load_member_data_failure(key):
+    """
+    :param key: member_data_key()
+    :return: the negative entry for key, if it is still being backed off from, or None
+    """
+    failure = member_data_cache.get('%s:failure' % key)
+    if failure is not None and time.time() < failure['until']:
+        return failure
+    return None
+
+
+def store_member_data(key, result, fetched_at, max_age):
+    """
+    Store a fetched result, unless the entry was evicted while it was being
+    fetched (which would bring evicted data back). A result with data replaces
+    the cached data; an error or empty result is stored as a negative entry.
+    A stale result (the last good data, while the data provider is down) is
+    stored as both: it is served, and refreshed once the backoff allows.
+    :param key: member_data_key()
+    :param result: fetch result
+    :param fetched_at: time.time() when the fetch started
+    :param max_age: seconds to keep the entry
+    """
+    if is_evicted(key, fetched_at):
+        return
+    if result.get('fhir_data') and result.get('stale'):
+        member_data_cache.set(key, make_entry(result, 0), max_age)
+        store_member_data_failure(key, {'status': result.get('status'), 'stale': True})
+    elif result.get('fhir_data'):
+        member_data_cache.set(key, make_entry(result, fetched_at), max_age)
+        member_data_cache.delete('%s:failure' % key)
+    else:
+        store_member_data_failure(key, result)
+
+
+def keep_member_data(key, fetched_at, max_age):
+    """
+    Record that a fetch found the same data as the cached entry, keeping the
+    entry as it is (and with it, the data each worker decoded and derived
+    from it) but fetched at fetched_at
+    :param key: member_data_key()
+    :param fetched_at: time.time() when the fetch started
+    :param max_age: seconds to keep the entry
+    :return: whether there was a complete entry to keep
+    """
+    entry = member_data_cache.get(key)
+    if entry is None or not entry.get('complete'):
+        return False
+    if not is_evicted(key, fetched_at):
+        member_data_cache.set(key, dict(entry, fetched_at=fetched_at), max_age)
+        member_data_cache.delete('%s:failure' % key)
+    return True
+
+
+def is_evicted(key, fetched_at):
+    """
+    :return: whether the entry was evicted after a fetch started at fetched_at
+    """
+    evicted_at = member_data_cache.get('%s:evicted' % key)
+    return evicted_at is not None and evicted_at >= fetched_at
+
+
+def store_member_data_failure(key, result):
+    """
+    Store a negative entry for an error or empty result. Until it expires, the
+    result is returned without fetching; each failure in a row doubles the
+    time, from MEMBER_DATA_FAILURE_TIMEOUT up to MEMBER_DATA_FAILURE_MAX_TIMEOUT.
+    Negative entries are kept apart from the data, so a failed refresh does
+    not replace good data.
+    :param key: member_data_key()
+    :param result: fetch result: an error dict, {} or data with an empty bundle
+    """
+    failure_key = '%s:failure' % key
+    previous = member_data_cache.get(failure_key)
+    failures = previous['failures'] + 1 if previous is not None else 1
+    backoff = min(
+        settings.MEMBER_DATA_FAILURE_TIMEOUT * 2 ** (failures - 1),
+        settings.MEMBER_DATA_FAILURE_MAX_TIMEOUT,
+    )
+    logger.info('member data %s: failure %d (status %s), backing off %ds',
+                key, failures, result.get('status'), backoff)
+    member_data_cache.set(
+        failure_key,
+        {'result': result, 'failures': failures, 'until': time.time() + backoff},
+        # kept after the backoff, so that the next failure backs off longer
+        settings.MEMBER_DATA_FAILURE_MAX_TIMEOUT * 2,
+    )
+
+
+def cache_member_data(timeout, max_age):
+    """
+    Cache the results of fetch(member, provider, refresh=False, partial=None,
+    **kwargs) in the member data cache, stale-while-revalidate:
+
+    - an entry younger than timeout is returned as is;
+    - an older entry is still returned at once, and refreshed in the background;
+    - an entry is dropped after max_age, and a miss fetches (at most once at a
+      time per member and provider);
+    - refresh=True fetches with refresh and replaces the entry that the other
+      calls read;
+    - fetch may call partial(result) with part of the result (e.g. the first
+      page), which is served while the rest is fetched if there is no entry;
+    - a result that fetch marks 'unchanged' (the data provider sent the data
+      it sent last time) keeps the entry and the member's generation, rather
+      than replacing the entry and invalidating the member.
+
+    A caller that already has the member's member_data_key() passes it as
+    data_key, so that the member's generation is not read again.
+
+    Errors and empty results are cached as negative entries, with exponential
+    backoff, and never replace good data (see store_member_data_failure).
+    :param timeout: seconds after which an entry is refreshed
+    :param max_age: seconds after which an entry is no longer used
+    """
+    def decorator(fetch):
+        def fetch_and_store(member, provider, refresh, key, **kwargs):
+            fetched_at = time.time()
+            stored_partial = []
+
+            def store_partial(result):
+                # the first page of a paged bundle, served until the rest
+                # arrives if there is no (older) entry to serve instead
+                if member_data_cache.add(key, make_entry(result, fetched_at), max_age):
+                    stored_partial.append(True)
+
+            result = fetch(member, provider, refresh=refresh, partial=store_partial, **kwargs)
+            unchanged = result.pop('unchanged', False)
+            if stored_partial and not result.get('fhir_data'):
+                member_data_cache.delete(key)
+            if (result.get('fhir_data') and not result.get('stale')
+                    and member_data_key(member, provider) == key):
+                if unchanged and keep_member_data(key, fetched_at, max_age):
+                    # the data provider sent the data that is cached: keep
+                    # the resources cached by type, and what was derived
+                    # from them, in the same generation
+                    return result
+                # the member's new data (from a refresh, a revalidation or a
+                # miss alike): drop everything derived from the old, e.g. the
+                # resources cached by type (unless the member was invalidated
+                # during the fetch)
+                key = member_data_key(member, provider, generation=invalidate_member(member))
+            store_member_data(key, result, fetched_at, max_age)
+            return result
+
+        def revalidate(member, provider, key=None):
+            if key is None:
+                key = member_data_key(member, provider)
+            revalidate_key = '%s:revalidate' % key
+            # one background refresh per entry, across all workers
+            if not member_data_cache.add(revalidate_key, 1, settings.MEMBER_DATA_FETCH_LOCK_TIMEOUT):
+                return None
+
+            def run():
+                try:
+                    fetch_and_store(member, provider, False, key)
+                except Exception:
+                    logger.exception('background refresh of %s failed', key)
+                finally:
+                    member_data_cache.delete(revalidate_key)
+                    connection.close()
+
+            return revalidator.submit(run)
+
+        @functools.wraps(fetch)
+        def cached_fetch(member, provider, refresh=False, data_key=None, **kwargs):
+            # computed once, and passed on (see member_cache_key)
+            key = data_key or member_data_key(member, provider)
+            if refresh:
+                # asked for explicitly: don't wait out a backoff
+                member_data_cache.delete('%s:failure' % key)
+                return member_data_flight.do(
+                    '%s:refresh' % key, lambda: load_member_data(member_data_key(member, provider)),
+                    lambda: fetch_and_store(member, provider, True, key, **kwargs),
+                )
+
+            entry = get_entry(key)
+            if entry is not None:
+                if time.time() - entry['fetched_at'] > timeout and load_member_data_failure(key) is None:
+                    revalidate(member, provider, key)
+                return entry['data']
+
+            failure = load_member_data_failure(key)
+            if failure is not None:
+                return failure['result']
+
+            return member_data_flight.do(
+                # the result is stored in a new generation
+                key, lambda: load_member_data(member_data_key(member, provider)),
+                lambda: fetch_and_store(member, provider, False, key, **kwargs),
+            )
+
+        def warm(member, provider, limit=None, **kwargs):
+            """
+            Make sure the member's entry is fresh, fetching it in this thread
+            if it is missing or older than timeout (and not backing off)
+            :param limit: context manager entered around the fetch only (e.g. to cap concurrency)
+            :return: (result, whether it was fetched)
+            """
+            key = member_data_key(member, provider)
+            entry = get_entry(key)
+            if entry is not None and time.time() - entry['fetched_at'] <= timeout:
+                return entry['data'], False
+            failure = load_member_data_failure(key)
+            if failure is not None:
+                return failure['result'], False
+            with limit or contextlib.nullcontext():
+                result = member_data_flight.do(
+                    key, lambda: load_member_data(member_data_key(member, provider)),
+                    lambda: fetch_and_store(member, provider, False, key, **kwargs),
+                )
+            return result, True
+
+        cached_fetch.uncached = fetch
+        cached_fetch.revalidate = revalidate
+        cached_fetch.warm = warm
+        return cached_fetch
+
+    return decorator
+
+
+def evict_member_data(member, provider):
+    """
+    Remove the member's cached data (the bundle, the resources cached by type,
+    and failures) from provider, and invalidate everything else cached for
+    the member. A fetch that is in flight when the entry is evicted does not
+    store its result.
+    :param member: User
+    :param provider: provider name
+    """
+    key = member_data_key(member, provider)
+    member_data_cache.set('%s:evicted' % key, time.time(), settings.MEMBER_DATA_FETCH_LOCK_TIMEOUT)
+    # the current generation's entries are deleted, not just left to expire
+    member_data_cache.delete_many(
+        [key, '%s:failure' % key] + list(member_type_keys(key, RESOURCES)))
+    invalidate_member(member)
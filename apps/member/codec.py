@@ -0,0 +1,301 @@
+# Compact encoding of member data in the member data cache
+#
+# The cache backends pickle what they store, and a pickled BundleIndex is
+# about as big as the bundle's JSON text. Member data is therefore cached as
+# zlib-compressed JSON instead, about a tenth of the size. FHIR JSON repeats
+# the same keys, code systems, codings and references over and over, and the
+# compressor starts from a preset dictionary of those fragments (fhir.zdict,
+# trained on the test bundles with `manage.py member_data_codec --train`), so
+# that even small entries, such as the resources of one type, compress well.
+# The dictionary ships with the code, so it holds only the structure of FHIR
+# JSON (keys, code systems, codes, reference types), never a member's data:
+# no ids, references, names, addresses or free text.
+#
+# An encoded entry starts with MAGIC and the id of the dictionary it was
+# compressed with: an entry from another dictionary (or a corrupt one) fails
+# to decode with ValueError, and is treated as a cache miss.
+#
+# Neither encoding nor decoding holds the whole JSON text: the text is
+# compressed as the encoder produces it, and decompressed a chunk at a time
+# into the incremental parser (fhir_stream.py), as the snapshots are.
+import codecs
+import functools
+import json
+import logging
+import os
+import pickle
+import struct
+import time
+import zlib
+from collections import Counter
+
+from .fhir_index import BundleIndex
+from .fhir_stream import parse_member_data
+
+logger = logging.getLogger('smhapp_.%s' % __name__)
+
+DICTIONARY_PATH = os.path.join(os.path.dirname(__file__), 'fhir.zdict')
+# zlib uses at most the last 32K of a preset dictionary
+DICTIONARY_SIZE = 32 * 1024
+COMPRESSION_LEVEL = 6
+COMPRESS_CHUNK_SIZE = 64 * 1024
+DECOMPRESS_CHUNK_SIZE = 256 * 1024
+MAGIC = b'SMZ1'
+HEADER = struct.Struct('>4sI')
+
+
+# keys whose values are structure (code systems, codes, enumerations) rather
+# than the member's data, and may go into the dictionary with their values
+STRUCTURAL_KEYS = frozenset([
+    'resourceType', 'system', 'code', 'unit', 'url', 'status', 'use', 'intent', 'mode',
+    'clinicalStatus', 'verificationStatus', 'contentType', 'periodUnit', 'relation',
+])
+
+
+def object_prefix(value):
+    """
+    :param value: dict
+    :return: the start of its JSON, up to the first value that is not
+        structural, e.g. '{"system":"http://loinc.org","code":"8480-6","display":'
+    """
+    parts = []
+    for key, item in value.items():
+        if key in STRUCTURAL_KEYS and not isinstance(item, (dict, list)):
+            parts.append('"%s":%s' % (key, json.dumps(item, separators=(',', ':'))))
+        else:
+            parts.append('"%s":' % key)
+            return '{' + ','.join(parts)
+    return '{' + ','.join(parts) + '}'
+
+
+def fragments(value, counter, values):
+    """
+    Count the JSON fragments of value that a dictionary could hold: each
+    '"key":' (of any value), each '"key":scalar' pair of a STRUCTURAL_KEYS
+    key, the resource type of each reference ('"reference":"Practitioner/'),
+    and the object_prefix() of each object
+    :param value: decoded JSON
+    :param counter: Counter of the keys and reference types
+    :param values: Counter of the structural pairs and object prefixes
+    """
+    if isinstance(value, dict):
+        if len(value) > 1:
+            values[object_prefix(value)] += 1
+        for key, item in value.items():
+            if isinstance(item, (dict, list)):
+                counter['"%s":' % key] += 1
+                fragments(item, counter, values)
+            elif key in STRUCTURAL_KEYS:
+                values['"%s":%s' % (key, json.dumps(item, separators=(',', ':')))] += 1
+            elif key == 'reference' and isinstance(item, str) and '/' in item:
+                counter['"reference":"%s/' % item.split('/')[-2]] += 1
+            else:
+                counter['"%s":' % key] += 1
+    elif isinstance(value, list):
+        for item in value:
+            fragments(item, counter, values)
+
+
+def train_dictionary(bundles, size=DICTIONARY_SIZE, min_bundles=2):
+    """
+    Build a preset dictionary from the structural fragments (see fragments())
+    that save the most bytes (occurrences x length) across the resources of
+    bundles. A code or other structural value is only used if it occurs in
+    min_bundles bundles, so that nothing particular to one member goes in.
+    :param bundles: iterable of FHIR Bundle dicts (or BundleIndex)
+    :param size: maximum dictionary size in bytes
+    :param min_bundles: bundles a structural value must occur in
+    :return: bytes, the most valuable fragments last (zlib reaches them with the shortest distances)
+    """
+    counter, values, bundle_counts = Counter(), Counter(), Counter()
+    for bundle in bundles:
+        bundle_values = Counter()
+        for resource in BundleIndex.of(bundle):
+            fragments(resource, counter, bundle_values)
+        values.update(bundle_values)
+        bundle_counts.update(bundle_values.keys())
+    counter.update({
+        fragment: count for fragment, count in values.items() if bundle_counts[fragment] >= min_bundles
+    })
+    scored = sorted(
+        ((count * len(fragment.encode('utf-8')), fragment) for fragment, count in counter.items() if count > 1),
+        reverse=True,
+    )
+    picked, total = [], 0
+    for score, fragment in scored:
+        fragment = fragment.encode('utf-8')
+        if total + len(fragment) <= size:
+            picked.append(fragment)
+            total += len(fragment)
+    return b''.join(reversed(picked))
+
+
+@functools.lru_cache()
+def load_dictionary(path=DICTIONARY_PATH):
+    """
+    :return: the preset dictionary at path, or b'' if there is none
+    """
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        logger.warning('no member data dictionary at %s', path)
+        return b''
+
+
+def encode(result, zdict=None):
+    """
+    :param result: member data, with 'fhir_data' as a BundleIndex or bundle dict
+    :param zdict: preset dictionary (default: load_dictionary())
+    :return: bytes
+    Raises TypeError if result can't be serialized to JSON.
+    """
+    if zdict is None:
+        zdict = load_dictionary()
+    compressor = zlib.compressobj(COMPRESSION_LEVEL, zdict=zdict) if zdict else zlib.compressobj(COMPRESSION_LEVEL)
+    parts, size = compress_json(result, compressor)
+    return HEADER.pack(MAGIC, zlib.adler32(zdict)) + b''.join(parts)
+
+
+def compress_json(result, compressor, digest=None):
+    """
+    Compress the JSON of member data, without building the JSON text as one string
+    :param result: member data, with 'fhir_data' as a BundleIndex or bundle dict
+    :param compressor: zlib compressobj
+    :param digest: hashlib hash to update with the JSON, if any
+    :return: (list of the compressed parts, size of the JSON in bytes)
+    Raises TypeError if result can't be serialized to JSON.
+    """
+    fhir_data = result.get('fhir_data')
+    if isinstance(fhir_data, BundleIndex):
+        result = dict(result, fhir_data=fhir_data.as_bundle())
+    size = 0
+    parts = []
+
+    def compress(pending):
+        nonlocal size
+        chunk = ''.join(pending).encode('utf-8')
+        if digest is not None:
+            digest.update(chunk)
+        size += len(chunk)
+        part = compressor.compress(chunk)
+        if part:
+            parts.append(part)
+
+    # the encoder yields a few characters at a time: compress them in batches
+    pending = []
+    pending_length = 0
+    for chunk in json.JSONEncoder(separators=(',', ':')).iterencode(result):
+        pending.append(chunk)
+        pending_length += len(chunk)
+        if pending_length >= COMPRESS_CHUNK_SIZE:
+            compress(pending)
+            pending = []
+            pending_length = 0
+    compress(pending)
+    parts.append(compressor.flush())
+    return parts, size
+
+
+def iter_decompressed_text(data, zdict=b'', sizes=None):
+    """
+    :param data: compressed JSON (without a header)
+    :param zdict: the preset dictionary it was compressed with, if any
+    :param sizes: list to append the estimate_size() of each decompressed chunk to, if any
+    :return: iterator of decoded text chunks
+    """
+    decompressor = zlib.decompressobj(zdict=zdict) if zdict else zlib.decompressobj()
+    # a UTF-8 sequence may be split between chunks
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    view = memoryview(data)
+    for i in range(0, len(view), DECOMPRESS_CHUNK_SIZE):
+        chunk = decompressor.decompress(view[i:i + DECOMPRESS_CHUNK_SIZE])
+        if sizes is not None:
+            sizes.append(estimate_size(chunk))
+        yield decoder.decode(chunk)
+    chunk = decompressor.flush()
+    if sizes is not None:
+        sizes.append(estimate_size(chunk))
+    yield decoder.decode(chunk, final=True)
+
+
+def estimate_size(text, resources=0):
+    """
+    Estimate the memory taken by decoded JSON from its text, without walking
+    the objects (which takes as long as decoding them). Calibrated on the test
+    bundles, whole and by resource type, to within about 15%. The estimate of
+    a text is the sum of the estimates of its parts.
+    :param text: JSON text (bytes), or a part of it
+    :param resources: number of resources in the BundleIndex built from it
+    :return: bytes
+    """
+    return (len(text) + 150 * text.count(b'{') + 40 * text.count(b':') + 40 * text.count(b'[')
+            + 100 * resources)
+
+
+def decode(data, zdict=None):
+    """
+    :param data: bytes from encode()
+    :param zdict: the preset dictionary data was encoded with (default: load_dictionary())
+    :return: member data, with 'fhir_data' as a BundleIndex
+    Raises ValueError if data was not encoded with zdict, or is corrupt.
+    """
+    return decode_sized(data, zdict)[0]
+
+
+def decode_sized(data, zdict=None):
+    """
+    decode(), and estimate the memory the result takes
+    :return: (member data, estimate_size() in bytes)
+    """
+    if zdict is None:
+        zdict = load_dictionary()
+    if len(data) < HEADER.size:
+        raise ValueError('not encoded member data')
+    magic, dictionary_id = HEADER.unpack_from(data)
+    if magic != MAGIC or dictionary_id != zlib.adler32(zdict):
+        raise ValueError('member data encoded with another dictionary')
+    sizes = []
+    try:
+        result = parse_member_data(iter_decompressed_text(memoryview(data)[HEADER.size:], zdict, sizes))
+    except zlib.error as e:
+        raise ValueError('corrupt member data: %s' % e)
+    return result, sum(sizes) + estimate_size(b'', len(result['fhir_data']))
+
+
+def measure(result, zdict=None, repeat=3):
+    """
+    Compare the encoding of result with pickling it (what the cache backends do)
+    :param result: member data, with 'fhir_data' as a BundleIndex
+    :param zdict: preset dictionary (default: load_dictionary())
+    :param repeat: timings are the best of repeat runs
+    :return: dict of sizes in bytes, compression ratios and times in milliseconds
+    """
+    if zdict is None:
+        zdict = load_dictionary()
+
+    def best(function):
+        times = []
+        for i in range(repeat):
+            start = time.perf_counter()
+            value = function()
+            times.append(time.perf_counter() - start)
+        return value, round(min(times) * 1000, 2)
+
+    pickled, pickle_ms = best(lambda: pickle.dumps(result, pickle.HIGHEST_PROTOCOL))
+    unpickle_ms = best(lambda: pickle.loads(pickled))[1]
+    encoded, encode_ms = best(lambda: encode(result, zdict))
+    decode_ms = best(lambda: decode(encoded, zdict))[1]
+    plain = encode(result, b'')
+    return {
+        'resources': len(result['fhir_data']),
+        'pickle_bytes': len(pickled),
+        'zlib_bytes': len(plain),
+        'encoded_bytes': len(encoded),
+        'ratio': round(len(pickled) / len(encoded), 2),
+        'dictionary_gain': round(1 - len(encoded) / len(plain), 3),
+        'pickle_ms': pickle_ms,
+        'unpickle_ms': unpickle_ms,
+        'encode_ms': encode_ms,
+        'decode_ms': decode_ms,
+    }
@@ -47,6 +47,11 @@ PRECISION = 2
 
 PROVIDER_RESOURCES = ['Encounter', 'Location', 'Organization', 'Practitioner', 'PractitionerRole', 'CareTeam']
 
+PRESCRIPTION_TYPES = ['MedicationRequest', 'MedicationStatement', 'Medication', 'Practitioner']
+
+# resources that reference every record, left out of a record's "Referenced by"
+REFERENCED_BY_EXCLUDE = ('Provenance', 'Composition')
+
 FIELD_TITLES = [
     {'profile': 'AllergyIntolerance',
      'elements': [
@@ -107,6 +112,12 @@ FIELD_TITLES = [
          {'system_name': 'birthDate', 'show_name': 'Date of Birth'},
          {'system_name': 'communication', 'show_name': 'Preferred Language'},
      ]},
+    {'profile': 'Practitioner',
+     'elements': [
+         {'system_name': 'earliestDate', 'show_name': 'First Seen'},
+         {'system_name': 'latestDate', 'show_name': 'Last Seen'},
+         {'system_name': 'location', 'show_name': 'Location'},
+     ]},
     {'profile': 'VitalSigns',
      'elements': [
          {'system_name': 'id', 'show_name': 'detail'},
@@ -445,7 +456,7 @@ RECORDS_STU3 = [
     {'name': 'VisionPrescription', 'slug': 'visionprescription', 'call_type': 'fhir', 'resources': ['VisionPrescription'], 'display': 'Vision Prescription', 'headers': ['id', '*'], 'exclude': ['meta', 'identifier', 'resourceType']}
 ]
 
-RESOURCES = ['Account', 'ActivityDefinition', 'AllergyIntolerance', 'AdverseEvent', 'Appointment',
+RESOURCES = ('Account', 'ActivityDefinition', 'AllergyIntolerance', 'AdverseEvent', 'Appointment',
              'AppointmentResponse', 'AuditEvent', 'Basic', 'Binary', 'BodySite', 'Bundle',
              'CapabilityStatement', 'CarePlan', 'CareTeam', 'ChargeItem', 'Claim', 'ClaimResponse',
              'ClinicalImpression', 'CodeSystem', 'Communication', 'CommunicationRequest',
@@ -468,7 +479,7 @@ RESOURCES = ['Account', 'ActivityDefinition', 'AllergyIntolerance', 'AdverseEven
              'RequestGroup', 'ResearchStudy', 'ResearchSubject', 'RiskAssessment',
              'Schedule', 'SearchParameter', 'Sequence', 'ServiceDefinition', 'Slot', 'Specimen',
              'StructureDefinition', 'StructureMap', 'Subscription', 'Substance', 'SupplyDelivery',
-             'SupplyRequest', 'Task', 'TestScript', 'TestReport', 'ValueSet', 'VisionPrescription']
+             'SupplyRequest', 'Task', 'TestScript', 'TestReport', 'ValueSet', 'VisionPrescription')
 
 VITALSIGNS = ['3141-9', '8302-2', '39156-5',
               '8480-6', '8462-4', '8867-4', '8310-5', '9279-1']
@@ -0,0 +1,85 @@
+# Linear-time de-duplication of records
+#
+# A profile's 'unique' lists the jsonpaths that identify a record (e.g. a
+# Practitioner's identifier value), and only the first record of each
+# identity is shown. Identities used to be kept in a list, and every record
+# compared with all of those seen before it, which is quadratic in the number
+# of records: slow for members with thousands of Encounters and their
+# practitioners. Each record's identity is now a hashable key, the tuple of
+# its first value at each path, looked up in a set.
+#
+# Records with no value at any of the paths have no identity and are all
+# kept, as before.
+import logging
+
+from .accessors import compile_path
+
+logger = logging.getLogger('smhapp_.%s' % __name__)
+
+
+def hashable(value):
+    """
+    :param value: decoded JSON
+    :return: a hashable value that is equal for equal JSON values
+    """
+    if isinstance(value, dict):
+        return frozenset((key, hashable(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return tuple(hashable(item) for item in value)
+    return value
+
+
+class Deduplicator(object):
+    """Keeps the first record of each key, counting the records it folds"""
+
+    def __init__(self, paths):
+        """
+        :param paths: jsonpath expressions whose (first) values make up a record's key
+        """
+        self.accessors = [compile_path(path) for path in paths]
+        self.seen = set()
+        self.folded = 0
+
+    def key(self, entry):
+        """
+        :param entry: a record (resource dict)
+        :return: its key, or None if none of the paths has a value in it
+        """
+        values = tuple(accessor.first(entry) for accessor in self.accessors)
+        if not any(values):
+            return None
+        return tuple(hashable(value) for value in values)
+
+    def is_new(self, entry):
+        """
+        :param entry: a record
+        :return: whether no record with the same key was seen yet (records without a key are new)
+        """
+        key = self.key(entry)
+        if key is None:
+            return True
+        if key in self.seen:
+            self.folded += 1
+            return False
+        self.seen.add(key)
+        return True
+
+    def filter(self, entries):
+        """
+        :param entries: iterable of records
+        :return: list of the first record of each key, and those without a key, in order
+        """
+        return [entry for entry in entries if self.is_new(entry)]
+
+
+def dedupe(entries, paths):
+    """
+    :param entries: list of records
+    :param paths: jsonpath expressions of the key, e.g. a profile's 'unique'
+    :return: (list of the records kept, number of duplicates folded)
+    """
+    deduplicator = Deduplicator(paths)
+    kept = deduplicator.filter(entries)
+    if deduplicator.folded:
+        logger.debug('folded %d of %d records on %s', deduplicator.folded, len(entries), ', '.join(paths))
+    return kept, deduplicator.folded
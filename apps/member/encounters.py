@@ -0,0 +1,118 @@
+# Encounters by participant
+#
+# The providers pages show when a member saw each practitioner, and where.
+# practitioner_encounter() used to go through every encounter for every
+# practitioner, deriving each encounter's participant, location and start
+# again for each pair. The EncounterIndex goes through the encounters once,
+# and keeps the dates and locations of the encounters of each participant
+# (Encounter.participant.individual), by reference ('Practitioner/12'): a
+# practitioner's encounters are then a single lookup.
+#
+# The index is built once per bundle (encounter_index()), and shared like the
+# bundle: it must not be modified.
+from .fhir_index import derived
+from .references import reference_key, resource_key
+
+
+class ParticipantEncounters(object):
+    """The encounters of one participant, with their first and last dates and their locations"""
+
+    def __init__(self):
+        self.encounters = []
+        # YYYY-MM-DD
+        self.earliest = None
+        self.latest = None
+        # Encounter.location items, one per location reference, in the order first seen
+        self.locations = []
+        self.location_keys = set()
+
+    def add(self, encounter, start, locations):
+        """
+        :param encounter: Encounter resource
+        :param start: its start date (YYYY-MM-DD), or None
+        :param locations: [(reference key, Encounter.location item), ...]
+        """
+        self.encounters.append(encounter)
+        if start:
+            if self.earliest is None or start < self.earliest:
+                self.earliest = start
+            if self.latest is None or start > self.latest:
+                self.latest = start
+        for key, location in locations:
+            if key not in self.location_keys:
+                self.location_keys.add(key)
+                self.locations.append(location)
+
+
+class EncounterIndex(object):
+    """Reference of a participant -> ParticipantEncounters"""
+
+    def __init__(self, encounters):
+        """
+        :param encounters: iterable of Encounter resources
+        """
+        self.by_participant = {}
+        for encounter in encounters:
+            start = ((encounter.get('period') or {}).get('start') or '')[:10] or None
+            locations = [
+                (reference_key(location.get('location')), location)
+                for location in encounter.get('location') or ()
+                if reference_key(location.get('location'))
+            ]
+            # a participant listed twice in an encounter still has one encounter
+            participants = dict.fromkeys(
+                reference_key(participant.get('individual'))
+                for participant in encounter.get('participant') or ()
+            )
+            participants.pop(None, None)
+            for key in participants:
+                summary = self.by_participant.get(key)
+                if summary is None:
+                    summary = self.by_participant[key] = ParticipantEncounters()
+                summary.add(encounter, start, locations)
+
+    def __len__(self):
+        return len(self.by_participant)
+
+    def get(self, resource_or_reference):
+        """
+        :param resource_or_reference: a resource (e.g. a Practitioner), a reference string or Reference dict
+        :return: ParticipantEncounters, or None if it took part in no encounter
+        """
+        if isinstance(resource_or_reference, dict) and 'resourceType' in resource_or_reference:
+            key = resource_key(resource_or_reference)
+        else:
+            key = reference_key(resource_or_reference)
+        return self.by_participant.get(key)
+
+    def annotate(self, resource):
+        """
+        Add the 'earliestDate', 'latestDate' and 'location' (Encounter.location
+        items) of the resource's encounters to it, if it took part in any
+        :param resource: resource dict (a copy: it is modified)
+        :return: resource
+        """
+        summary = self.get(resource)
+        if summary is not None:
+            if summary.earliest:
+                resource['earliestDate'] = summary.earliest
+                resource['latestDate'] = summary.latest
+            if summary.locations:
+                resource['location'] = list(summary.locations)
+        return resource
+
+
+def build_encounter_index(index):
+    """
+    :param index: BundleIndex
+    :return: EncounterIndex of its encounters
+    """
+    return EncounterIndex(index.resources('Encounter'))
+
+
+def encounter_index(fhir_data):
+    """
+    :param fhir_data: BundleIndex or bundle dict
+    :return: EncounterIndex of the bundle's encounters, built once per bundle
+    """
+    return derived(fhir_data, build_encounter_index)
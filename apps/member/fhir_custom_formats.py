@@ -141,10 +141,11 @@ def dt_dosage(value, member_id=None):
     return f_value
 
 
-def dt_medicationreference(value, member_id=None, resource=None):
+def dt_medicationreference(value, member_id=None, resource=None, graph=None):
     """
     Format MedicationReference Complex Data Type
     :param value:
+    :param graph: the bundle's ReferenceGraph, to name references without a display
     :return f_value:
     """
     # print("\nResource:", resource, ", Value:", value)
@@ -156,13 +157,13 @@ def dt_medicationreference(value, member_id=None, resource=None):
             f_value = ""
             # f_value = "Medication: "
             for v_l in value:
-                if 'display' in v_l:
+                if has_display(v_l, graph):
                     # f_value += v_l['display'] + " "
-                    f_value += dt_reference(v_l, member_id) + " "
+                    f_value += dt_reference(v_l, member_id, graph) + " "
         elif type(value) == dict:
-            if 'display' in value:
+            if has_display(value, graph):
                 # f_value = value['display']
-                f_value = dt_reference(value, member_id)
+                f_value = dt_reference(value, member_id, graph)
                 # f_value = "Medication: " + value['display']
     else:
         # print("ELSE Value:", value)
@@ -172,15 +173,15 @@ def dt_medicationreference(value, member_id=None, resource=None):
             f_value = ""
             # f_value = "Medication: "
             for v_l in value:
-                if 'display' in v_l:
+                if has_display(v_l, graph):
                     # f_value += v_l['display'] + " "
-                    f_value += dt_reference(v_l, member_id) + " "
+                    f_value += dt_reference(v_l, member_id, graph) + " "
         elif type(value) == dict:
             # print("Dealing with DICT")
-            if 'display' in value:
+            if has_display(value, graph):
                 # print("we have a display")
                 # f_value = value['display']
-                f_value = dt_reference(value, member_id)
+                f_value = dt_reference(value, member_id, graph)
                 # f_value = "Medication: " + value['display']
     return f_value
 
@@ -212,9 +213,20 @@ def dt_referencerange(value, member_id=None):
     return f_value
 
 
-def dt_reference(display_dict, member_id=None):
+def has_display(reference, graph=None):
+    """
+    :param reference: Reference dict
+    :param graph: the bundle's ReferenceGraph, if any
+    :return: whether dt_reference() can name the reference: it has a display,
+        or it resolves to a resource in graph
+    """
+    return 'display' in reference or (graph is not None and graph.resolve(reference) is not None)
+
+
+def dt_reference(display_dict, member_id=None, graph=None):
     """
     Format a Reference
+    :param graph: the bundle's ReferenceGraph, to name a reference without a display
     :return:
     """
     if 'reference' in display_dict:
@@ -222,6 +234,8 @@ def dt_reference(display_dict, member_id=None):
             disp = display_dict['text']
         elif ('display' in display_dict):
             disp = display_dict['display']
+        elif graph is not None and graph.resolve(display_dict) is not None:
+            disp = graph.display(display_dict)
         else:
             disp = display_dict['reference']
 
@@ -0,0 +1,116 @@
+# Resource-level differences between two versions of a member's bundle
+#
+# A refresh usually changes a handful of resources out of hundreds. Each
+# resource is identified by "resourceType/id" and versioned by its
+# meta.versionId / meta.lastUpdated or, when it has neither (as HIXNY's
+# resources mostly don't), by a hash of its content. A bundle's manifest maps
+# identities to versions; comparing the manifest of the last snapshot with the
+# new bundle gives the resources that were added, changed or removed.
+import hashlib
+import json
+
+
+def resource_version(resource):
+    """
+    :param resource: FHIR resource dict
+    :return: str that changes whenever the resource does
+    """
+    meta = resource.get('meta') or {}
+    if meta.get('versionId') or meta.get('lastUpdated'):
+        return '%s|%s' % (meta.get('versionId', ''), meta.get('lastUpdated', ''))
+    content = json.dumps(resource, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+def resource_key(resource, version=None):
+    """
+    :param resource: FHIR resource dict
+    :param version: resource_version(resource), for resources without an id
+    :return: "resourceType/id", or "resourceType/#version" for resources without an id
+    """
+    if resource.get('id'):
+        return '%s/%s' % (resource.get('resourceType'), resource['id'])
+    return '%s/#%s' % (resource.get('resourceType'), version or resource_version(resource))
+
+
+def bundle_manifest(index):
+    """
+    :param index: BundleIndex
+    :return: {resource_key: resource_version} for every resource in the index
+    """
+    manifest = {}
+    for resource in index:
+        version = resource_version(resource)
+        manifest[resource_key(resource, version)] = version
+    return manifest
+
+
+class BundleDelta(object):
+    """The resources added, changed and removed between two versions of a bundle"""
+
+    def __init__(self, added=None, changed=None, removed=None):
+        """
+        :param added: resources that are new
+        :param changed: resources whose version changed (the new versions)
+        :param removed: resource_keys of the resources that are gone
+        """
+        self.added = added or []
+        self.changed = changed or []
+        self.removed = removed or []
+
+    def __bool__(self):
+        return bool(self.added or self.changed or self.removed)
+
+    def __len__(self):
+        return len(self.added) + len(self.changed) + len(self.removed)
+
+    def counts(self):
+        """
+        :return: {'added': n, 'changed': n, 'removed': n}
+        """
+        return {
+            'added': len(self.added),
+            'changed': len(self.changed),
+            'removed': len(self.removed),
+        }
+
+    def resource_types(self):
+        """
+        :return: set of the resourceTypes that were added, changed or removed
+        """
+        types = {r.get('resourceType') for r in self.added + self.changed}
+        types.update(key.split('/', 1)[0] for key in self.removed)
+        return types
+
+    def summary(self):
+        """
+        :return: counts() and sorted resource_types(), small enough to cache with the member data
+        """
+        return dict(self.counts(), resource_types=sorted(t for t in self.resource_types() if t))
+
+    def __repr__(self):
+        return '<BundleDelta: %(added)d added, %(changed)d changed, %(removed)d removed>' % self.counts()
+
+
+def diff_bundles(old_manifest, index):
+    """
+    Compare a new bundle with the manifest of the previous one
+    :param old_manifest: bundle_manifest() of the previous bundle
+    :param index: BundleIndex of the new bundle
+    :return: (BundleDelta, bundle_manifest(index))
+    """
+    delta = BundleDelta()
+    manifest = {}
+    for resource in index:
+        version = resource_version(resource)
+        key = resource_key(resource, version)
+        if key in manifest:
+            continue
+        manifest[key] = version
+        old_version = old_manifest.get(key)
+        if old_version is None:
+            delta.added.append(resource)
+        elif old_version != version:
+            delta.changed.append(resource)
+    delta.removed = [key for key in old_manifest if key not in manifest]
+    return delta, manifest
@@ -0,0 +1,205 @@
+# Index over the resources in a FHIR Bundle
+#
+# Patient/$everything returns every resource for a member in a single Bundle.
+# The views used to walk bundle['entry'] once per RECORDS_STU3 profile; the
+# BundleIndex is built once per fetched bundle and answers the same questions
+# from resourceType and (resourceType, id) maps.
+#
+# Other indexes over a bundle (its encounters by participant, its references)
+# are built on first use and kept with the BundleIndex (derived()), which the
+# workers share: they are built once per bundle, not once per request.
+import threading
+import weakref
+
+
+class BundleIndex(object):
+    """
+    resourceType -> resources and (resourceType, id) -> resource maps for a bundle
+
+    Resources are kept in bundle order. The index holds references to the
+    resource dicts, not copies, so it adds little on top of the bundle itself.
+    """
+
+    resourceType = 'Bundle'
+    # the bundle's link (paging) and total, if it had them
+    links = ()
+    total = None
+    # resourceType -> the positions of its resources in entries (None in
+    # indexes pickled before it was kept)
+    positions = None
+
+    def __init__(self, bundle=None):
+        """
+        :param bundle: FHIR Bundle dict ({'resourceType': 'Bundle', 'entry': [...]}) or None
+        """
+        self.entries = []
+        self.by_type = {}
+        self.by_id = {}
+        self.positions = {}
+        if bundle:
+            self.extend(bundle.get('entry') or [])
+            self.links = bundle.get('link') or []
+            self.total = bundle.get('total')
+
+    @classmethod
+    def of(cls, data):
+        """
+        Return data as a BundleIndex, building one if data is a bundle dict
+        :param data: BundleIndex | bundle dict | None
+        :return: BundleIndex
+        """
+        if isinstance(data, cls):
+            return data
+        return cls(data)
+
+    def add(self, resource):
+        """
+        Add a single resource to the index
+        :param resource: FHIR resource dict
+        :return: resource
+        """
+        resource_type = resource.get('resourceType')
+        if self.positions is not None:
+            self.positions.setdefault(resource_type, []).append(len(self.entries))
+        self.entries.append(resource)
+        self.by_type.setdefault(resource_type, []).append(resource)
+        if 'id' in resource:
+            self.by_id[(resource_type, resource['id'])] = resource
+        return resource
+
+    def extend(self, entries):
+        """
+        Add the resources from a list of bundle entries
+        :param entries: [{'resource': {...}}, ...]
+        """
+        for item in entries:
+            if 'resource' in item:
+                self.add(item['resource'])
+
+    def merge(self, other):
+        """
+        Add the resources of another index (e.g. the next page of a paged
+        bundle), skipping the ones that are already in this one
+        :param other: BundleIndex
+        """
+        for resource in other:
+            if (resource.get('resourceType'), resource.get('id')) not in self.by_id:
+                self.add(resource)
+
+    def link(self, relation):
+        """
+        :param relation: link relation, e.g. 'next'
+        :return: the url of the bundle's link with that relation, or None
+        """
+        for link in self.links:
+            if link.get('relation') == relation:
+                return link.get('url')
+        return None
+
+    def resources(self, resource_types=None, id=None):
+        """
+        Get the resources of the requested types, in bundle order
+        :param resource_types: str | list of resourceType names | None for all
+        :param id: optional resource id to match: the resource of each type with that id
+        :return: list of resource dicts
+        """
+        if isinstance(resource_types, str):
+            resource_types = [resource_types]
+
+        if id is not None:
+            if resource_types is None:
+                resource_types = self.by_type
+            found = (self.by_id.get((resource_type, id)) for resource_type in dict.fromkeys(resource_types))
+            return [r for r in found if r is not None]
+
+        if resource_types is None:
+            return list(self.entries)
+        if len(resource_types) == 1:
+            return list(self.by_type.get(resource_types[0], []))
+        if self.positions is None:
+            wanted = set(resource_types)
+            return [r for r in self.entries if r.get('resourceType') in wanted]
+        # the positions of the resources of each type, merged back into bundle order
+        positions = sorted(p for t in set(resource_types) for p in self.positions.get(t, ()))
+        return [self.entries[p] for p in positions]
+
+    def get(self, resource_type, id, default=None):
+        """
+        Get a single resource by resourceType and id
+        :param resource_type:
+        :param id:
+        :param default:
+        :return: resource dict | default
+        """
+        return self.by_id.get((resource_type, id), default)
+
+    def resolve(self, reference, default=None):
+        """
+        Resolve a relative "Type/id" reference to the resource it points at
+        :param reference: "Type/id" string or a Reference dict
+        :param default:
+        :return: resource dict | default
+        """
+        if isinstance(reference, dict):
+            reference = reference.get('reference')
+        if not reference or '/' not in reference:
+            return default
+        resource_type, id = reference.split('/')[-2:]
+        return self.get(resource_type, id, default)
+
+    def count(self, resource_type=None):
+        """
+        Number of resources of resource_type, or of all resources
+        :param resource_type:
+        :return: int
+        """
+        if resource_type is None:
+            return len(self.entries)
+        return len(self.by_type.get(resource_type, []))
+
+    def counts(self):
+        """
+        :return: {resourceType: count}
+        """
+        return {k: len(v) for k, v in self.by_type.items()}
+
+    def as_bundle(self):
+        """
+        Rebuild a FHIR Bundle dict from the index
+        :return: {'resourceType': 'Bundle', 'entry': [...]}
+        """
+        return {'resourceType': 'Bundle',
+                'entry': [{'resource': r} for r in self.entries]}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __repr__(self):
+        return '<BundleIndex: %d resources, %d types>' % (len(self.entries), len(self.by_type))
+
+
+_derived = weakref.WeakKeyDictionary()
+_derived_lock = threading.Lock()
+
+
+def derived(fhir_data, build):
+    """
+    Get data derived from a bundle, building it once per BundleIndex (and
+    again if resources were added to the index since). The data is shared
+    like the bundle: it must not be modified.
+    :param fhir_data: BundleIndex or bundle dict
+    :param build: module-level function, called with the BundleIndex
+    :return: build(index)
+    """
+    index = BundleIndex.of(fhir_data)
+    with _derived_lock:
+        built = _derived.get(index, {}).get(build)
+    if built is not None and built[0] == len(index):
+        return built[1]
+    value = build(index)
+    with _derived_lock:
+        _derived.setdefault(index, {})[build] = (len(index), value)
+    return value
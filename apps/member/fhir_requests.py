@@ -2,6 +2,7 @@ import logging
 #
 # from django.conf import settings
 from .constants import RESOURCES, VITALSIGNS
+from .fhir_index import BundleIndex
 logger = logging.getLogger(__name__)
 
 
@@ -14,7 +15,7 @@ DEBUG_MODULE = False
 def get_converted_fhir_resource(fhir_data, resourcetype="all"):
     """
     Get resourceType using HIE_Profile.fhir_content as fhir_data
-    :param fhir_data: source fhir bundle
+    :param fhir_data: source fhir bundle or BundleIndex
     :param resourcetype:
     :return:
 
@@ -47,13 +48,17 @@ def get_converted_fhir_resource(fhir_data, resourcetype="all"):
 
 
 def get_resource_data(data, resource_types, constructor=dict, id=None):
-    if isinstance(resource_types, str):
-        resource_types = [resource_types]
+    """
+    Get the resources of resource_types from a bundle or BundleIndex
+    :param data: fhir bundle | BundleIndex
+    :param resource_types: str | list
+    :param constructor: called with each resource (dict makes a shallow copy)
+    :param id: optional resource id to match
+    :return: list
+    """
     return [
-        constructor(item['resource'])
-        for item in (data or {}).get('entry', [])
-        if item['resource']['resourceType'] in resource_types
-        if id is None or item['resource'].get('id') == id
+        constructor(resource)
+        for resource in BundleIndex.of(data).resources(resource_types, id=id)
     ]
 
 
@@ -0,0 +1,230 @@
+# Incremental parser for sharemyhealth member data responses
+#
+# r.json() needs the whole response body as one string before it builds the
+# whole dict tree from it, so at peak a worker holds the raw text, the decoded
+# tree and then the BundleIndex built from it. parse_member_data reads the body
+# a chunk at a time and adds each entry's resource to a BundleIndex as soon as
+# that entry has been read; the text of the entries already read is dropped.
+import codecs
+import json
+import re
+
+from .fhir_index import BundleIndex
+
+CHUNK_SIZE = 64 * 1024
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+
+class JSONStream(object):
+    """
+    JSON text read from an iterator of str chunks, decoded one value at a time
+
+    members() and elements() walk an object or array without decoding it as a
+    whole; value() decodes the complete value at the current position.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def fill(self, size=CHUNK_SIZE):
+        """
+        Drop the consumed text and read at least size more characters, or to the end
+        :param size:
+        """
+        parts = [self.buffer[self.pos:]]
+        wanted = len(parts[0]) + size
+        length = len(parts[0])
+        while length < wanted:
+            try:
+                chunk = next(self.chunks)
+            except StopIteration:
+                self.eof = True
+                break
+            parts.append(chunk)
+            length += len(chunk)
+        self.buffer = ''.join(parts)
+        self.pos = 0
+
+    def peek(self):
+        """
+        Skip whitespace and return the next character, without consuming it
+        :return: str
+        """
+        while True:
+            self.pos = WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if self.eof:
+                raise ValueError('Unexpected end of JSON input')
+            self.fill()
+
+    def expect(self, char):
+        """Consume char, which must be the next non-whitespace character"""
+        if self.peek() != char:
+            raise ValueError(
+                'Expected %r, found %r' % (char, self.buffer[self.pos:self.pos + 20])
+            )
+        self.pos += 1
+
+    def value(self):
+        """
+        Decode and consume the complete JSON value at the current position
+        :return: the decoded value
+        """
+        first = self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except ValueError:
+                if self.eof:
+                    raise
+            else:
+                # a number or literal that ends the buffer may go on in the next chunk
+                if end < len(self.buffer) or self.eof or first in '{["':
+                    self.pos = end
+                    return value
+            # read at least as much again as is pending, so that a large value
+            # is re-decoded a few times, not once per chunk
+            self.fill(max(CHUNK_SIZE, len(self.buffer) - self.pos))
+
+    def members(self):
+        """
+        Iterate over the keys of the object at the current position. The caller
+        must consume each key's value (with value(), members() or elements())
+        before asking for the next key.
+        """
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            if self.peek() != '"':
+                raise ValueError('Expected an object key at %r' % self.buffer[self.pos:self.pos + 20])
+            key = self.value()
+            self.expect(':')
+            yield key
+            if self.peek() == '}':
+                self.pos += 1
+                return
+            self.expect(',')
+
+    def elements(self):
+        """
+        Iterate over the elements of the array at the current position, yielding
+        their indexes. The caller must consume each element before the next.
+        """
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        i = 0
+        while True:
+            yield i
+            if self.peek() == ']':
+                self.pos += 1
+                return
+            self.expect(',')
+            i += 1
+
+    def end(self):
+        """Check that there is nothing but whitespace after the parsed value"""
+        try:
+            char = self.peek()
+        except ValueError:
+            return
+        raise ValueError('Extra data after JSON value: %r' % char)
+
+
+def parse_bundle_member(stream, key, index):
+    """
+    Read the value of the Bundle member key, at the current position of
+    stream, into index: the entries' resources, and the link and total.
+    Other members are skipped.
+    :param stream: JSONStream
+    :param key: the member's name
+    :param index: BundleIndex
+    """
+    if key == 'entry' and stream.peek() == '[':
+        for _ in stream.elements():
+            entry = stream.value()
+            if isinstance(entry, dict) and 'resource' in entry:
+                index.add(entry['resource'])
+    elif key == 'link':
+        index.links = stream.value() or []
+    elif key == 'total':
+        index.total = stream.value()
+    else:
+        stream.value()
+
+
+def parse_bundle(stream, index=None):
+    """
+    Read the FHIR Bundle at the current position of stream into a BundleIndex.
+    Each entry is decoded on its own and its resource added to the index.
+    :param stream: JSONStream
+    :param index: BundleIndex to add to (default: a new one)
+    :return: BundleIndex
+    """
+    if index is None:
+        index = BundleIndex()
+    for key in stream.members():
+        parse_bundle_member(stream, key, index)
+    return index
+
+
+def parse_member_data(chunks):
+    """
+    Parse a sharemyhealth member data response ({'fhir_data': <Bundle>, ...})
+    :param chunks: iterable of str
+    :return: dict, with 'fhir_data' as a BundleIndex
+    """
+    stream = JSONStream(chunks)
+    result = {}
+    for key in stream.members():
+        if key == 'fhir_data' and stream.peek() == '{':
+            result[key] = parse_bundle(stream)
+        else:
+            result[key] = stream.value()
+    stream.end()
+    result['fhir_data'] = BundleIndex.of(result.get('fhir_data'))
+    return result
+
+
+def parse_page(chunks):
+    """
+    Parse a page of a paged bundle: a member data response, like
+    parse_member_data(), or a bare FHIR Bundle
+    :param chunks: iterable of str
+    :return: BundleIndex
+    """
+    stream = JSONStream(chunks)
+    index = BundleIndex()
+    for key in stream.members():
+        if key == 'fhir_data' and stream.peek() == '{':
+            parse_bundle(stream, index)
+        else:
+            parse_bundle_member(stream, key, index)
+    stream.end()
+    return index
+
+
+def iter_response_text(response, chunk_size=CHUNK_SIZE):
+    """
+    Iterate over the body of a streamed requests.Response as decoded text
+    :param response: requests.Response, requested with stream=True
+    :param chunk_size: bytes to read at a time
+    """
+    # JSON is UTF-8 unless the response says otherwise
+    decoder = codecs.getincrementaldecoder(response.encoding or 'utf-8-sig')()
+    for chunk in response.iter_content(chunk_size=chunk_size):
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    text = decoder.decode(b'', final=True)
+    if text:
+        yield text
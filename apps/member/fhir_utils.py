@@ -2,14 +2,17 @@
 # import logging
 import json
 
+from collections.abc import Mapping
 from datetime import datetime, timezone
 from django.conf import settings
 from getenv import env
-from jsonpath_ng import parse    # , jsonpath
 from operator import itemgetter
 # from operator import itemgetter as i
 # from functools import cmp_to_key
+from .accessors import compile_path
 from .constants import VITALSIGNS, TIMELINE
+from .dedup import dedupe
+from .fhir_index import BundleIndex
 # RECORDS_STU3
 
 
@@ -60,7 +63,7 @@ def find_list_entry(big_list, key, value):
 def load_test_fhir_data(data):
     """
     load a test fhir structure
-    :return: fhir_data
+    :return: fhir_data as a BundleIndex
     """
     if settings.VPC_ENV in ['prod', 'staging', 'dev']:
         fhir_data = data.get('fhir_data')
@@ -75,7 +78,7 @@ def load_test_fhir_data(data):
                 fhir_data = data.get('fhir_data')
         else:
             fhir_data = data.get('fhir_data')
-    return fhir_data
+    return BundleIndex.of(fhir_data)
 
 
 def path_extract(entry, resource_spec):
@@ -107,10 +110,8 @@ def path_extract(entry, resource_spec):
                 fmt = ff['format']
                 if fld in e:
                     # print("Field:", e[fld])
-                    jp_parsing = parse(det)
-                    rslt = jp_parsing.find(e)
-                    # print("Result:", det, ">", rslt)
-                    results = [match.value for match in rslt]
+                    results = compile_path(det).find(e)
+                    # print("Result:", det, ">", results)
                     # print(results)
                     result = []
                     for r in results:
@@ -360,17 +361,17 @@ def view_filter(all_records, view=None):
 def value_in(resource, value):
     """
     check for field in resource
-    :param resource:
+    :param resource: dict, or a read-only profile (profiles.PROFILES)
     :param value:
     :return: True | False
     """
     if value in resource:
-        if isinstance(resource[value], dict):
-            if resource[value] == {}:
+        if isinstance(resource[value], Mapping):
+            if len(resource[value]) == 0:
                 return False
             else:
                 return True
-        elif isinstance(resource[value], list) or isinstance(resource[value], str):
+        elif isinstance(resource[value], (list, tuple, str)):
             if len(resource[value]) == 0:
                 return False
             else:
@@ -443,12 +444,10 @@ def groupsort(entry, resource):
     # print(entry[0])
     ct = 0
     ungrouped = []
+    group_path = compile_path(resource['group'][0])
     for e in entry:
         ct += 1
-        jp_parsing = parse(resource['group'][0])
-        result = jp_parsing.find(e)
-        # print("count:", ct, "Result:", resource['group'][0], ">", result)
-        group_key = [match.value for match in result]
+        group_key = group_path.find(e)
         # print("group_key:", group_key)
         if len(group_key) > 0:
             # we have group_key = ['key']
@@ -623,9 +622,7 @@ def get_date_from_path(e_item, path_field):
     :return:
     """
 
-    jp_parsing = parse(path_field)
-    result = jp_parsing.find(e_item)
-    sort_date = [match.value for match in result]
+    sort_date = compile_path(path_field).find(e_item)
 
     if sort_date:
         return sort_date[0:10]
@@ -819,54 +816,18 @@ def sort_date(entries, resource_spec=None):
 
 def filter_unique(entries, resource):
     """
-    if unique in resource then use jsonpath to check field
+    if unique in resource then keep the first entry for each value
+    of the jsonpaths it lists (see dedup.py)
 
     :param entries:
     :param resource:
-    :return filtered_entries:
+    :return: {'entry': filtered_entries, 'folded': number of duplicates left out}
 
     """
 
-    if 'unique' not in resource:
-        # nothing to filter
-        return {'entry': entries}
-
-    if len(resource['unique']) > 0:
-        unique = resource['unique'][0]
-    else:
-        # nothing defined in resource['unique'] which would be a list
-        return {'entry': entries}
-    # We have something to check
-    # We will add the retrieved field value to found and use to check whether we have seen this record before
-    found = []
-    filtered_entries = []
-
-    for e in entries:
-        # print("resource:", e['resourceType'], ", id:", e['id'])
-        jp_parsing = parse(unique)
-        result = jp_parsing.find(e)
-        # print("Result:", unique, ":", result)
-        results = [match.value for match in result]
-        if len(results) > 0:
-            matched_on = results[0]
-        else:
-            matched_on = None
-        # print("RESULTS:", matched_on)
-
-        if matched_on:
-            if matched_on in found:
-                # we have seen result before so skip it
-                # print("filtered out id:", e['id'])
-                pass
-            else:
-                # we haven't seen this result before
-                # print("filtered in ", e['id'])
-                filtered_entries.append(e)
-                found.append(matched_on)
-        else:
-            # we didn't find the value based on the unique test so we add it to filtered_entries
-            # print("no match for ", unique, " in ", e['id'])
-            filtered_entries.append(e)
+    if not resource.get('unique'):
+        # nothing to filter (nothing defined in resource['unique'] which would be a list)
+        return {'entry': entries, 'folded': 0}
 
-    # print("changed from ", len(entries), " to ", len(filtered_entries))
-    return {'entry': filtered_entries}
+    filtered_entries, folded = dedupe(entries, resource['unique'])
+    return {'entry': filtered_entries, 'folded': folded}
@@ -0,0 +1,177 @@
+# Member data jobs, queued in the database
+#
+# Refreshing a member's data asks sharemyhealth to pull it from the HIE again,
+# which can take tens of seconds. Rather than holding a web worker for that,
+# refresh_member_data queues a MemberDataRefresh and returns; a worker process
+# (`manage.py run_member_data_jobs`) runs the queued jobs and records their
+# status, which the records and timeline pages poll.
+#
+# The same queue warms the cache (refresh=False): when an organization is
+# granted access to a member's data, or a member connects, their data is
+# fetched in the background so that the first view of it is not a cold fetch.
+import contextlib
+import logging
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+
+from .models import (
+    REFRESH_ACTIVE_STATUSES,
+    REFRESH_DONE,
+    REFRESH_FAILED,
+    REFRESH_FETCHING,
+    REFRESH_QUEUED,
+    MemberDataRefresh,
+)
+from .utils import fetch_member_data
+
+logger = logging.getLogger('smhapp_.%s' % __name__)
+
+
+def enqueue_refresh(member, provider='sharemyhealth', refresh=True):
+    """
+    Queue a refresh of the member's data, unless one is already queued or running
+    :param member: User
+    :param provider: provider name
+    :param refresh: ask the provider to refresh the data from the HIE (else
+        only fetch the data if it is not fresh in the cache)
+    :return: MemberDataRefresh (the new job, or the one already queued)
+    """
+    job = MemberDataRefresh.objects.active().filter(member=member, provider=provider).last()
+    if job is not None and refresh and not job.refresh:
+        # a refresh asked for while a warm-up is active: make it a refresh if
+        # it has not started yet, else queue the refresh after it
+        if MemberDataRefresh.objects.filter(pk=job.pk, status=REFRESH_QUEUED).update(refresh=True):
+            job.refresh = True
+        else:
+            job = None
+    if job is None:
+        try:
+            with transaction.atomic():
+                job = MemberDataRefresh.objects.create(member=member, provider=provider, refresh=refresh)
+        except IntegrityError:
+            # another request queued one meanwhile (there is at most one
+            # queued job per member and provider): use that one
+            return enqueue_refresh(member, provider, refresh)
+    return job
+
+
+def enqueue_warm_up(member, provider='sharemyhealth'):
+    """
+    Queue a fetch of the member's data into the cache, unless a job for it is
+    already queued or running
+    :param member: User
+    :param provider: provider name
+    :return: MemberDataRefresh
+    """
+    return enqueue_refresh(member, provider, refresh=False)
+
+
+def claim_next_refresh():
+    """
+    Claim the oldest queued job for this worker. The claim is a conditional
+    update, so two workers never run the same job, on any database.
+    :return: MemberDataRefresh | None
+    """
+    for job in MemberDataRefresh.objects.filter(status=REFRESH_QUEUED).order_by('created')[:10]:
+        now = timezone.now()
+        claimed = MemberDataRefresh.objects.filter(pk=job.pk, status=REFRESH_QUEUED).update(
+            status=REFRESH_FETCHING, started=now, updated=now
+        )
+        if claimed:
+            job.refresh_from_db()
+            return job
+    return None
+
+
+def set_status(job, status, **fields):
+    """
+    Record the job's status (and other fields)
+    :param job: MemberDataRefresh
+    :param status: one of the REFRESH_ statuses
+    """
+    job.status = status
+    for name, value in fields.items():
+        setattr(job, name, value)
+    job.save(update_fields=['status', 'updated'] + list(fields))
+
+
+@contextlib.contextmanager
+def heartbeat(job):
+    """
+    Update the running job every MEMBER_DATA_JOB_HEARTBEAT seconds, however
+    long the fetch takes (e.g. many pages), so that it is not taken for abandoned
+    :param job: MemberDataRefresh
+    """
+    stopped = threading.Event()
+
+    def beat():
+        try:
+            while not stopped.wait(settings.MEMBER_DATA_JOB_HEARTBEAT):
+                MemberDataRefresh.objects.filter(pk=job.pk, status__in=REFRESH_ACTIVE_STATUSES).update(
+                    updated=timezone.now())
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=beat, name='member-data-job-heartbeat', daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stopped.set()
+        thread.join()
+
+
+def run_refresh(job):
+    """
+    Run a claimed job: fetch the member's data (which replaces the cached
+    data), or for a warm-up, fetch it only if it is not fresh in the cache
+    :param job: MemberDataRefresh, claimed by claim_next_refresh()
+    :return: job
+    """
+    def progress(status):
+        set_status(job, status)
+
+    try:
+        with heartbeat(job):
+            if job.refresh:
+                result = fetch_member_data(job.member, job.provider, refresh=True, progress=progress)
+            else:
+                result = fetch_member_data.warm(job.member, job.provider, progress=progress)[0]
+    except Exception as e:
+        logger.exception('member data refresh %s failed', job.pk)
+        result = {'error': 'Could not access member data. [%s]' % e.__class__.__name__}
+
+    if 'fhir_data' in result:
+        set_status(job, REFRESH_DONE, finished=timezone.now(),
+                   resource_count=len(result['fhir_data']))
+    else:
+        set_status(job, REFRESH_FAILED, finished=timezone.now(),
+                   error=result.get('error') or 'Not connected to %s' % job.provider)
+    return job
+
+
+def fail_abandoned_refreshes():
+    """
+    Fail the running jobs whose worker stopped (no heartbeat for four heartbeats)
+    :return: number of jobs failed
+    """
+    now = timezone.now()
+    cutoff = now - timedelta(seconds=settings.MEMBER_DATA_JOB_HEARTBEAT * 4)
+    return MemberDataRefresh.objects.active().exclude(status=REFRESH_QUEUED).filter(
+        updated__lt=cutoff
+    ).update(status=REFRESH_FAILED, finished=now, updated=now, error='The refresh was interrupted.')
+
+
+def run_next_refresh():
+    """
+    Claim and run the oldest queued job, if there is one
+    :return: the job that was run, or None
+    """
+    job = claim_next_refresh()
+    if job is not None:
+        run_refresh(job)
+    return job
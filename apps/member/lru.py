@@ -0,0 +1,125 @@
+# In-process LRU of decoded member data, within a byte budget
+#
+# Every read of cached member data decodes the entry from the shared cache
+# (see codec.py), which takes milliseconds for a large bundle. Each worker
+# therefore keeps the member data it decoded last, so that the pages a member
+# (or an org agent) goes through don't decode the same bundle over and over.
+# Bundles vary from kilobytes to tens of megabytes, so the LRU is bounded by
+# the (estimated) size of the decoded data, not the number of entries: an
+# agent paging through hundreds of members evicts the least recently used
+# bundles instead of growing the worker until it is killed.
+#
+# An entry is only served for the exact shared-cache entry it was decoded
+# from (its version), so an entry replaced or invalidated by another worker is
+# decoded again. The decoded data is shared by the worker's requests: it must
+# not be modified.
+#
+# Only the decoded data is counted against the budget. The indexes derived
+# from a bundle (fhir_index.derived(), e.g. its reference graph) are kept as
+# long as the bundle is, uncounted: about a tenth more for the test bundles.
+# With MEMBER_DATA_CACHE_CODEC = 'pickle' the LRU is not used at all, since
+# the cache backend unpickles a new copy of the data on every read.
+#
+# Every STATS_LOG_INTERVAL lookups, the worker logs the LRU's stats().
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger('smhapp_.%s' % __name__)
+
+STATS_LOG_INTERVAL = 1000
+
+
+class ByteBudgetLRU(object):
+    """Least recently used entries, evicted once their sizes add up to more than max_bytes"""
+
+    def __init__(self, max_bytes, log_interval=STATS_LOG_INTERVAL):
+        """
+        :param max_bytes: the byte budget (0: keep nothing)
+        :param log_interval: log the stats every log_interval lookups (0: never)
+        """
+        self.max_bytes = max_bytes
+        self.log_interval = log_interval
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, version):
+        """
+        :param key: cache key
+        :param version: the version of the value wanted
+        :return: the value stored for key at version, or None
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                value = None
+            else:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                value = entry[1]
+            log = self.log_interval and (self.hits + self.misses) % self.log_interval == 0
+        if log:
+            logger.info('member data LRU: %s', self.stats())
+        return value
+
+    def set(self, key, version, value, size):
+        """
+        Store value, evicting the least recently used entries beyond the budget
+        :param key: cache key
+        :param version: the version of value
+        :param value: the value
+        :param size: its size in bytes (measured or estimated)
+        :return: whether value was stored (a value bigger than the budget is not)
+        """
+        with self.lock:
+            self._discard(key)
+            if size > self.max_bytes:
+                return False
+            self.entries[key] = (version, value, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                evicted_key, (_, _, evicted_size) = self.entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+                logger.debug('evicted %s (%d bytes) from the member data LRU', evicted_key, evicted_size)
+            return True
+
+    def discard(self, key):
+        """Remove key, if it is stored"""
+        with self.lock:
+            self._discard(key)
+
+    def _discard(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[2]
+
+    def clear(self):
+        """Remove every entry (the counters are kept)"""
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        """
+        :return: dict of the entries, bytes, budget, hits, misses, evictions and hit ratio
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': round(self.hits / lookups, 3) if lookups else None,
+            }
@@ -0,0 +1,33 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand
+
+from apps.member import accessors
+from apps.member.management.commands.member_data_codec import FIXTURES
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare finding the record profile and timeline jsonpaths in FHIR bundles by parsing '
+        'them for each resource, and with the compiled accessors; report as JSON'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'files', nargs='*',
+            help='Bundle JSON files, or member data JSON files (default: the test bundles)',
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=1,
+            help='Timings are the best of this many runs (default: 1)',
+        )
+
+    def handle(self, *args, **options):
+        report = {}
+        for path in options['files'] or FIXTURES:
+            with open(path) as f:
+                data = json.load(f)
+            bundle = data.get('fhir_data', data)
+            report[os.path.basename(path)] = accessors.measure([bundle], options['repeat'])
+        self.stdout.write(json.dumps(report, indent=2))
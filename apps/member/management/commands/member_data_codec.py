@@ -0,0 +1,75 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand
+
+from apps.member import codec
+from apps.member.fhir_index import BundleIndex
+from apps.member.models import MemberBundleSnapshot
+from apps.member.snapshots import decode_member_data
+
+FIXTURES = [
+    os.path.join(os.path.dirname(codec.__file__), 'tests', name)
+    for name in ['anon_fhir.json', 'madigan_fhir.json']
+]
+
+
+class Command(BaseCommand):
+    help = (
+        'Report the size and speed of the member data cache encoding on FHIR bundles, as JSON, '
+        'or (--train) rebuild its preset dictionary from them'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'files', nargs='*',
+            help='Bundle JSON files, or member data JSON files (default: the test bundles)',
+        )
+        parser.add_argument(
+            '--snapshots', type=int, default=0,
+            help='Also report on this many of the stored member bundle snapshots',
+        )
+        parser.add_argument(
+            '--by-type', action='store_true',
+            help='Report on the resources of each type, as fetch_member_resources() caches them',
+        )
+        parser.add_argument(
+            '--train', action='store_true',
+            help='Write a new dictionary trained on the files to %s' % codec.DICTIONARY_PATH,
+        )
+        parser.add_argument(
+            '--size', type=int, default=codec.DICTIONARY_SIZE,
+            help='Dictionary size in bytes (default: %d)' % codec.DICTIONARY_SIZE,
+        )
+
+    def handle(self, *args, **options):
+        results = {}
+        for path in options['files'] or FIXTURES:
+            with open(path) as f:
+                data = json.load(f)
+            if 'fhir_data' not in data:
+                data = {'fhir_data': data}
+            data['fhir_data'] = BundleIndex.of(data['fhir_data'])
+            results[os.path.basename(path)] = data
+        snapshots = MemberBundleSnapshot.objects.order_by('-updated')[:options['snapshots']]
+        for snapshot in snapshots if options['snapshots'] else []:
+            results['snapshot %s' % snapshot.pk] = decode_member_data(snapshot.data)
+
+        if options['train']:
+            zdict = codec.train_dictionary(
+                [data['fhir_data'] for data in results.values()], options['size'])
+            with open(codec.DICTIONARY_PATH, 'wb') as f:
+                f.write(zdict)
+            codec.load_dictionary.cache_clear()
+            self.stderr.write('wrote %d bytes to %s' % (len(zdict), codec.DICTIONARY_PATH))
+
+        if options['by_type']:
+            for name, data in list(results.items()):
+                for resource_type in sorted(data['fhir_data'].counts()):
+                    index = BundleIndex()
+                    for resource in data['fhir_data'].resources([resource_type]):
+                        index.add(resource)
+                    results['%s %s' % (name, resource_type)] = dict(data, fhir_data=index)
+
+        report = {name: codec.measure(data) for name, data in results.items()}
+        self.stdout.write(json.dumps(report, indent=2))
@@ -0,0 +1,53 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from apps.member.cache import member_data_memory
+from apps.member.prewarm import prewarm_candidates, prewarm_member_data
+
+
+class Command(BaseCommand):
+    help = (
+        'Fetch the data of the connected members (those who granted an organization '
+        'access first) into the member data cache, e.g. before clinic hours'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--provider', default='sharemyhealth',
+            help='The data provider (default: sharemyhealth)',
+        )
+        parser.add_argument(
+            '--granted-only', action='store_true',
+            help='Only the members who granted an organization access to their data',
+        )
+        parser.add_argument(
+            '--limit', type=int,
+            help='Prewarm at most this many members',
+        )
+        parser.add_argument(
+            '--workers', type=int, default=4,
+            help='Threads fetching at once (default: 4)',
+        )
+        parser.add_argument(
+            '--concurrency', type=int, default=2,
+            help='Requests in flight at once to the data provider (default: 2)',
+        )
+        parser.add_argument(
+            '--rate', type=float,
+            help='Requests started per second (default: no limit)',
+        )
+
+    def handle(self, *args, **options):
+        members = prewarm_candidates(options['provider'], granted_only=options['granted_only'])
+        if options['limit'] is not None:
+            members = members[:options['limit']]
+        stats = prewarm_member_data(
+            options['provider'],
+            members=members,
+            workers=options['workers'],
+            concurrency=options['concurrency'],
+            rate=options['rate'],
+        )
+        # this process's LRU of decoded member data, filled by the fetches
+        self.stdout.write(json.dumps(dict(stats.as_dict(), memory=member_data_memory.stats()), indent=2))
@@ -0,0 +1,37 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+
+from apps.member.jobs import fail_abandoned_refreshes, run_next_refresh
+
+logger = logging.getLogger('smhapp_.%s' % __name__)
+
+
+class Command(BaseCommand):
+    help = 'Run the queued member data jobs (refreshes), polling the database for new ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Run the jobs that are queued now, then exit',
+        )
+        parser.add_argument(
+            '--interval', type=float, default=2.0,
+            help='Seconds to wait between polls when the queue is empty (default: 2)',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            failed = fail_abandoned_refreshes()
+            if failed:
+                logger.warning('%d interrupted member data refreshes marked failed', failed)
+
+            job = run_next_refresh()
+            if job is not None:
+                self.stdout.write('%s: %s' % (job, job.error or job.resource_count))
+                continue
+
+            if options['once']:
+                break
+            time.sleep(options['interval'])
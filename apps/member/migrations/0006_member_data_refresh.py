@@ -0,0 +1,36 @@
+# Generated by Django 3.0.4 on 2026-10-18 13:01
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('member', '0005_auto_20191208_1745'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MemberDataRefresh',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('provider', models.CharField(default='sharemyhealth', max_length=255)),
+                ('refresh', models.BooleanField(default=True, help_text='Ask the data provider to refresh the data from the HIE')),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('fetching', 'Fetching'), ('indexing', 'Indexing'), ('done', 'Done'), ('failed', 'Failed')], db_index=True, default='queued', max_length=10)),
+                ('started', models.DateTimeField(blank=True, null=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('resource_count', models.PositiveIntegerField(blank=True, null=True)),
+                ('error', models.TextField(blank=True, default='')),
+                ('member', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='member_data_refreshes', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'Member Data Refreshes',
+                'ordering': ['created'],
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 3.0.4 on 2026-10-18 13:05
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('member', '0006_member_data_refresh'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MemberBundleSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('provider', models.CharField(default='sharemyhealth', max_length=255)),
+                ('data', models.BinaryField(help_text='The member data response, as compressed JSON')),
+                ('sha256', models.CharField(help_text='Hash of the uncompressed JSON', max_length=64)),
+                ('size', models.PositiveIntegerField(default=0, help_text='Size of the uncompressed JSON')),
+                ('resource_count', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.CharField(blank=True, default='', help_text="The data provider's updated_at for the data", max_length=255)),
+                ('etag', models.CharField(blank=True, default='', max_length=255)),
+                ('last_modified', models.CharField(blank=True, default='', max_length=255)),
+                ('fetched', models.DateTimeField(help_text='When the data provider last sent or confirmed (304) this data')),
+                ('member', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bundle_snapshots', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('member', 'provider')},
+            },
+        ),
+    ]
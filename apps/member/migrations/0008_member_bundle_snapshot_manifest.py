@@ -0,0 +1,18 @@
+# Generated by Django 3.0.4 on 2026-10-18 13:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('member', '0007_member_bundle_snapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='memberbundlesnapshot',
+            name='manifest',
+            field=models.BinaryField(default=b'', help_text='Compressed JSON of {"resourceType/id": version} for the resources'),
+        ),
+    ]
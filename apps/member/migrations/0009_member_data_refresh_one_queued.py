@@ -0,0 +1,17 @@
+# Generated by Django 3.0.4 on 2026-10-18 14:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('member', '0008_member_bundle_snapshot_manifest'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='memberdatarefresh',
+            constraint=models.UniqueConstraint(condition=models.Q(status='queued'), fields=('member', 'provider'), name='one_queued_refresh_per_member'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.0.4 on 2026-10-18 14:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('member', '0009_member_data_refresh_one_queued'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FlightLock',
+            fields=[
+                ('key', models.CharField(help_text='Hash of the flight key', max_length=64, primary_key=True, serialize=False)),
+                ('token', models.CharField(help_text='Identifies the holder', max_length=32)),
+                ('expires', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,141 @@
+from django.conf import settings
+from django.db import models
+
+from apps.common.models import CreatedUpdatedModel
+
+REFRESH_QUEUED = 'queued'
+REFRESH_FETCHING = 'fetching'
+REFRESH_INDEXING = 'indexing'
+REFRESH_DONE = 'done'
+REFRESH_FAILED = 'failed'
+REFRESH_STATUSES = [
+    (REFRESH_QUEUED, 'Queued'),
+    (REFRESH_FETCHING, 'Fetching'),
+    (REFRESH_INDEXING, 'Indexing'),
+    (REFRESH_DONE, 'Done'),
+    (REFRESH_FAILED, 'Failed'),
+]
+REFRESH_ACTIVE_STATUSES = [REFRESH_QUEUED, REFRESH_FETCHING, REFRESH_INDEXING]
+
+
+class MemberDataRefreshQuerySet(models.QuerySet):
+
+    def active(self):
+        """Refreshes that are queued or running"""
+        return self.filter(status__in=REFRESH_ACTIVE_STATUSES)
+
+
+class MemberDataRefresh(CreatedUpdatedModel, models.Model):
+    """
+    A refresh of a member's data from a data provider, queued in the database
+    and run by `manage.py run_member_data_jobs` (see apps.member.jobs).
+    """
+
+    member = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='member_data_refreshes',
+    )
+    provider = models.CharField(max_length=255, default='sharemyhealth')
+    refresh = models.BooleanField(
+        default=True,
+        help_text='Ask the data provider to refresh the data from the HIE',
+    )
+    status = models.CharField(
+        max_length=10, choices=REFRESH_STATUSES, default=REFRESH_QUEUED, db_index=True
+    )
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+    resource_count = models.PositiveIntegerField(null=True, blank=True)
+    error = models.TextField(blank=True, default='')
+
+    objects = MemberDataRefreshQuerySet.as_manager()
+
+    def __str__(self):
+        return "{} refresh for {} ({})".format(self.provider, self.member, self.status)
+
+    @property
+    def active(self):
+        return self.status in REFRESH_ACTIVE_STATUSES
+
+    def as_dict(self):
+        """The job's status, for the polling endpoint"""
+        return {
+            'id': self.id,
+            'provider': self.provider,
+            'status': self.status,
+            'status_display': self.get_status_display(),
+            'active': self.active,
+            'created': self.created.isoformat() if self.created else None,
+            'updated': self.updated.isoformat() if self.updated else None,
+            'finished': self.finished.isoformat() if self.finished else None,
+            'resource_count': self.resource_count,
+            'error': self.error,
+        }
+
+    class Meta:
+        ordering = ['created']
+        verbose_name_plural = "Member Data Refreshes"
+        constraints = [
+            # concurrent requests can't queue a member's refresh twice
+            models.UniqueConstraint(
+                fields=['member', 'provider'],
+                condition=models.Q(status=REFRESH_QUEUED),
+                name='one_queued_refresh_per_member',
+            ),
+        ]
+
+
+class MemberBundleSnapshot(CreatedUpdatedModel, models.Model):
+    """
+    The last member data (FHIR bundle) fetched for a member from a data
+    provider, compressed, with the validators needed to re-fetch it
+    conditionally (see apps.member.snapshots). Holds PHI: it is deleted when
+    the member disconnects or reconnects.
+    """
+
+    member = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='bundle_snapshots',
+    )
+    provider = models.CharField(max_length=255, default='sharemyhealth')
+    data = models.BinaryField(help_text='The member data response, as compressed JSON')
+    sha256 = models.CharField(max_length=64, help_text='Hash of the uncompressed JSON')
+    manifest = models.BinaryField(
+        default=b'', help_text='Compressed JSON of {"resourceType/id": version} for the resources'
+    )
+    size = models.PositiveIntegerField(default=0, help_text='Size of the uncompressed JSON')
+    resource_count = models.PositiveIntegerField(default=0)
+    updated_at = models.CharField(
+        max_length=255, blank=True, default='',
+        help_text="The data provider's updated_at for the data",
+    )
+    etag = models.CharField(max_length=255, blank=True, default='')
+    last_modified = models.CharField(max_length=255, blank=True, default='')
+    fetched = models.DateTimeField(
+        help_text='When the data provider last sent or confirmed (304) this data'
+    )
+
+    def __str__(self):
+        return "{} snapshot for {} ({} resources)".format(
+            self.provider, self.member, self.resource_count
+        )
+
+    class Meta:
+        unique_together = [('member', 'provider')]
+
+
+class FlightLock(models.Model):
+    """
+    The lock of a single-flight call (see apps.member.singleflight): the worker
+    that inserted the row computes the result for its key, while the others
+    wait for it, until it deletes the row or the row expires.
+    """
+
+    key = models.CharField(max_length=64, primary_key=True, help_text='Hash of the flight key')
+    token = models.CharField(max_length=32, help_text='Identifies the holder')
+    expires = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return "flight lock {} until {}".format(self.key, self.expires)
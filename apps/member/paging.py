@@ -0,0 +1,113 @@
+# Paged member data bundles
+#
+# A member with a long history may get their $everything bundle in pages:
+# each page links to the next one (link[relation=next]). When the next link
+# is an offset into a result set whose size the first page gave (total), the
+# URLs of all the remaining pages are known at once, and they are fetched
+# concurrently; otherwise the next links are followed one at a time. Either
+# way the pages are merged into the first page's index in order, each as soon
+# as it (and the pages before it) has arrived.
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl, urlencode, urljoin, urlsplit, urlunsplit
+
+from django.conf import settings
+
+from smh_app import upstream
+
+from .fhir_stream import iter_response_text, parse_page
+
+logger = logging.getLogger('smhapp_.%s' % __name__)
+
+# query parameters that servers page result sets with (HAPI: _getpagesoffset)
+OFFSET_PARAMS = ['_getpagesoffset', '_offset', 'offset']
+
+# threads that fetch the pages of paged bundles
+page_fetcher = ThreadPoolExecutor(
+    max_workers=settings.MEMBER_DATA_PAGE_WORKERS,
+    thread_name_prefix='member-data-pages',
+)
+
+
+def offset_page_urls(next_url, total, page_size):
+    """
+    The URLs of all the remaining pages, if next_url pages by offset
+    :param next_url: the first page's next link
+    :param total: the number of resources in all the pages, or None
+    :param page_size: resources per page
+    :return: list of URLs, or None if they can't be worked out
+    """
+    parts = urlsplit(next_url)
+    query = parse_qsl(parts.query, keep_blank_values=True)
+    params = dict(query)
+    offset_param = next((name for name in OFFSET_PARAMS if name in params), None)
+    if offset_param is None or not total or not page_size:
+        return None
+    try:
+        offset = int(params[offset_param])
+        page_size = int(params.get('_count') or page_size)
+    except ValueError:
+        return None
+    return [
+        urlunsplit(parts._replace(query=urlencode(
+            [(name, str(page_offset) if name == offset_param else value) for name, value in query]
+        )))
+        for page_offset in range(offset, total, page_size)
+    ]
+
+
+def fetch_page(url, headers):
+    """
+    :param url: URL of a page
+    :param headers: request headers (Authorization)
+    :return: BundleIndex of the page
+    Raises upstream.RequestException if the page could not be fetched.
+    """
+    r = upstream.get(url, headers=headers, stream=True)
+    try:
+        r.raise_for_status()
+        return parse_page(iter_response_text(r))
+    finally:
+        r.close()
+
+
+def fetch_remaining_pages(index, url, headers, max_pages=None):
+    """
+    Fetch the pages after the first one and merge them into its index
+    :param index: BundleIndex of the first page
+    :param url: URL of the first page (next links may be relative to it)
+    :param headers: request headers (Authorization)
+    :param max_pages: stop after this many pages (default: settings.MEMBER_DATA_MAX_PAGES)
+    :return: number of pages fetched (after the first)
+    Raises upstream.RequestException or ValueError if a page could not be
+    fetched or parsed: a bundle with pages missing is not the member's data.
+    """
+    if max_pages is None:
+        max_pages = settings.MEMBER_DATA_MAX_PAGES
+    next_url = index.link('next')
+    if not next_url:
+        return 0
+    next_url = urljoin(url, next_url)
+    # the merged index is the whole bundle, with no pages left to link to
+    index.links = []
+
+    page_urls = offset_page_urls(next_url, index.total, len(index))
+    if page_urls is not None:
+        page_urls = page_urls[:max_pages]
+        logger.debug('fetching %d pages of %s concurrently', len(page_urls), url)
+        futures = [page_fetcher.submit(fetch_page, page_url, headers) for page_url in page_urls]
+        try:
+            for future in futures:
+                index.merge(future.result())
+        finally:
+            for future in futures:
+                future.cancel()
+        return len(page_urls)
+
+    pages = 0
+    while next_url and pages < max_pages:
+        page = fetch_page(next_url, headers)
+        index.merge(page)
+        pages += 1
+        next_url = page.link('next') and urljoin(next_url, page.link('next'))
+    return pages
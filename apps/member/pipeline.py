@@ -2,6 +2,23 @@ from django.shortcuts import reverse
 
 from apps.notifications.models import Notification
 
+from .cache import evict_member_data
+from .jobs import enqueue_warm_up
+from .snapshots import delete_snapshots
+
+
+def reset_member_data(backend, user, *args, **kwargs):
+    """On (re)connect, drop cached data, failures and snapshots, so the new connection is fetched"""
+    if backend.name in ['sharemyhealth']:
+        evict_member_data(user, backend.name)
+        delete_snapshots(user, backend.name)
+
+
+def warm_member_data(backend, user, *args, **kwargs):
+    """On connect, fetch the member's data in the background, so their first view of it is warm"""
+    if backend.name in ['sharemyhealth']:
+        enqueue_warm_up(user, backend.name)
+
 
 def connection_notifications(backend, user, response, *args, **kwargs):
     if backend.name in ['sharemyhealth']:
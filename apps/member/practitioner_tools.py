@@ -1,33 +1,21 @@
-from .fhir_utils import add_key
+from .dedup import dedupe
+from .encounters import EncounterIndex
 # from jsonpath_ng import parse
 
 
 def practitioner_encounter(practitioner, encounter):
     """
+    Add the dates and locations of their encounters to practitioners
+    (see encounters.EncounterIndex.annotate)
 
-    :param practitioner:
+    :param practitioner: list of Practitioner resources (modified)
+    :param encounter: list of Encounter resources, or their EncounterIndex
     :return: practitioner
     """
-    # print("P", len(practitioner))
-    # print("E", len(encounter))
+    if not isinstance(encounter, EncounterIndex):
+        encounter = EncounterIndex(encounter)
     for p in practitioner:
-        p = add_key(p, [("earliestDate", str), ("latestDate", str), ("location", list)])
-
-        for e in encounter:
-            # run through encounters and find match on practitioner.id or location.id
-            participant = get_participant(e)
-            location = get_location(e)
-            active_date = get_start(e)
-
-            if 'id' in participant:
-                if participant['id'] == p['id']:
-                    # print("matched on:", participant, "\nid:", p)
-                    if active_date > p['latestDate']:
-                        p['latestDate'] = active_date[0:10]
-                    if active_date < p['earliestDate']:
-                        p['earliestDate'] = active_date[0:10]
-
-                    p['location'].append(location)
+        encounter.annotate(p)
     return practitioner
 
 
@@ -90,30 +78,7 @@ def sort_extended_practitioner(practitioner):
     sort on date latestDate
     Then alpha on other practitioners
     :param practitioner:
-    :return: practitioner
+    :return: practitioner, the first of each id
     """
 
-    uniques = []
-    for p in practitioner:
-        if find_uniques(p, uniques):
-            uniques.append(p)
-    return uniques
-
-
-def find_uniques(p, uniques):
-    """
-
-    :param p:
-    :param uniques:
-    :return:
-    """
-    unique = True
-    for u in uniques:
-        if p['id'] == u['id'] and p['latestDate'] == u['latestDate'] and p['location'] == u['location']:
-            return False
-        elif p['id'] == u['id'] and p['location'] == u['location']:
-            return False
-        elif p['id'] == u['id']:
-            return False
-
-    return unique
+    return dedupe(practitioner, ['$.id'])[0]
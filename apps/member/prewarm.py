@@ -0,0 +1,184 @@
+# Pre-warming the member data cache
+#
+# The first view of a member's records fetches and indexes their whole bundle
+# from sharemyhealth, which takes seconds. Org agents go through many members
+# in a row, so before clinic hours `manage.py prewarm_member_data` fetches the
+# bundles of the members that organizations have been granted access to (and
+# of the other connected members), so those first views hit a warm cache.
+# Fetches run on a thread pool, with at most `concurrency` requests in flight
+# to each upstream host and at most `rate` requests started per second.
+import logging
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection
+from social_django.models import UserSocialAuth
+
+from apps.org.models import ResourceGrant
+from smh_app.breaker import OPEN, base_url, get_breaker
+
+from .utils import fetch_member_data
+
+logger = logging.getLogger('smhapp_.%s' % __name__)
+
+# outcomes of prewarming one member
+FRESH = 'fresh'  # already in the cache
+FETCHED = 'fetched'
+BACKING_OFF = 'backing off'  # a recent fetch failed
+UNAVAILABLE = 'unavailable'  # the host's circuit breaker is open
+FAILED = 'failed'  # error, or no data
+
+
+class FetchLimit(object):
+    """
+    Caps the concurrent fetches from one host, and spaces out their starts so
+    that at most rate of them start per second. Use as a context manager.
+    """
+
+    def __init__(self, concurrency, rate=None):
+        """
+        :param concurrency: fetches in flight at once
+        :param rate: fetches started per second (None: no limit)
+        """
+        self.semaphore = threading.BoundedSemaphore(concurrency)
+        self.interval = 1.0 / rate if rate else 0
+        self.next_start = time.monotonic()
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        self.semaphore.acquire()
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_start)
+            self.next_start = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.semaphore.release()
+
+
+class PrewarmStats(object):
+    """Outcomes, resource counts and timing of a prewarm run"""
+
+    def __init__(self):
+        self.outcomes = Counter()
+        self.resources = 0
+        self.fetch_seconds = 0.0
+        self.started = time.monotonic()
+        self.finished = None
+        self.lock = threading.Lock()
+
+    def add(self, outcome, resources=0, seconds=0.0):
+        with self.lock:
+            self.outcomes[outcome] += 1
+            self.resources += resources
+            if outcome in [FETCHED, FAILED]:
+                self.fetch_seconds += seconds
+
+    @property
+    def members(self):
+        return sum(self.outcomes.values())
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.monotonic()) - self.started
+
+    def as_dict(self):
+        fetches = self.outcomes[FETCHED] + self.outcomes[FAILED]
+        return {
+            'members': self.members,
+            **{outcome: self.outcomes[outcome] for outcome in [FRESH, FETCHED, BACKING_OFF, UNAVAILABLE, FAILED]},
+            'resources': self.resources,
+            'elapsed': round(self.elapsed, 2),
+            'members_per_second': round(self.members / self.elapsed, 2) if self.elapsed else None,
+            'average_fetch_seconds': round(self.fetch_seconds / fetches, 2) if fetches else None,
+        }
+
+    def __str__(self):
+        return ', '.join('%s: %s' % item for item in self.as_dict().items())
+
+
+def prewarm_candidates(provider='sharemyhealth', granted_only=False):
+    """
+    The active members who are connected to provider: those who granted an
+    organization access to their data first, then (unless granted_only) the others
+    :param provider: provider name
+    :param granted_only: only the members with resource grants
+    :return: list of User
+    """
+    granted = set(ResourceGrant.objects.values_list('member_id', flat=True))
+    social_auths = UserSocialAuth.objects.filter(
+        provider=provider, user__is_active=True
+    ).select_related('user').order_by('user_id')
+    members = [
+        social_auth.user
+        for social_auth in social_auths
+        if (social_auth.extra_data or {}).get('access_token')
+        and (social_auth.user_id in granted or not granted_only)
+    ]
+    members.sort(key=lambda member: member.pk not in granted)
+    return members
+
+
+def prewarm_member(member, provider, limit, stats):
+    """
+    Fetch the member's data into the cache, unless it is fresh there
+    :param member: User
+    :param provider: provider name
+    :param limit: FetchLimit of the provider's host
+    :param stats: PrewarmStats to add the outcome to
+    :return: the outcome
+    """
+    host = getattr(settings, 'SOCIAL_AUTH_%s_HOST' % provider.upper())
+    start = time.monotonic()
+    try:
+        if get_breaker(host).state() == OPEN:
+            outcome, result = UNAVAILABLE, {}
+        else:
+            result, fetched = fetch_member_data.warm(member, provider, limit=limit)
+            if not fetched:
+                outcome = FRESH if result.get('fhir_data') else BACKING_OFF
+            elif result.get('fhir_data') and not result.get('stale'):
+                outcome = FETCHED
+            else:
+                outcome = FAILED
+    except Exception:
+        logger.exception('prewarming %s data of %s failed', provider, member)
+        outcome, result = FAILED, {}
+    finally:
+        # each pool thread has its own connection
+        connection.close()
+    resources = len(result['fhir_data']) if outcome == FETCHED else 0
+    stats.add(outcome, resources, time.monotonic() - start)
+    logger.debug('prewarm %s %s: %s', provider, member, outcome)
+    return outcome
+
+
+def prewarm_member_data(provider='sharemyhealth', members=None, workers=4, concurrency=2, rate=None):
+    """
+    Fetch the data of many members into the member data cache. This is the
+    entry point for scheduled runs (see the prewarm_member_data command).
+    :param provider: provider name
+    :param members: the members to prewarm (default: prewarm_candidates(provider))
+    :param workers: threads fetching at once
+    :param concurrency: fetches in flight at once to the provider's host
+    :param rate: fetches started per second (None: no limit)
+    :return: PrewarmStats
+    """
+    if members is None:
+        members = prewarm_candidates(provider)
+    host = getattr(settings, 'SOCIAL_AUTH_%s_HOST' % provider.upper())
+    limit = FetchLimit(concurrency, rate)
+    stats = PrewarmStats()
+    logger.info('prewarming %s data of %d members from %s', provider, len(members), base_url(host))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='member-data-prewarm') as pool:
+        for member in members:
+            pool.submit(prewarm_member, member, provider, limit, stats)
+    stats.finished = time.monotonic()
+    logger.info('prewarmed %s data: %s', provider, stats)
+    return stats
@@ -0,0 +1,222 @@
+# Compiled record profiles, and per-request record summaries
+#
+# RECORDS_STU3 (constants.py) describes how each kind of record is fetched and
+# shown. The views used to look profiles up with find_index() on every
+# request, and wrote each member's records ('data', 'count') into the shared
+# profile dicts: with threaded workers one request could show another's
+# records, and the last member's PHI stayed in memory. The profiles are now
+# compiled once, at import, into read-only mappings (PROFILES) indexed by
+# slug, name and view, and a request's records go into RecordSummary objects
+# that wrap the profiles without changing them.
+#
+# The list pages summarize dozens of profiles at once. RecordBuckets sorts a
+# bundle's resources into the buckets of all of them in a single pass, copying
+# each resource once and splitting the Observations into vital signs and lab
+# results on the way, instead of looking up and copying the resources once per
+# profile (and the Observations twice more). The counts of each type come from
+# the BundleIndex.
+from collections.abc import Mapping
+from types import MappingProxyType
+
+from .constants import RECORDS_STU3, RESOURCES, VITALSIGNS
+from .fhir_index import BundleIndex
+from .fhir_utils import filter_unique
+
+
+def freeze(value):
+    """
+    :param value: decoded JSON-like data
+    :return: a read-only copy: dicts as MappingProxyType, lists as tuples
+    """
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+PROFILES = freeze(RECORDS_STU3)
+PROFILES_BY_SLUG = MappingProxyType({profile['slug']: profile for profile in PROFILES})
+PROFILES_BY_NAME = MappingProxyType({profile['name']: profile for profile in PROFILES})
+VIEW_PROFILES = MappingProxyType({
+    view: tuple(profile for profile in PROFILES if view in profile.get('views', ()))
+    for view in sorted({view for profile in PROFILES for view in profile.get('views', ())})
+})
+
+
+def get_profile(slug):
+    """
+    :param slug: a profile's slug, e.g. 'condition'
+    :return: the profile, or None
+    """
+    return PROFILES_BY_SLUG.get(slug)
+
+
+def view_profiles(view):
+    """
+    :param view: 'record', 'provider', ...
+    :return: the profiles shown in view, in RECORDS_STU3 order
+    """
+    return VIEW_PROFILES.get(view, ())
+
+
+class RecordSummary(Mapping):
+    """
+    A profile with a member's records of it, for one request. Reads like the
+    profile, plus 'data' (the records) and 'count', as the templates expect,
+    and 'folded' (the duplicates left out of them).
+    """
+
+    def __init__(self, profile, entries, folded=0):
+        """
+        :param profile: a profile from PROFILES
+        :param entries: the member's records of the profile
+        :param folded: the number of duplicate records left out of entries (on the profile's 'unique')
+        """
+        self.profile = profile
+        self.data = entries
+        self.count = len(entries)
+        self.folded = folded
+
+    def __getitem__(self, key):
+        if key == 'data':
+            return self.data
+        if key == 'count':
+            return self.count
+        if key == 'folded':
+            return self.folded
+        return self.profile[key]
+
+    def __iter__(self):
+        yield from self.profile
+        yield 'data'
+        yield 'count'
+        yield 'folded'
+
+    def __len__(self):
+        return len(self.profile) + 3
+
+    def __repr__(self):
+        return '<RecordSummary %s: %d>' % (self.profile['name'], self.count)
+
+
+VITAL_SIGN_CODES = frozenset(VITALSIGNS)
+# the Observation split of the 'custom' profiles: whether an Observation goes in, by vital_sign()
+CUSTOM_SPLITS = {'VitalSigns': True, 'LabResults': False}
+
+
+def vital_sign(observation):
+    """
+    :param observation: Observation resource
+    :return: whether its (first) code is a vital sign's (else it is a lab result)
+    """
+    try:
+        return observation['code']['coding'][0]['code'] in VITAL_SIGN_CODES
+    except (KeyError, IndexError, TypeError):
+        return False
+
+
+class RecordBuckets(object):
+    """
+    The resources of a bundle sorted into the buckets of several profiles, in
+    one pass. Each bucket holds shallow copies of the resources, in bundle
+    order, as get_converted_fhir_resource() returns them; a resource in
+    several buckets is the same copy.
+    """
+
+    def __init__(self, fhir_data, profiles, keep_resources=False):
+        """
+        :param fhir_data: BundleIndex or bundle dict
+        :param profiles: profiles from PROFILES, e.g. view_profiles('record')
+        :param keep_resources: also keep (copies of) all the resources of RESOURCES types, in .resources
+        """
+        self.profiles = tuple(profiles)
+        self.buckets = {}
+        # slug: the number of duplicates entries() left out
+        self.folded = {}
+        index = BundleIndex.of(fhir_data)
+        # the index counts the resources of each type already
+        self.counts = {t: n for t, n in index.counts().items() if t in RESOURCES}
+        self.resources = [] if keep_resources else None
+        # resourceType: [(bucket, None or the vital_sign() wanted), ...]
+        routes = {}
+        in_bundle_order = keep_resources
+        for profile in self.profiles:
+            call_type = profile['call_type'].lower()
+            if call_type == 'fhir':
+                split = None
+            elif call_type == 'custom' and profile['name'] in CUSTOM_SPLITS:
+                split = CUSTOM_SPLITS[profile['name']]
+            else:
+                continue
+            bucket = self.buckets[profile['slug']] = []
+            resource_types = [t for t in dict.fromkeys(profile['resources']) if t in RESOURCES]
+            # a bucket of several types must be filled in bundle order
+            in_bundle_order = in_bundle_order or len(resource_types) > 1
+            for resource_type in resource_types:
+                routes.setdefault(resource_type, []).append((bucket, split))
+
+        if not in_bundle_order:
+            # each bucket is of one type: go through the resources type by type
+            for resource_type, resource_routes in routes.items():
+                resources = [dict(resource) for resource in index.resources(resource_type)]
+                vital_signs = None
+                for bucket, split in resource_routes:
+                    if split is None:
+                        bucket.extend(resources)
+                        continue
+                    if vital_signs is None:
+                        vital_signs = [vital_sign(resource) for resource in resources]
+                    bucket.extend(resource for resource, is_vital_sign in zip(resources, vital_signs)
+                                  if is_vital_sign == split)
+            return
+
+        for resource in index.resources(None if keep_resources else list(routes)):
+            resource_type = resource.get('resourceType')
+            resource_routes = routes.get(resource_type)
+            if resource_routes is None and (self.resources is None or resource_type not in RESOURCES):
+                continue
+            resource = dict(resource)
+            if self.resources is not None:
+                self.resources.append(resource)
+            is_vital_sign = None
+            for bucket, split in resource_routes or ():
+                if split is not None:
+                    if is_vital_sign is None:
+                        is_vital_sign = vital_sign(resource)
+                    if is_vital_sign != split:
+                        continue
+                bucket.append(resource)
+
+    def entries(self, profile):
+        """
+        :param profile: one of the profiles
+        :return: the member's records of the profile (de-duplicated on 'unique'),
+            or None if it is not shown ('skip')
+        """
+        entries = self.buckets.get(profile['slug'])
+        if entries is not None and profile.get('unique'):
+            filtered = filter_unique(entries, profile)
+            entries = filtered['entry']
+            self.folded[profile['slug']] = filtered['folded']
+        return entries
+
+    def summaries(self):
+        """
+        :return: list of RecordSummary, one per profile that is shown
+        """
+        summaries = []
+        for profile in self.profiles:
+            entries = self.entries(profile)
+            if entries is not None:
+                summaries.append(RecordSummary(profile, entries, self.folded.get(profile['slug'], 0)))
+        return summaries
+
+
+def summarize_records(fhir_data, profiles):
+    """
+    :param fhir_data: BundleIndex
+    :param profiles: profiles from PROFILES, e.g. view_profiles('record')
+    :return: list of RecordSummary, one per profile that is shown
+    """
+    return RecordBuckets(fhir_data, profiles).summaries()
@@ -0,0 +1,177 @@
+# The references between a bundle's resources, both ways
+#
+# FHIR resources point at each other with References ({'reference':
+# 'Practitioner/12', 'display': ...}), anywhere in the resource: an
+# Encounter's participant.individual and location.location, a
+# MedicationRequest's medicationReference and requester.agent, ... The
+# BundleIndex resolves a reference by (resourceType, id), but nothing answered
+# the reverse question, "what references this Practitioner (or Location, or
+# Medication)?", short of walking every resource.
+#
+# The ReferenceGraph walks each resource once and keeps both directions: the
+# resources each one references (forward) and the resources referencing each
+# one (reverse), by 'Type/id'. Like the other indexes over a bundle it is built
+# once per bundle (reference_graph()), and shared: it must not be modified.
+# Local references ('#contained') and urn:uuid: references are not followed.
+from .fhir_index import BundleIndex, derived
+
+
+def reference_key(reference):
+    """
+    :param reference: 'Type/id' (possibly absolute, or versioned) string, or a Reference dict
+    :return: 'Type/id', or None
+    """
+    if isinstance(reference, dict):
+        reference = reference.get('reference')
+    if not isinstance(reference, str):
+        return None
+    parts = reference.split('/_history/')[0].split('/')
+    if len(parts) < 2 or not parts[-1]:
+        return None
+    return '/'.join(parts[-2:])
+
+
+def resource_key(resource):
+    """
+    :param resource: FHIR resource
+    :return: the 'Type/id' a reference to it has
+    """
+    return '%s/%s' % (resource.get('resourceType'), resource.get('id'))
+
+
+def key_of(resource_or_reference):
+    """
+    :param resource_or_reference: a resource, a reference string or a Reference dict
+    :return: 'Type/id', or None
+    """
+    if isinstance(resource_or_reference, dict) and 'resourceType' in resource_or_reference:
+        return resource_key(resource_or_reference)
+    return reference_key(resource_or_reference)
+
+
+def references_in(value, keys):
+    """
+    Collect the keys of the References in value
+    :param value: decoded JSON, e.g. a resource
+    :param keys: dict to add the 'Type/id' keys to (in the order found)
+    """
+    if isinstance(value, dict):
+        key = reference_key(value.get('reference'))
+        if key is not None:
+            keys[key] = None
+        for item in value.values():
+            if isinstance(item, (dict, list)):
+                references_in(item, keys)
+    elif isinstance(value, list):
+        for item in value:
+            if isinstance(item, (dict, list)):
+                references_in(item, keys)
+
+
+def reference_display(resource):
+    """
+    :param resource: FHIR resource
+    :return: a name for it: its name, code or type text, or its 'Type/id'
+    """
+    name = resource.get('name')
+    if isinstance(name, str):
+        return name
+    if isinstance(name, list) and name and isinstance(name[0], dict):
+        if name[0].get('text'):
+            return name[0]['text']
+        parts = list(name[0].get('given') or []) + [name[0].get('family') or '']
+        if any(parts):
+            return ' '.join(part for part in parts if part)
+    for field in ('code', 'type'):
+        concept = resource.get(field)
+        if isinstance(concept, list):
+            concept = concept[0] if concept else None
+        if isinstance(concept, dict):
+            if concept.get('text'):
+                return concept['text']
+            for coding in concept.get('coding') or ():
+                if coding.get('display'):
+                    return coding['display']
+    return resource_key(resource)
+
+
+class ReferenceGraph(object):
+    """'Type/id' -> the keys it references (forward), and the keys referencing it (reverse)"""
+
+    def __init__(self, fhir_data):
+        """
+        :param fhir_data: BundleIndex or bundle dict
+        """
+        self.index = BundleIndex.of(fhir_data)
+        self.forward = {}
+        self.reverse = {}
+        for resource in self.index:
+            keys = {}
+            references_in(resource, keys)
+            source = resource_key(resource)
+            keys.pop(source, None)
+            if keys:
+                self.forward[source] = tuple(keys)
+                for key in keys:
+                    self.reverse.setdefault(key, []).append(source)
+
+    def resolve(self, reference, default=None):
+        """
+        :param reference: reference string or Reference dict
+        :return: the resource it points at, or default
+        """
+        key = reference_key(reference)
+        if key is None:
+            return default
+        return self.index.get(*key.split('/'), default=default)
+
+    def resolved(self, keys, resource_types=None):
+        """
+        :param keys: 'Type/id' keys
+        :param resource_types: only resources of these types (default: all)
+        :return: list of the resources in the bundle
+        """
+        resources = []
+        for key in keys:
+            resource_type, id = key.split('/')
+            if resource_types is None or resource_type in resource_types:
+                resource = self.index.get(resource_type, id)
+                if resource is not None:
+                    resources.append(resource)
+        return resources
+
+    def references(self, resource_or_reference, resource_types=None):
+        """
+        :param resource_or_reference: a resource, a reference string or a Reference dict
+        :param resource_types: only resources of these types (default: all)
+        :return: list of the resources it references (that are in the bundle)
+        """
+        return self.resolved(self.forward.get(key_of(resource_or_reference), ()), resource_types)
+
+    def referenced_by(self, resource_or_reference, resource_types=None):
+        """
+        :param resource_or_reference: a resource, a reference string or a Reference dict
+        :param resource_types: only resources of these types (default: all)
+        :return: list of the resources that reference it, in bundle order
+        """
+        return self.resolved(self.reverse.get(key_of(resource_or_reference), ()), resource_types)
+
+    def display(self, reference):
+        """
+        :param reference: Reference dict or reference string
+        :return: its display, or the name of the resource it points at, or None if unresolved
+        """
+        if isinstance(reference, dict) and reference.get('display'):
+            return reference['display']
+        resource = self.resolve(reference)
+        if resource is None:
+            return None
+        return reference_display(resource)
+
+
+def reference_graph(fhir_data):
+    """
+    :param fhir_data: BundleIndex or bundle dict
+    :return: the ReferenceGraph of the bundle, built once per bundle
+    """
+    return derived(fhir_data, ReferenceGraph)
@@ -0,0 +1,169 @@
+# Single-flight coalescing of concurrent cache misses
+#
+# When a cached member bundle expires, every request for that member that
+# arrives before it is fetched again misses together, and each one would make
+# its own Patient/$everything call. SingleFlight lets one caller (the leader)
+# do the fetch while the others wait for it and use its result: threads in the
+# same process wait on the leader's thread, and other processes wait on a lock
+# and then read the result that the leader stored in the shared cache.
+#
+# The lock is only as good as its add(). The default member data cache is
+# file-based, whose add() is not atomic, so the locks are kept in the database
+# instead (DatabaseLocks): a lock is a FlightLock row, taken by inserting it,
+# which its primary key makes atomic on any database.
+import hashlib
+import logging
+import threading
+import time
+import uuid
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import FlightLock
+
+logger = logging.getLogger('smhapp_.%s' % __name__)
+
+
+class Call(object):
+    """A call in flight in this process"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class DatabaseLocks(object):
+    """
+    Locks in the database (FlightLock rows), with the add(), get() and
+    delete() of a cache. Not to be used inside a transaction, which would
+    hide the lock from the other workers until it commits.
+    """
+
+    def row_key(self, key):
+        """
+        :param key: lock key
+        :return: the FlightLock.key of the lock (a hash: keys can be long, or hold secrets)
+        """
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    def add(self, key, value, timeout):
+        """
+        Take the lock, unless another worker holds it
+        :param key: lock key
+        :param value: token of the holder
+        :param timeout: seconds before the lock expires
+        :return: whether the lock was taken
+        """
+        now = timezone.now()
+        # locks left by workers that died
+        FlightLock.objects.filter(expires__lte=now).delete()
+        try:
+            with transaction.atomic():
+                FlightLock.objects.create(
+                    key=self.row_key(key), token=value, expires=now + timedelta(seconds=timeout))
+        except IntegrityError:
+            return False
+        return True
+
+    def get(self, key, default=None):
+        """
+        :param key: lock key
+        :return: the token of the holder of the lock, or default if it is not held
+        """
+        token = FlightLock.objects.filter(
+            key=self.row_key(key), expires__gt=timezone.now()).values_list('token', flat=True).first()
+        return default if token is None else token
+
+    def delete(self, key):
+        """Release the lock"""
+        FlightLock.objects.filter(key=self.row_key(key)).delete()
+
+
+class SingleFlight(object):
+    """
+    Coalesce concurrent calls for the same key, within and across processes.
+
+    The locks must be shared by the processes, and their add() atomic:
+    DatabaseLocks, or a cache whose add() is (memcached, redis; not the
+    file-based cache, which at worst lets two processes fetch at once).
+    """
+
+    def __init__(self, locks, lock_timeout=120, wait_timeout=90, poll_interval=0.05):
+        """
+        :param locks: DatabaseLocks, or a shared Django cache (or proxy), that holds the locks
+        :param lock_timeout: seconds before a lock left by a dead leader expires
+        :param wait_timeout: seconds to wait for another leader before fetching anyway
+        :param poll_interval: first interval at which to poll another process' lock
+        """
+        self.locks = locks
+        self.lock_timeout = lock_timeout
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, load, compute):
+        """
+        Get the result for key, computing it at most once at a time per key.
+        :param key: cache key of the result
+        :param load: callable() -> the result stored in the cache, or None
+        :param compute: callable() -> the result; it must store the result
+            where load() finds it, if the result is to be shared with other processes
+        :return: the result
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Call()
+
+        if not leader:
+            if call.event.wait(self.wait_timeout):
+                if call.error is not None:
+                    raise call.error
+                return call.result
+            logger.warning('single-flight: gave up waiting for %s in this process', key)
+            return compute()
+
+        try:
+            call.result = self._do_shared(key, load, compute)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    def _do_shared(self, key, load, compute):
+        """Compute the result, or wait for the process that is computing it"""
+        lock_key = '%s:lock' % key
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + self.wait_timeout
+        while True:
+            if self.locks.add(lock_key, token, self.lock_timeout):
+                try:
+                    return compute()
+                finally:
+                    if self.locks.get(lock_key) == token:
+                        self.locks.delete(lock_key)
+
+            # another process is computing it: poll its (small) lock until it is
+            # released, then read the result that it stored
+            interval = self.poll_interval
+            while self.locks.get(lock_key) is not None:
+                if time.monotonic() >= deadline:
+                    logger.warning('single-flight: gave up waiting for %s', key)
+                    return compute()
+                time.sleep(interval)
+                interval = min(interval * 2, 1)
+
+            result = load()
+            if result is not None:
+                return result
+            # the other process did not store a result (its fetch failed):
+            # try to become the leader
@@ -0,0 +1,191 @@
+# Persistent snapshots of the member data fetched from sharemyhealth
+#
+# The cache only lives until an eviction, a deploy or a cache flush, after
+# which every member's bundle would be downloaded again in full. The last
+# bundle fetched for each member is therefore kept in the database, compressed
+# (MemberBundleSnapshot). Fetches send its validators (If-None-Match /
+# If-Modified-Since) and reuse it when the data provider answers 304 Not
+# Modified, and a snapshot confirmed within MEMBER_DATA_CACHE_TIMEOUT is used
+# without asking the data provider at all.
+import hashlib
+import json
+import logging
+import zlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.shortcuts import reverse
+from django.utils import timezone
+from django.utils.http import http_date
+
+from apps.data.util import parse_timestamp
+from apps.notifications.models import Notification
+
+from .codec import compress_json, iter_decompressed_text
+from .fhir_delta import diff_bundles
+from .fhir_stream import parse_member_data
+from .models import MemberBundleSnapshot
+
+logger = logging.getLogger('smhapp_.%s' % __name__)
+
+COMPRESSION_LEVEL = 6
+
+
+def encode_member_data(result):
+    """
+    Serialize member data to compressed JSON, without building the JSON text
+    as one string
+    :param result: member data, with 'fhir_data' as a BundleIndex or bundle dict
+    :return: (compressed bytes, sha256 hex digest of the JSON, size of the JSON)
+    """
+    digest = hashlib.sha256()
+    parts, size = compress_json(result, zlib.compressobj(COMPRESSION_LEVEL), digest)
+    return b''.join(parts), digest.hexdigest(), size
+
+
+def decode_member_data(data):
+    """
+    :param data: compressed JSON from encode_member_data()
+    :return: member data, with 'fhir_data' as a BundleIndex
+    """
+    return parse_member_data(iter_decompressed_text(bytes(data)))
+
+
+def encode_manifest(manifest):
+    """
+    :param manifest: {resource_key: resource_version}
+    :return: compressed JSON
+    """
+    return zlib.compress(json.dumps(manifest, separators=(',', ':')).encode('utf-8'), COMPRESSION_LEVEL)
+
+
+def decode_manifest(data):
+    """
+    :param data: compressed JSON from encode_manifest(), or b''
+    :return: {resource_key: resource_version}
+    """
+    if not data:
+        return {}
+    return json.loads(zlib.decompress(bytes(data)).decode('utf-8'))
+
+
+def get_snapshot(member, provider):
+    """
+    :return: the member's MemberBundleSnapshot from provider (data loaded on access), or None
+    """
+    return MemberBundleSnapshot.objects.filter(
+        member=member, provider=provider).defer('data', 'manifest').first()
+
+
+def is_fresh(snapshot):
+    """
+    :return: whether the snapshot was sent or confirmed within MEMBER_DATA_CACHE_TIMEOUT
+    """
+    max_age = timedelta(seconds=settings.MEMBER_DATA_CACHE_TIMEOUT)
+    return timezone.now() - snapshot.fetched < max_age
+
+
+def conditional_headers(snapshot):
+    """
+    :return: request headers that ask for the data only if it changed since the snapshot
+    """
+    headers = {}
+    if snapshot is not None:
+        if snapshot.etag:
+            headers['If-None-Match'] = snapshot.etag
+        if snapshot.last_modified:
+            headers['If-Modified-Since'] = snapshot.last_modified
+    return headers
+
+
+def last_modified(response, result):
+    """
+    :return: the response's Last-Modified, else the data's updated_at as an HTTP date, else ''
+    """
+    if response.headers.get('Last-Modified'):
+        return response.headers['Last-Modified']
+    updated_at = parse_timestamp(result.get('updated_at'))
+    if updated_at is not None:
+        return http_date(updated_at.timestamp())
+    return ''
+
+
+def save_snapshot(member, provider, result, response, snapshot=None):
+    """
+    Store member data that the data provider sent (200), and work out which
+    resources changed since the snapshot. The compressed data is only
+    rewritten when something changed.
+    :param member: User
+    :param provider: provider name
+    :param result: member data, with 'fhir_data'
+    :param response: the requests.Response it came in
+    :param snapshot: the member's current MemberBundleSnapshot, if any
+    :return: (MemberBundleSnapshot, BundleDelta from the previous snapshot, or None)
+    """
+    previous_manifest = decode_manifest(snapshot.manifest) if snapshot is not None else {}
+    delta, manifest = diff_bundles(previous_manifest, result['fhir_data'])
+    fields = {
+        'updated_at': result.get('updated_at') or '',
+        'etag': response.headers.get('ETag', ''),
+        'last_modified': last_modified(response, result),
+        'fetched': timezone.now(),
+    }
+
+    if snapshot is not None and not delta and snapshot.updated_at == fields['updated_at']:
+        # same data: only record the new validators
+        for name, value in fields.items():
+            setattr(snapshot, name, value)
+        snapshot.save(update_fields=list(fields) + ['updated'])
+        return snapshot, delta
+
+    data, sha256, size = encode_member_data(result)
+    fields.update(
+        data=data,
+        sha256=sha256,
+        size=size,
+        manifest=encode_manifest(manifest),
+        resource_count=len(result['fhir_data']),
+    )
+    snapshot, created = MemberBundleSnapshot.objects.update_or_create(
+        member=member, provider=provider, defaults=fields,
+    )
+    logger.debug('saved %s: %d bytes of JSON in %d, %r', snapshot, size, len(data), delta)
+    return snapshot, (None if created else delta)
+
+
+def confirm_snapshot(snapshot, response):
+    """
+    Record that the data provider confirmed the snapshot (304)
+    :param snapshot: MemberBundleSnapshot
+    :param response: the 304 requests.Response
+    """
+    snapshot.fetched = timezone.now()
+    snapshot.etag = response.headers.get('ETag', snapshot.etag)
+    snapshot.save(update_fields=['fetched', 'etag', 'updated'])
+
+
+def delete_snapshots(member, provider):
+    """Delete the member's snapshots from provider (they hold PHI)"""
+    MemberBundleSnapshot.objects.filter(member=member, provider=provider).delete()
+
+
+def member_data_notifications(member, provider, delta):
+    """
+    Tell the member which of their records the data provider added, changed
+    or removed. Called for the refreshes that the member asks for only:
+    changes found by a background refresh or a warm-up are not notified.
+    :param member: User
+    :param provider: provider name
+    :param delta: BundleDelta since the previous snapshot
+    """
+    if provider in ['sharemyhealth'] and delta:
+        counts = delta.counts()
+        changes = ', '.join(
+            '%d %s' % (counts[name], name) for name in ['added', 'changed', 'removed'] if counts[name]
+        )
+        Notification.objects.create(
+            notify=member,
+            actor=member,
+            actions=[{'url': reverse('member:records', args=[member.pk]), 'text': 'View'}],
+            message='Your health records from <b>HIXNY</b> were updated: %s' % changes,
+        )
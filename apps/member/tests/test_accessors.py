@@ -0,0 +1,51 @@
+import json
+import os
+
+from django.test import SimpleTestCase
+from jsonpath_ng import parse
+
+from ..accessors import PROFILE_ACCESSORS, compile_path, profile_paths
+from ..fhir_index import BundleIndex
+
+FIXTURES = [
+    os.path.join(os.path.dirname(__file__), name) for name in ['anon_fhir.json', 'madigan_fhir.json']
+]
+
+
+class AccessorTests(SimpleTestCase):
+
+    def assertFindsLikeJsonpathNg(self, expr, value):
+        self.assertEqual(compile_path(expr).find(value), [match.value for match in parse(expr).find(value)])
+
+    def test_profile_paths_match_jsonpath_ng(self):
+        self.assertEqual(set(PROFILE_ACCESSORS), set(profile_paths()))
+        self.assertTrue(all(accessor.simple for accessor in PROFILE_ACCESSORS.values()))
+        for path in FIXTURES:
+            with open(path) as f:
+                bundle = BundleIndex.of(json.load(f))
+            for expr in PROFILE_ACCESSORS:
+                parsed = parse(expr)
+                for resource in bundle:
+                    self.assertEqual(
+                        PROFILE_ACCESSORS[expr].find(resource), [match.value for match in parsed.find(resource)],
+                        '%s in %s/%s' % (expr, resource['resourceType'], resource.get('id')))
+
+    def test_jsonpath_ng_quirks(self):
+        resource = {
+            'code': {'text': 'flu', 'coding': []},
+            'period': {'start': '2020-01-01'},
+            'name': 'not a list',
+            'count': 0,
+            'items': [{'value': 1}, {'other': 2}, 'text', None, {'value': None}],
+        }
+        for expr in ['$', '$.code.text', '$.code.coding[*].display', '$.code.coding[0]', '$.period[*].start',
+                     '$.name[*]', '$.name[0]', '$.name.first', '$.count[*]', '$.items[*].value', '$.items[1]',
+                     '$.items[9]', '$.missing[*].value', '$.code[*].text']:
+            self.assertFindsLikeJsonpathNg(expr, resource)
+
+    def test_other_paths_use_jsonpath_ng(self):
+        accessor = compile_path('$.items[1:].value')
+        self.assertFalse(accessor.simple)
+        self.assertEqual(accessor.find({'items': [{'value': 1}, {'value': 2}]}), [2])
+        self.assertIs(compile_path('$.items[1:].value'), accessor)
+        self.assertEqual(compile_path('$.code.text').first({}, 'none'), 'none')
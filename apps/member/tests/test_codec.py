@@ -0,0 +1,119 @@
+import json
+import os
+import pickle
+import sys
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+
+from .. import codec
+from ..cache import (
+    load_member_data, member_data_cache, member_data_key, member_data_memory, store_member_data,
+)
+from ..fhir_index import BundleIndex
+from .test_member_data_cache import LOCMEM
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'madigan_fhir.json')
+
+
+class CodecTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        with open(FIXTURE) as f:
+            cls.bundle = json.load(f)
+
+    def test_round_trip(self):
+        result = {'fhir_data': BundleIndex(self.bundle), 'updated_at': 'ünïcode'}
+        data = codec.encode(result)
+        self.assertLess(len(data), len(pickle.dumps(result)) / 5)
+        decoded = codec.decode(data)
+        self.assertEqual(decoded['updated_at'], 'ünïcode')
+        self.assertEqual(decoded['fhir_data'].entries, result['fhir_data'].entries)
+        self.assertEqual(decoded['fhir_data'].count('Practitioner'), result['fhir_data'].count('Practitioner'))
+
+    def test_dictionary_shrinks_small_entries(self):
+        index = BundleIndex()
+        for resource in BundleIndex(self.bundle).resources(['Condition']):
+            index.add(resource)
+        result = {'fhir_data': index}
+        self.assertTrue(codec.load_dictionary())
+        self.assertLess(len(codec.encode(result)), len(codec.encode(result, b'')) * 0.8)
+
+    def test_dictionary_holds_no_member_data(self):
+        other = os.path.join(os.path.dirname(__file__), 'anon_fhir.json')
+        with open(other) as f:
+            zdict = codec.train_dictionary([self.bundle, json.load(f)])
+        for zdict in (zdict, codec.load_dictionary()):
+            self.assertIn(b'"system":"http://loinc.org"', zdict)
+            self.assertIn(b'"reference":"Practitioner/', zdict)
+            # no ids, references, names, addresses or drugs
+            self.assertNotIn(b'"reference":"Observation/469"', zdict)
+            self.assertNotIn(b'EAGLE MILLS', zdict)
+            self.assertNotIn(b'Zofran', zdict)
+            self.assertNotIn(b'"postalCode":"1', zdict)
+
+    def test_size_estimate(self):
+        def size(value):
+            # decoded JSON is a tree, whose keys json.loads() shares
+            if isinstance(value, dict):
+                return sys.getsizeof(value) + sum(size(v) for v in value.values())
+            if isinstance(value, list):
+                return sys.getsizeof(value) + sum(size(v) for v in value)
+            return sys.getsizeof(value)
+
+        text = json.dumps(self.bundle, separators=(',', ':')).encode('utf-8')
+        self.assertAlmostEqual(codec.estimate_size(text) / size(json.loads(text)), 1, delta=0.2)
+
+    def test_streamed_json(self):
+        result = {'fhir_data': BundleIndex(self.bundle), 'updated_at': 'ünïcode'}
+        text = json.dumps(dict(result, fhir_data=self.bundle), separators=(',', ':')).encode('utf-8')
+        data = codec.encode(result)
+        zdict = codec.load_dictionary()
+        streamed = ''.join(codec.iter_decompressed_text(data[codec.HEADER.size:], zdict))
+        self.assertEqual(streamed, text.decode('utf-8'))
+        decoded, size = codec.decode_sized(data)
+        self.assertEqual(size, codec.estimate_size(text, len(decoded['fhir_data'])))
+        with self.assertRaises(ValueError):
+            codec.decode(data[:len(data) // 2])
+
+    def test_other_dictionary_is_rejected(self):
+        data = codec.encode({'fhir_data': BundleIndex(self.bundle)}, b'"system":"http://loinc.org"')
+        with self.assertRaises(ValueError):
+            codec.decode(data)
+        with self.assertRaises(ValueError):
+            codec.decode(data[:20])
+
+
+@override_settings(CACHES=LOCMEM)
+class EncodedCacheEntryTests(TestCase):
+
+    def setUp(self):
+        member_data_cache.clear()
+        self.key = member_data_key(get_user_model().objects.create(username='codec-member'), 'sharemyhealth')
+        self.result = {'fhir_data': BundleIndex(
+            {'entry': [{'resource': {'resourceType': 'Patient', 'id': '1'}}]}), 'updated_at': 'now'}
+
+    def test_entries_are_encoded(self):
+        store_member_data(self.key, self.result, 0, 600)
+        self.assertIsInstance(member_data_cache.get(self.key)['data'], bytes)
+        self.assertEqual(load_member_data(self.key)['fhir_data'].get('Patient', '1'), {'resourceType': 'Patient', 'id': '1'})
+
+        with self.settings(MEMBER_DATA_CACHE_CODEC='pickle'):
+            store_member_data(self.key, self.result, 0, 600)
+        self.assertIsInstance(member_data_cache.get(self.key)['data'], dict)
+        self.assertEqual(load_member_data(self.key)['updated_at'], 'now')
+
+    def test_decoded_data_is_reused_until_the_entry_changes(self):
+        store_member_data(self.key, self.result, 0, 600)
+        first = load_member_data(self.key)
+        self.assertIs(load_member_data(self.key), first)
+        self.assertIn(self.key, member_data_memory.entries)
+
+        store_member_data(self.key, dict(self.result, updated_at='later'), 0, 600)
+        self.assertEqual(load_member_data(self.key)['updated_at'], 'later')
+
+    def test_undecodable_entry_is_a_miss(self):
+        member_data_cache.set(self.key, {'data': codec.encode(self.result, b'other'), 'fetched_at': 0})
+        self.assertIsNone(load_member_data(self.key))
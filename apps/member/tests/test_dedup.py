@@ -0,0 +1,58 @@
+import json
+import os
+
+from django.test import SimpleTestCase
+
+from ..dedup import Deduplicator, dedupe
+from ..fhir_index import BundleIndex
+from ..fhir_utils import filter_unique
+from ..practitioner_tools import sort_extended_practitioner
+from ..profiles import get_profile
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'anon_fhir.json')
+
+
+class DedupTests(SimpleTestCase):
+
+    def test_practitioners_fold_on_their_identifier(self):
+        with open(FIXTURE) as f:
+            practitioners = BundleIndex(json.load(f)).resources('Practitioner')
+        # what the list-based filter_unique kept
+        found, expected = [], []
+        for practitioner in practitioners:
+            values = [identifier['value'] for identifier in practitioner.get('identifier', []) if 'value' in identifier]
+            if values and values[0] in found:
+                continue
+            if values and values[0]:
+                found.append(values[0])
+            expected.append(practitioner)
+
+        result = filter_unique(practitioners, get_profile('practitioner'))
+        self.assertEqual(result['entry'], expected)
+        self.assertEqual(result['folded'], len(practitioners) - len(expected))
+        self.assertGreater(result['folded'], 0)
+
+    def test_multi_field_keys(self):
+        entries = [
+            {'id': '1', 'code': {'text': 'flu'}, 'period': {'start': '2020'}},
+            {'id': '2', 'code': {'text': 'flu'}, 'period': {'start': '2021'}},
+            {'id': '3', 'code': {'text': 'flu'}, 'period': {'start': '2020'}},
+            {'id': '4'},
+            {'id': '5'},
+        ]
+        kept, folded = dedupe(entries, ['$.code.text', '$.period.start'])
+        self.assertEqual([entry['id'] for entry in kept], ['1', '2', '4', '5'])
+        self.assertEqual(folded, 1)
+
+    def test_object_values_are_keys(self):
+        deduplicator = Deduplicator(['$.code'])
+        entries = [{'code': {'coding': [{'code': 'a'}], 'text': 't'}}, {'code': {'text': 't', 'coding': [{'code': 'a'}]}},
+                   {'code': {'coding': [{'code': 'b'}], 'text': 't'}}]
+        self.assertEqual(deduplicator.filter(entries), [entries[0], entries[2]])
+        self.assertEqual(deduplicator.folded, 1)
+
+    def test_practitioners_fold_on_their_id(self):
+        practitioners = [{'id': str(i % 1000), 'latestDate': str(i)} for i in range(20000)]
+        kept = sort_extended_practitioner(practitioners)
+        self.assertEqual(len(kept), 1000)
+        self.assertEqual(kept, practitioners[:1000])
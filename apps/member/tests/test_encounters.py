@@ -0,0 +1,57 @@
+import json
+import os
+
+from django.test import SimpleTestCase
+
+from ..encounters import EncounterIndex, encounter_index, reference_key
+from ..fhir_index import BundleIndex
+from ..practitioner_tools import practitioner_encounter
+
+FIXTURES = [
+    os.path.join(os.path.dirname(__file__), name) for name in ['anon_fhir.json', 'madigan_fhir.json']
+]
+
+
+class EncounterIndexTests(SimpleTestCase):
+
+    def test_matches_going_through_every_encounter(self):
+        for path in FIXTURES:
+            with open(path) as f:
+                index = BundleIndex(json.load(f))
+            encounters = index.resources('Encounter')
+            practitioners = practitioner_encounter(
+                [dict(practitioner) for practitioner in index.resources('Practitioner')], encounter_index(index))
+            self.assertTrue(any('latestDate' in practitioner for practitioner in practitioners))
+            for practitioner in practitioners:
+                seen = [
+                    encounter for encounter in encounters
+                    if any(participant.get('individual', {}).get('reference') == 'Practitioner/' + practitioner['id']
+                           for participant in encounter.get('participant', []))
+                ]
+                dates = [encounter['period']['start'][:10] for encounter in seen if 'start' in encounter.get('period', {})]
+                self.assertEqual(practitioner.get('earliestDate'), min(dates, default=None))
+                self.assertEqual(practitioner.get('latestDate'), max(dates, default=None))
+                locations = {location['location']['reference'] for encounter in seen for location in encounter.get('location', [])}
+                self.assertEqual({location['location']['reference'] for location in practitioner.get('location', [])}, locations)
+
+    def test_built_once_per_bundle(self):
+        index = BundleIndex({'entry': [{'resource': {
+            'resourceType': 'Encounter', 'id': '1', 'period': {'start': '2020-01-02T10:00:00+00:00'},
+            'participant': [{'individual': {'reference': 'http://example.org/fhir/Practitioner/7/_history/2'}},
+                            {'individual': {'reference': 'Practitioner/7'}}],
+        }}]})
+        encounters = encounter_index(index)
+        self.assertIs(encounter_index(index), encounters)
+        summary = encounters.get({'resourceType': 'Practitioner', 'id': '7'})
+        self.assertEqual((summary.earliest, summary.latest, len(summary.encounters)), ('2020-01-02', '2020-01-02', 1))
+        self.assertIsNone(encounters.get('Practitioner/8'))
+
+        index.add({'resourceType': 'Encounter', 'id': '2', 'participant': [{'individual': {'reference': 'Practitioner/8'}}]})
+        self.assertIsNotNone(encounter_index(index).get('Practitioner/8'))
+
+    def test_reference_key(self):
+        self.assertEqual(reference_key({'reference': 'Location/5'}), 'Location/5')
+        self.assertEqual(reference_key('https://fhir.example.org/r3/Location/5/_history/1'), 'Location/5')
+        self.assertIsNone(reference_key({'display': 'Albany'}))
+        self.assertIsNone(reference_key('5'))
+        self.assertEqual(len(EncounterIndex([{'resourceType': 'Encounter', 'participant': [{}]}])), 0)
@@ -0,0 +1,53 @@
+import copy
+import json
+import os
+
+from django.test import SimpleTestCase
+
+from ..fhir_delta import bundle_manifest, diff_bundles, resource_version
+from ..fhir_index import BundleIndex
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'madigan_fhir.json')
+
+
+class BundleDeltaTests(SimpleTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        with open(FIXTURE) as f:
+            cls.bundle = json.load(f)
+
+    def test_resource_version(self):
+        resource = {'resourceType': 'Observation', 'id': '1', 'status': 'final'}
+        self.assertEqual(resource_version(resource), resource_version(dict(reversed(list(resource.items())))))
+        self.assertNotEqual(resource_version(resource), resource_version(dict(resource, status='amended')))
+        versioned = dict(resource, meta={'versionId': '2'})
+        self.assertEqual(resource_version(versioned), resource_version(dict(versioned, status='amended')))
+
+    def test_same_bundle_has_no_changes(self):
+        index = BundleIndex(self.bundle)
+        delta, manifest = diff_bundles(bundle_manifest(index), BundleIndex(copy.deepcopy(self.bundle)))
+        self.assertFalse(delta)
+        self.assertEqual(manifest, bundle_manifest(index))
+
+    def test_added_changed_removed(self):
+        old_manifest = bundle_manifest(BundleIndex(self.bundle))
+        bundle = copy.deepcopy(self.bundle)
+        removed = bundle['entry'].pop()['resource']
+        changed = bundle['entry'][0]['resource']
+        changed['text'] = {'status': 'generated', 'div': '<div>changed</div>'}
+        added = {'resourceType': 'Observation', 'id': 'new-observation', 'status': 'final'}
+        bundle['entry'].append({'resource': added})
+
+        delta, manifest = diff_bundles(old_manifest, BundleIndex(bundle))
+
+        self.assertEqual(delta.added, [added])
+        self.assertEqual(delta.changed, [changed])
+        self.assertEqual(delta.removed, ['%s/%s' % (removed['resourceType'], removed['id'])])
+        self.assertEqual(len(delta), 3)
+        self.assertEqual(
+            delta.summary()['resource_types'],
+            sorted({'Observation', changed['resourceType'], removed['resourceType']}),
+        )
+        self.assertFalse(diff_bundles(manifest, BundleIndex(bundle))[0])
@@ -0,0 +1,71 @@
+import json
+import os
+
+from django.test import TestCase
+
+from ..fhir_index import BundleIndex
+from ..fhir_requests import get_converted_fhir_resource, get_resource_data
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'anon_fhir.json')
+
+
+class BundleIndexTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        with open(FIXTURE) as f:
+            cls.bundle = json.load(f)
+        cls.index = BundleIndex(cls.bundle)
+
+    def test_counts_by_type(self):
+        self.assertEqual(len(self.index), len(self.bundle['entry']))
+        self.assertEqual(self.index.count('Observation'), 290)
+        self.assertEqual(self.index.count('Encounter'), 99)
+        self.assertEqual(self.index.count('Account'), 0)
+
+    def test_resources_match_linear_scan(self):
+        for resource_types in (['Observation'], ['Encounter', 'Location'], 'Practitioner'):
+            wanted = [resource_types] if isinstance(resource_types, str) else resource_types
+            expected = [
+                item['resource'] for item in self.bundle['entry']
+                if item['resource']['resourceType'] in wanted
+            ]
+            self.assertEqual(self.index.resources(resource_types), expected)
+
+    def test_resources_by_id(self):
+        encounter = self.index.resources('Encounter')[0]
+        self.assertEqual(self.index.resources(['Encounter', 'Location'], id=encounter['id']), [encounter])
+        self.assertIn(encounter, self.index.resources(id=encounter['id']))
+        self.assertEqual(self.index.resources('Location', id=encounter['id'] + 'x'), [])
+
+    def test_resources_of_indexes_without_positions(self):
+        # e.g. unpickled from a cache entry written by an earlier version
+        index = BundleIndex(self.bundle)
+        del index.positions
+        self.assertEqual(index.resources(['Encounter', 'Location']),
+                         self.index.resources(['Encounter', 'Location']))
+
+    def test_get_and_resolve(self):
+        encounter = self.index.resources('Encounter')[0]
+        self.assertIs(self.index.get('Encounter', encounter['id']), encounter)
+        self.assertIs(self.index.resolve('Encounter/%s' % encounter['id']), encounter)
+        self.assertIs(self.index.resolve({'reference': 'Encounter/%s' % encounter['id']}), encounter)
+        self.assertIsNone(self.index.resolve('Encounter/does-not-exist'))
+        self.assertIsNone(self.index.resolve(None))
+
+    def test_helpers_accept_bundle_or_index(self):
+        from_bundle = get_converted_fhir_resource(self.bundle, ['Condition'])
+        from_index = get_converted_fhir_resource(self.index, ['Condition'])
+        self.assertEqual(from_bundle, from_index)
+        self.assertEqual(len(from_index['entry']), 26)
+
+        # the default constructor hands out copies, so callers may annotate them
+        copies = get_resource_data(self.index, 'Condition')
+        copies[0]['annotated'] = True
+        self.assertNotIn('annotated', self.index.resources('Condition')[0])
+
+    def test_empty(self):
+        self.assertFalse(BundleIndex.of(None))
+        self.assertEqual(BundleIndex.of({'resourceType': 'Bundle'}).resources('Observation'), [])
+        self.assertIs(BundleIndex.of(self.index), self.index)
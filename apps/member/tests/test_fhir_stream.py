@@ -0,0 +1,55 @@
+import json
+import os
+
+from django.test import TestCase
+
+from ..fhir_index import BundleIndex
+from ..fhir_stream import parse_member_data
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'anon_fhir.json')
+
+
+def chunked(text, size):
+    return (text[i:i + size] for i in range(0, len(text), size))
+
+
+class ParseMemberDataTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        with open(FIXTURE) as f:
+            cls.bundle = json.load(f)
+        cls.response = {'fhir_data': cls.bundle, 'updated_at': '2020-03-01T12:00:00Z'}
+
+    def test_matches_full_parse(self):
+        expected = BundleIndex(self.bundle)
+        for indent in (None, 2):
+            text = json.dumps(self.response, indent=indent)
+            # chunk sizes that split keys, numbers and entries at every offset
+            for size in (1, 7, 4096, len(text)):
+                if size == 1 and indent:
+                    continue
+                result = parse_member_data(chunked(text, size))
+                self.assertEqual(result['updated_at'], '2020-03-01T12:00:00Z')
+                self.assertIsInstance(result['fhir_data'], BundleIndex)
+                self.assertEqual(result['fhir_data'].entries, expected.entries)
+                self.assertEqual(result['fhir_data'].counts(), expected.counts())
+
+    def test_numbers_across_chunks(self):
+        text = '{"total": 12345, "fhir_data": {"entry": [{"resource": {"resourceType": "Observation", "id": "1", "valueQuantity": {"value": 98.6}}}]}, "n": 1}'
+        for size in range(1, 12):
+            result = parse_member_data(chunked(text, size))
+            self.assertEqual(result['total'], 12345)
+            self.assertEqual(result['n'], 1)
+            self.assertEqual(result['fhir_data'].get('Observation', '1')['valueQuantity']['value'], 98.6)
+
+    def test_empty_and_missing_bundle(self):
+        self.assertEqual(len(parse_member_data(['{"fhir_data": null}'])['fhir_data']), 0)
+        self.assertEqual(len(parse_member_data(['{}'])['fhir_data']), 0)
+        self.assertEqual(len(parse_member_data(['{"fhir_data": {"entry": []}}'])['fhir_data']), 0)
+
+    def test_invalid_json(self):
+        for text in ('', '{"fhir_data": {"entry": [{"resource": {}', '{"a": 1} x', '[1]', '{"a" 1}'):
+            with self.assertRaises(ValueError):
+                parse_member_data(chunked(text, 3))
@@ -0,0 +1,105 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from apps.org.models import Organization, ResourceRequest
+
+from ..jobs import enqueue_refresh, enqueue_warm_up, fail_abandoned_refreshes, run_next_refresh
+from ..models import (
+    REFRESH_FAILED, REFRESH_FETCHING, REFRESH_QUEUED, MemberDataRefresh, MemberDataRefreshQuerySet,
+)
+from .test_member_data_cache import LOCMEM
+
+
+@override_settings(CACHES=LOCMEM)
+class MemberDataRefreshJobTests(TestCase):
+
+    def setUp(self):
+        self.member = get_user_model().objects.create(username='refreshing-member')
+        self.member.set_password('password')
+        self.member.save()
+
+    def test_refresh_is_queued_once(self):
+        job = enqueue_refresh(self.member)
+        self.assertEqual(job.status, REFRESH_QUEUED)
+        self.assertEqual(enqueue_refresh(self.member), job)
+        self.assertEqual(MemberDataRefresh.objects.count(), 1)
+
+    def test_concurrent_requests_queue_one_refresh(self):
+        job = enqueue_refresh(self.member)
+        active = MemberDataRefreshQuerySet.active
+        lookups = []
+
+        def racing_active(queryset):
+            # the first lookup misses the job that another request has just queued
+            lookups.append(queryset)
+            return queryset.none() if len(lookups) == 1 else active(queryset)
+
+        with mock.patch.object(MemberDataRefreshQuerySet, 'active', racing_active):
+            self.assertEqual(enqueue_refresh(self.member), job)
+        self.assertEqual(MemberDataRefresh.objects.count(), 1)
+
+    @override_settings(MEMBER_DATA_JOB_HEARTBEAT=15)
+    def test_jobs_without_a_heartbeat_are_failed(self):
+        running = MemberDataRefresh.objects.create(member=self.member, status=REFRESH_FETCHING)
+        abandoned = MemberDataRefresh.objects.create(member=self.member, status=REFRESH_FETCHING)
+        MemberDataRefresh.objects.filter(pk=running.pk).update(updated=timezone.now() - timedelta(seconds=30))
+        MemberDataRefresh.objects.filter(pk=abandoned.pk).update(updated=timezone.now() - timedelta(seconds=90))
+        self.assertEqual(fail_abandoned_refreshes(), 1)
+        abandoned.refresh_from_db()
+        self.assertEqual(abandoned.status, REFRESH_FAILED)
+        self.assertTrue(MemberDataRefresh.objects.get(pk=running.pk).active)
+
+    def test_worker_runs_queued_job(self):
+        job = enqueue_refresh(self.member)
+        # the member has no sharemyhealth connection, so the fetch fails
+        self.assertEqual(run_next_refresh(), job)
+        job.refresh_from_db()
+        self.assertEqual(job.status, REFRESH_FAILED)
+        self.assertTrue(job.error)
+        self.assertIsNotNone(job.finished)
+        self.assertIsNone(run_next_refresh())
+        # a new refresh can be queued once the last one has finished
+        self.assertNotEqual(enqueue_refresh(self.member), job)
+
+    def test_post_queues_and_status_is_polled(self):
+        self.client.login(username='refreshing-member', password='password')
+        response = self.client.post(
+            reverse('member:refresh-data', args=[self.member.pk]),
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest',
+        )
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['status'], REFRESH_QUEUED)
+
+        url = reverse('member:refresh-data-status', args=[self.member.pk])
+        self.assertTrue(self.client.get(url).json()['active'])
+        run_next_refresh()
+        status = self.client.get(url).json()
+        self.assertFalse(status['active'])
+        self.assertEqual(status['status'], REFRESH_FAILED)
+
+    def test_warm_up_is_queued_once_and_becomes_a_refresh(self):
+        job = enqueue_warm_up(self.member)
+        self.assertFalse(job.refresh)
+        self.assertEqual(enqueue_warm_up(self.member), job)
+
+        # the member asks for a refresh before the warm-up runs
+        self.assertEqual(enqueue_refresh(self.member), job)
+        job.refresh_from_db()
+        self.assertTrue(job.refresh)
+        self.assertEqual(MemberDataRefresh.objects.count(), 1)
+
+    def test_approving_a_request_warms_the_members_data(self):
+        self.client.login(username='refreshing-member', password='password')
+        organization = Organization.objects.create(name='Clinic', slug='clinic')
+        resource_request = ResourceRequest.objects.create(
+            member=self.member, organization=organization, user=self.member,
+        )
+        self.client.post(reverse('member:approve_resource_request', args=[resource_request.pk]))
+        job = MemberDataRefresh.objects.get(member=self.member)
+        self.assertEqual(job.status, REFRESH_QUEUED)
+        self.assertFalse(job.refresh)
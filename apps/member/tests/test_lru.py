@@ -0,0 +1,45 @@
+from django.test import SimpleTestCase
+
+from ..lru import ByteBudgetLRU
+
+
+class ByteBudgetLRUTests(SimpleTestCase):
+
+    def test_least_recently_used_entries_are_evicted_beyond_the_budget(self):
+        lru = ByteBudgetLRU(100)
+        lru.set('a', 1, 'A', 40)
+        lru.set('b', 1, 'B', 40)
+        self.assertEqual(lru.get('a', 1), 'A')
+        lru.set('c', 1, 'C', 40)
+        self.assertIsNone(lru.get('b', 1))
+        self.assertEqual(lru.get('a', 1), 'A')
+        self.assertEqual(lru.get('c', 1), 'C')
+        self.assertEqual(lru.bytes, 80)
+
+        # too big to keep at all
+        self.assertFalse(lru.set('d', 1, 'D', 101))
+        self.assertEqual(len(lru), 2)
+        self.assertEqual(lru.stats(), {
+            'entries': 2, 'bytes': 80, 'max_bytes': 100,
+            'hits': 3, 'misses': 1, 'evictions': 1, 'hit_ratio': 0.75,
+        })
+
+    def test_other_versions_are_misses(self):
+        lru = ByteBudgetLRU(100)
+        lru.set('a', 1, 'A', 10)
+        self.assertIsNone(lru.get('a', 2))
+        lru.set('a', 2, 'A2', 30)
+        self.assertEqual(lru.get('a', 2), 'A2')
+        self.assertEqual(lru.bytes, 30)
+        lru.discard('a')
+        self.assertEqual((len(lru), lru.bytes), (0, 0))
+
+    def test_stats_are_logged_periodically(self):
+        lru = ByteBudgetLRU(100, log_interval=2)
+        lru.set('a', 1, 'A', 10)
+        with self.assertLogs('smhapp_.apps.member.lru', 'INFO') as logs:
+            lru.get('a', 1)
+            lru.get('b', 1)
+            lru.get('a', 1)
+        self.assertEqual(len(logs.records), 1)
+        self.assertIn("'hit_ratio': 0.5", logs.output[0])
@@ -0,0 +1,199 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+
+from ..cache import (
+    cache_member_data, evict_member_data, invalidate_member, member_cache_key, member_data_cache,
+    member_data_key, store_member_data,
+)
+from ..fhir_index import BundleIndex
+
+LOCMEM = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'member_data': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                    'LOCATION': 'member_data_tests'},
+}
+
+
+@override_settings(CACHES=LOCMEM)
+class MemberDataCacheTests(TestCase):
+
+    def setUp(self):
+        self.member = get_user_model().objects.create(username='cached-member')
+        member_data_cache.clear()
+        self.key = member_data_key(self.member, 'sharemyhealth')
+        self.fetches = []
+
+        @cache_member_data(timeout=60, max_age=600)
+        def fetch(member, provider, refresh=False, partial=None):
+            self.fetches.append(refresh)
+            if getattr(self, 'failing', False):
+                return {'error': 'Could not access member data.', 'status': 502}
+            return {'fhir_data': BundleIndex({'entry': [{'resource': {'resourceType': 'Patient', 'id': '1'}}]}),
+                    'n': len(self.fetches), 'unchanged': getattr(self, 'unchanged', False)}
+
+        self.fetch = fetch
+
+    def current_key(self):
+        # each fetch that stores data starts a new generation
+        return member_data_key(self.member, 'sharemyhealth')
+
+    def age_entry(self, seconds):
+        key = self.current_key()
+        entry = member_data_cache.get(key)
+        entry['fetched_at'] -= seconds
+        member_data_cache.set(key, entry)
+        return key
+
+    def wait_for_fetches(self, n, key):
+        for i in range(100):
+            if len(self.fetches) >= n and member_data_cache.get('%s:revalidate' % key) is None:
+                return
+            time.sleep(0.02)
+
+    def test_fresh_entry_is_served_from_cache(self):
+        self.assertEqual(self.fetch(self.member, 'sharemyhealth')['n'], 1)
+        self.assertEqual(self.fetch(self.member, 'sharemyhealth')['n'], 1)
+        self.assertEqual(self.fetches, [False])
+
+    def test_stale_entry_is_served_then_refreshed(self):
+        self.fetch(self.member, 'sharemyhealth')
+        key = self.age_entry(120)
+        # the stale copy comes back at once...
+        self.assertEqual(self.fetch(self.member, 'sharemyhealth')['n'], 1)
+        # ...and is replaced in the background, in a new generation
+        self.wait_for_fetches(2, key)
+        self.assertNotEqual(self.current_key(), key)
+        self.assertEqual(self.fetch(self.member, 'sharemyhealth')['n'], 2)
+        self.assertEqual(self.fetches, [False, False])
+
+    def test_forced_refresh_writes_the_canonical_entry(self):
+        self.fetch(self.member, 'sharemyhealth')
+        self.assertEqual(self.fetch(self.member, 'sharemyhealth', refresh=True)['n'], 2)
+        self.assertEqual(self.fetch(self.member, 'sharemyhealth')['n'], 2)
+        self.assertEqual(self.fetches, [False, True])
+
+    def test_every_fetch_that_stores_data_starts_a_new_generation(self):
+        self.fetch(self.member, 'sharemyhealth')
+        derived = member_cache_key(self.member, 'timeline')
+        key = self.age_entry(120)
+        self.fetch(self.member, 'sharemyhealth')
+        self.wait_for_fetches(2, key)
+        # the revalidated data replaces what was derived from the old
+        self.assertNotEqual(member_cache_key(self.member, 'timeline'), derived)
+        self.assertEqual(self.fetch(self.member, 'sharemyhealth')['n'], 2)
+
+    def test_unchanged_data_keeps_the_entry_and_the_generation(self):
+        self.fetch(self.member, 'sharemyhealth')
+        key = self.age_entry(120)
+        derived = member_cache_key(self.member, 'timeline')
+        self.unchanged = True
+        result = self.fetch(self.member, 'sharemyhealth', refresh=True)
+        self.assertNotIn('unchanged', result)
+        self.assertEqual(self.current_key(), key)
+        self.assertEqual(member_cache_key(self.member, 'timeline'), derived)
+        # the entry is the first fetch's, fetched again just now
+        self.assertLess(time.time() - member_data_cache.get(key)['fetched_at'], 60)
+        self.assertEqual(self.fetch(self.member, 'sharemyhealth')['n'], 1)
+
+    def test_unchanged_data_replaces_the_last_good_data(self):
+        self.fetch(self.member, 'sharemyhealth')
+        key = self.current_key()
+        self.assertTrue(member_data_cache.get(key)['complete'])
+        stale = {'fhir_data': BundleIndex({'entry': [{'resource': {'resourceType': 'Patient', 'id': '1'}}]}),
+                 'stale': True, 'status': 502}
+        store_member_data(key, stale, time.time(), 600)
+        self.unchanged = True
+        self.fetch(self.member, 'sharemyhealth', refresh=True)
+        self.assertNotEqual(self.current_key(), key)
+        self.assertNotIn('stale', self.fetch(self.member, 'sharemyhealth'))
+
+    def test_errors_do_not_replace_good_data(self):
+        self.fetch(self.member, 'sharemyhealth')
+        self.failing = True
+        self.assertIn('error', self.fetch(self.member, 'sharemyhealth', refresh=True))
+        self.assertEqual(self.fetch(self.member, 'sharemyhealth')['n'], 1)
+
+    def test_evicted_data_is_not_stored_by_an_earlier_fetch(self):
+        self.fetch(self.member, 'sharemyhealth')
+        key = self.current_key()
+        evict_member_data(self.member, 'sharemyhealth')
+        self.assertIsNone(member_data_cache.get(key))
+        # a fetch that started before the eviction must not bring the data back
+        store_member_data(key, self.fetch.uncached(self.member, 'sharemyhealth'), time.time() - 1, 600)
+        self.assertIsNone(member_data_cache.get(key))
+
+    @override_settings(MEMBER_DATA_FAILURE_TIMEOUT=30, MEMBER_DATA_FAILURE_MAX_TIMEOUT=100)
+    def test_failures_are_backed_off(self):
+        self.failing = True
+        self.assertIn('error', self.fetch(self.member, 'sharemyhealth'))
+        # the failure is returned again, without a fetch, until the backoff ends
+        self.assertIn('error', self.fetch(self.member, 'sharemyhealth'))
+        self.assertEqual(len(self.fetches), 1)
+
+        failure_key = '%s:failure' % self.key
+        for failures, backoff in ((2, 60), (3, 100)):
+            failure = member_data_cache.get(failure_key)
+            failure['until'] = time.time() - 1
+            member_data_cache.set(failure_key, failure)
+            self.fetch(self.member, 'sharemyhealth')
+            failure = member_data_cache.get(failure_key)
+            self.assertEqual(failure['failures'], failures)
+            self.assertAlmostEqual(failure['until'] - time.time(), backoff, delta=5)
+
+        # a refresh does not wait out the backoff, and its data clears the failures
+        self.failing = False
+        self.assertIn('fhir_data', self.fetch(self.member, 'sharemyhealth', refresh=True))
+        self.assertIsNone(member_data_cache.get(failure_key))
+
+    def test_empty_bundles_are_negative_entries(self):
+        @cache_member_data(timeout=60, max_age=600)
+        def fetch_empty(member, provider, refresh=False, partial=None):
+            self.fetches.append(refresh)
+            return {'fhir_data': BundleIndex()}
+
+        self.assertEqual(len(fetch_empty(self.member, 'sharemyhealth')['fhir_data']), 0)
+        fetch_empty(self.member, 'sharemyhealth')
+        self.assertEqual(self.fetches, [False])
+        self.assertIsNone(member_data_cache.get(self.key))
+        evict_member_data(self.member, 'sharemyhealth')
+        self.assertIsNone(member_data_cache.get('%s:failure' % self.key))
+
+    def test_partial_result_is_served_until_the_rest_arrives(self):
+        seen = []
+
+        @cache_member_data(timeout=60, max_age=600)
+        def fetch_pages(member, provider, refresh=False, partial=None):
+            partial({'fhir_data': BundleIndex({'entry': [{'resource': {'id': '1'}}]}), 'partial': True})
+            # meanwhile, another request is served the first page
+            seen.append(fetch_pages(member, provider))
+            return {'fhir_data': BundleIndex({'entry': [{'resource': {'id': '1'}}, {'resource': {'id': '2'}}]})}
+
+        result = fetch_pages.warm(self.member, 'sharemyhealth')[0]
+        self.assertTrue(seen[0]['partial'])
+        self.assertEqual(len(seen[0]['fhir_data']), 1)
+        self.assertEqual(len(result['fhir_data']), 2)
+        self.assertNotIn('partial', fetch_pages(self.member, 'sharemyhealth'))
+
+    def test_invalidation_moves_every_member_key(self):
+        self.fetch(self.member, 'sharemyhealth')
+        key = self.current_key()
+        derived = member_cache_key(self.member, 'timeline')
+        member_data_cache.set(derived, ['row'])
+        other = get_user_model().objects.create(username='other-member')
+        other_key = member_data_key(other, 'sharemyhealth')
+
+        invalidate_member(self.member)
+        self.assertNotEqual(self.current_key(), key)
+        self.assertIsNone(member_data_cache.get(member_cache_key(self.member, 'timeline')))
+        self.assertEqual(member_data_key(other, 'sharemyhealth'), other_key)
+        self.assertEqual(self.fetch(self.member, 'sharemyhealth')['n'], 2)
+
+    def test_refresh_starts_a_new_generation(self):
+        self.fetch(self.member, 'sharemyhealth')
+        derived = member_cache_key(self.member, 'timeline')
+        self.assertEqual(self.fetch(self.member, 'sharemyhealth', refresh=True)['n'], 2)
+        self.assertNotEqual(member_cache_key(self.member, 'timeline'), derived)
+        self.assertEqual(self.fetch(self.member, 'sharemyhealth')['n'], 2)
+        self.assertEqual(self.fetches, [False, True])
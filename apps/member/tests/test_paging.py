@@ -0,0 +1,98 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from django.test import SimpleTestCase
+
+from ..fhir_index import BundleIndex
+from ..paging import fetch_remaining_pages, offset_page_urls
+
+RESOURCES = [{'resourceType': 'Observation', 'id': str(i)} for i in range(10)]
+PAGE_SIZE = 3
+
+
+def page(offset, next_link):
+    """A page of RESOURCES from offset, linking to the next one with next_link(offset)"""
+    bundle = {
+        'resourceType': 'Bundle',
+        'total': len(RESOURCES),
+        'entry': [{'resource': r} for r in RESOURCES[offset:offset + PAGE_SIZE]],
+    }
+    if offset + PAGE_SIZE < len(RESOURCES):
+        bundle['link'] = [{'relation': 'next', 'url': next_link(offset + PAGE_SIZE)}]
+    return bundle
+
+
+class PageHandler(BaseHTTPRequestHandler):
+    """
+    /offset?_getpagesoffset=N pages by offset; /cursor?page=N links page to page
+    with opaque URLs, as a server without offsets would
+    """
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        query = parse_qs(parts.query)
+        self.server.paths.append(self.path)
+        if parts.path == '/offset':
+            offset = int(query['_getpagesoffset'][0])
+            body = page(offset, lambda o: '/offset?_getpagesoffset=%d&_count=%d' % (o, PAGE_SIZE))
+        else:
+            offset = int(query['page'][0]) * PAGE_SIZE
+            # no total: the pages can only be followed
+            body = dict(page(offset, lambda o: 'cursor?page=%d' % (o // PAGE_SIZE)), total=None)
+        body = json.dumps({'fhir_data': body}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class PagingTests(SimpleTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = HTTPServer(('127.0.0.1', 0), PageHandler)
+        cls.base_url = 'http://127.0.0.1:%d' % cls.server.server_port
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.server.paths = []
+
+    def test_offset_page_urls(self):
+        self.assertEqual(
+            offset_page_urls('http://fhir/x?_getpages=abc&_getpagesoffset=3&_count=3', 10, 3),
+            ['http://fhir/x?_getpages=abc&_getpagesoffset=%d&_count=3' % o for o in [3, 6, 9]],
+        )
+        self.assertIsNone(offset_page_urls('http://fhir/x?page=2', 10, 3))
+        self.assertIsNone(offset_page_urls('http://fhir/x?_getpagesoffset=3', None, 3))
+
+    def test_offset_pages_are_fetched_concurrently(self):
+        index = BundleIndex(page(0, lambda o: '/offset?_getpagesoffset=%d&_count=%d' % (o, PAGE_SIZE)))
+        pages = fetch_remaining_pages(index, self.base_url + '/offset?_getpagesoffset=0', {})
+        self.assertEqual(pages, 3)
+        self.assertEqual(index.entries, RESOURCES)
+        self.assertIsNone(index.link('next'))
+
+    def test_next_links_are_followed(self):
+        index = BundleIndex(page(0, lambda o: 'cursor?page=%d' % (o // PAGE_SIZE)))
+        pages = fetch_remaining_pages(index, self.base_url + '/cursor?page=0', {})
+        self.assertEqual(pages, 3)
+        self.assertEqual(index.entries, RESOURCES)
+        self.assertEqual(self.server.paths, ['/cursor?page=%d' % i for i in [1, 2, 3]])
+
+    def test_max_pages(self):
+        index = BundleIndex(page(0, lambda o: 'cursor?page=%d' % (o // PAGE_SIZE)))
+        self.assertEqual(fetch_remaining_pages(index, self.base_url + '/cursor?page=0', {}, max_pages=1), 1)
+        self.assertEqual(len(index), 2 * PAGE_SIZE)
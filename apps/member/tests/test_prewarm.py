@@ -0,0 +1,104 @@
+import json
+import threading
+import time
+from http.server import HTTPServer
+
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase, override_settings
+from social_django.models import UserSocialAuth
+
+from apps.org.models import Organization, ResourceGrant
+
+from ..cache import member_data_cache
+from ..prewarm import FETCHED, FRESH, FetchLimit, PrewarmStats, prewarm_candidates, prewarm_member
+from .test_member_data_cache import LOCMEM
+from .test_snapshots import FIXTURE, EverythingHandler
+
+
+class FetchLimitTests(SimpleTestCase):
+
+    def test_concurrency_and_rate(self):
+        limit = FetchLimit(concurrency=2, rate=50)
+        in_flight = []
+        peak = []
+        lock = threading.Lock()
+
+        def fetch():
+            with limit:
+                with lock:
+                    in_flight.append(1)
+                    peak.append(len(in_flight))
+                time.sleep(0.02)
+                with lock:
+                    in_flight.pop()
+
+        start = time.monotonic()
+        threads = [threading.Thread(target=fetch) for i in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(max(peak), 2)
+        # 6 starts, 1/50s apart
+        self.assertGreaterEqual(time.monotonic() - start, 5 / 50)
+
+
+class PrewarmCandidatesTests(TestCase):
+
+    def test_granted_members_first(self):
+        User = get_user_model()
+        members = [User.objects.create(username='prewarm-%d' % i) for i in range(4)]
+        for member in members[:3]:
+            UserSocialAuth.objects.create(
+                user=member, provider='sharemyhealth', uid=member.username,
+                extra_data={'access_token': 'token'},
+            )
+        # connected, but no longer active
+        members[0].is_active = False
+        members[0].save()
+        organization = Organization.objects.create(name='Clinic', slug='clinic')
+        for member in [members[2], members[3]]:
+            ResourceGrant.objects.create(organization=organization, member=member)
+
+        self.assertEqual(prewarm_candidates(), [members[2], members[1]])
+        self.assertEqual(prewarm_candidates(granted_only=True), [members[2]])
+
+
+@override_settings(CACHES=LOCMEM)
+class PrewarmMemberTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        with open(FIXTURE) as f:
+            cls.bundle = json.load(f)
+        cls.server = HTTPServer(('127.0.0.1', 0), EverythingHandler)
+        cls.server.body = json.dumps({'fhir_data': cls.bundle, 'updated_at': ''}).encode('utf-8')
+        cls.server.etag = '"v1"'
+        cls.server.requests = []
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def test_prewarm_member(self):
+        member_data_cache.clear()
+        member = get_user_model().objects.create(username='prewarm-member')
+        UserSocialAuth.objects.create(
+            user=member, provider='sharemyhealth', uid=member.username,
+            extra_data={'access_token': 'token'},
+        )
+        limit = FetchLimit(concurrency=1)
+        stats = PrewarmStats()
+        with self.settings(SOCIAL_AUTH_SHAREMYHEALTH_HOST='http://127.0.0.1:%d' % self.server.server_port):
+            self.assertEqual(prewarm_member(member, 'sharemyhealth', limit, stats), FETCHED)
+            self.assertEqual(prewarm_member(member, 'sharemyhealth', limit, stats), FRESH)
+
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(stats.as_dict()['fetched'], 1)
+        self.assertEqual(stats.as_dict()['fresh'], 1)
+        self.assertEqual(stats.resources, len(self.bundle['entry']))
@@ -0,0 +1,70 @@
+import json
+import os
+
+from django.test import SimpleTestCase
+
+from ..fhir_index import BundleIndex
+from ..fhir_requests import get_converted_fhir_resource, get_lab_results, get_vital_signs
+from ..fhir_utils import resource_count
+from ..profiles import PROFILES, PROFILES_BY_NAME, RecordBuckets, get_profile, summarize_records, view_profiles
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'madigan_fhir.json')
+
+
+class ProfilesTests(SimpleTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        with open(FIXTURE) as f:
+            cls.index = BundleIndex(json.load(f))
+
+    def test_profiles_are_read_only(self):
+        profile = get_profile('condition')
+        self.assertEqual(profile['name'], 'Condition')
+        with self.assertRaises(TypeError):
+            profile['data'] = []
+        with self.assertRaises(AttributeError):
+            profile['headers'].append('code')
+        self.assertIsNone(get_profile('no-such-record'))
+
+    def test_summaries_leave_the_profiles_alone(self):
+        summaries = summarize_records(self.index, view_profiles('record'))
+        by_name = {summary['name']: summary for summary in summaries}
+        self.assertEqual(by_name['Condition']['count'], self.index.count('Condition'))
+        self.assertEqual(len(by_name['Condition']['data']), self.index.count('Condition'))
+        self.assertEqual(by_name['Condition']['slug'], 'condition')
+        self.assertIn('VitalSigns', by_name)
+        # 'skip' profiles are not summarized
+        self.assertNotIn('Observation', by_name)
+        self.assertFalse(any('data' in profile or 'count' in profile for profile in PROFILES))
+
+
+class RecordBucketsTests(SimpleTestCase):
+
+    def test_one_pass_matches_the_per_profile_lookups(self):
+        for name in ['anon_fhir.json', 'madigan_fhir.json']:
+            with open(os.path.join(os.path.dirname(__file__), name)) as f:
+                index = BundleIndex(json.load(f))
+            buckets = RecordBuckets(index, PROFILES, keep_resources=True)
+            for profile in PROFILES:
+                if profile['call_type'] == 'fhir':
+                    expected = get_converted_fhir_resource(index, profile['resources'])['entry']
+                elif profile['name'] == 'VitalSigns':
+                    expected = get_vital_signs(index, profile)['entry']
+                elif profile['name'] == 'LabResults':
+                    expected = get_lab_results(index, profile)['entry']
+                else:
+                    expected = None
+                self.assertEqual(buckets.buckets.get(profile['slug']), expected, profile['name'])
+            self.assertEqual(buckets.counts, resource_count(get_converted_fhir_resource(index)['entry']))
+            self.assertEqual(len(buckets.resources), sum(buckets.counts.values()))
+            self.assertEqual(
+                len(buckets.entries(PROFILES_BY_NAME['VitalSigns'])) + len(buckets.entries(PROFILES_BY_NAME['LabResults'])),
+                index.count('Observation'))
+
+    def test_observations_without_a_code_are_lab_results(self):
+        index = BundleIndex({'entry': [{'resource': {'resourceType': 'Observation', 'id': '1'}}]})
+        summaries = {summary['name']: summary for summary in summarize_records(index, view_profiles('record'))}
+        self.assertEqual(summaries['LabResults']['count'], 1)
+        self.assertEqual(summaries['VitalSigns']['count'], 0)
@@ -0,0 +1,56 @@
+import json
+import os
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from .test_member_data_cache import LOCMEM
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'anon_fhir.json')
+
+
+@override_settings(CACHES=LOCMEM)
+class RecordPagesTests(TestCase):
+
+    def setUp(self):
+        self.member = get_user_model().objects.create(username='records-member')
+        self.member.set_password('password')
+        self.member.save()
+        self.client.login(username='records-member', password='password')
+        with open(FIXTURE) as f:
+            self.bundle = json.load(f)
+
+    def get(self, view, resource_name):
+        data = {'fhir_data': self.bundle, 'updated_at': '2020-01-01T00:00:00Z'}
+        with mock.patch('apps.member.views_new.fetch_member_data', return_value=data):
+            return self.client.get(reverse(view, args=[self.member.pk, resource_name]))
+
+    def test_observations_without_a_code_are_shown_as_lab_results(self):
+        self.bundle['entry'].append({'resource': {'resourceType': 'Observation', 'id': 'no-code', 'status': 'final'}})
+        vital_signs = self.get('member:records', 'vitalsigns')
+        self.assertEqual(vital_signs.status_code, 200)
+        self.assertNotIn('no-code', [record['id'] for record in vital_signs.context['content_list']])
+        lab_results = self.get('member:records', 'labresults')
+        self.assertEqual(lab_results.status_code, 200)
+        self.assertIn('no-code', [record['id'] for record in lab_results.context['content_list']])
+
+    def test_providers_list_has_the_dates_of_the_encounters(self):
+        response = self.get('member:providers', 'list')
+        self.assertEqual(response.status_code, 200)
+        practitioners = next(summary for summary in response.context['all_records'] if summary['name'] == 'Practitioner')
+        self.assertTrue(any('latestDate' in practitioner for practitioner in practitioners['data']))
+
+    def practitioners_folded(self):
+        summaries = self.get('member:providers', 'list').context['all_records']
+        return next(summary for summary in summaries if summary['name'] == 'Practitioner')['folded']
+
+    def test_duplicates_left_out_are_counted(self):
+        folded = self.practitioners_folded()
+        self.assertGreater(folded, 0)
+        practitioner = next(entry['resource'] for entry in self.bundle['entry']
+                            if entry['resource']['resourceType'] == 'Practitioner' and entry['resource'].get('identifier'))
+        self.bundle['entry'].append({'resource': dict(practitioner, id='duplicate')})
+        self.assertEqual(self.practitioners_folded(), folded + 1)
+        self.assertEqual(self.get('member:providers', 'practitioner').context['folded'], folded + 1)
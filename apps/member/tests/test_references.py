@@ -0,0 +1,59 @@
+import json
+import os
+
+from django.template import Context, Template
+from django.test import SimpleTestCase
+
+from ..fhir_custom_formats import dt_reference
+from ..fhir_index import BundleIndex
+from ..references import ReferenceGraph, reference_graph
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'anon_fhir.json')
+
+
+class ReferenceGraphTests(SimpleTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        with open(FIXTURE) as f:
+            cls.index = BundleIndex(json.load(f))
+
+    def test_both_directions(self):
+        graph = reference_graph(self.index)
+        self.assertIs(reference_graph(self.index), graph)
+        for encounter in self.index.resources('Encounter'):
+            for participant in encounter.get('participant', []):
+                practitioner = graph.resolve(participant['individual'])
+                self.assertIs(practitioner, self.index.resolve(participant['individual']))
+                self.assertIn(practitioner, graph.references(encounter, ['Practitioner']))
+                self.assertIn(encounter, graph.referenced_by(practitioner, ['Encounter']))
+
+        medication = self.index.resources('Medication')[0]
+        referencing = graph.referenced_by('Medication/%s' % medication['id'])
+        self.assertTrue(referencing)
+        self.assertEqual(
+            referencing,
+            [resource for resource in self.index
+             if json.dumps(resource).count('"Medication/%s"' % medication['id'])])
+
+    def test_display_of_unnamed_references(self):
+        graph = ReferenceGraph({'entry': [
+            {'resource': {'resourceType': 'Practitioner', 'id': '7', 'name': [{'family': 'Galati', 'given': ['Lisa']}]}},
+            {'resource': {'resourceType': 'Location', 'id': '5', 'name': 'Albany'}},
+            {'resource': {'resourceType': 'Encounter', 'id': '1',
+                          'participant': [{'individual': {'reference': 'Practitioner/7'}}],
+                          'location': [{'location': {'reference': 'Location/5', 'display': 'Albany Medical'}},
+                                       {'location': {'reference': '#contained'}}]}},
+        ]})
+        self.assertEqual(graph.forward['Encounter/1'], ('Practitioner/7', 'Location/5'))
+        self.assertEqual(graph.display({'reference': 'Practitioner/7'}), 'Lisa Galati')
+        self.assertEqual(graph.display({'reference': 'Location/5', 'display': 'Albany Medical'}), 'Albany Medical')
+        self.assertIsNone(graph.display({'reference': 'Location/6'}))
+        self.assertIn('>Lisa Galati</a>', dt_reference({'reference': 'Practitioner/7'}, 1, graph))
+        self.assertIn('>Practitioner/7</a>', dt_reference({'reference': 'Practitioner/7'}, 1))
+        # in the records tables
+        rendered = Template(
+            '{% load fhirtags %}{% graphvalueformat value "1.Encounter.participant" graph %}'
+        ).render(Context({'value': [{'individual': {'reference': 'Practitioner/7'}}], 'graph': graph}))
+        self.assertIn('>Lisa Galati</a>', rendered)
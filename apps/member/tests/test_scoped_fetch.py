@@ -0,0 +1,165 @@
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from social_django.models import UserSocialAuth
+
+from ..cache import (
+    evict_member_data, load_member_data_failure, member_data_cache, member_data_key, member_type_keys,
+)
+from ..utils import fetch_member_data, fetch_member_resources
+from .test_member_data_cache import LOCMEM
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'madigan_fhir.json')
+
+
+class TypeScopedHandler(BaseHTTPRequestHandler):
+    """Serves server.bundle at Patient/$everything, only the resources of _type if given"""
+
+    def do_GET(self):
+        query = parse_qs(urlsplit(self.path).query)
+        self.server.requests.append(query)
+        status = self.server.scoped_status if '_type' in query else self.server.status
+        if status != 200:
+            self.send_response(status)
+            self.send_header('Content-Type', 'text/plain; charset=utf-8')
+            self.send_header('Content-Length', str(len(self.server.error_body)))
+            self.end_headers()
+            self.wfile.write(self.server.error_body)
+            return
+        bundle = self.server.bundle
+        if '_type' in query:
+            types = query['_type'][0].split(',')
+            bundle = dict(bundle, entry=[
+                entry for entry in bundle['entry'] if entry['resource']['resourceType'] in types
+            ])
+        body = json.dumps({'fhir_data': bundle, 'updated_at': '2020-03-09 11:39:29.000000+0000'})
+        body = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@override_settings(CACHES=LOCMEM)
+class FetchMemberResourcesTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = HTTPServer(('127.0.0.1', 0), TypeScopedHandler)
+        with open(FIXTURE) as f:
+            cls.server.bundle = json.load(f)
+        cls.server.requests = []
+        cls.server.status = 200
+        cls.server.scoped_status = 200
+        cls.server.error_body = b''
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.server.requests.clear()
+        self.server.status = 200
+        self.server.scoped_status = 200
+        self.server.error_body = b''
+        member_data_cache.clear()
+        self.member = get_user_model().objects.create(username='scoped-member')
+        UserSocialAuth.objects.create(
+            user=self.member, provider='sharemyhealth', uid='scoped-member',
+            extra_data={'access_token': 'token'},
+        )
+
+    def count(self, resource_type):
+        return sum(
+            1 for entry in self.server.bundle['entry'] if entry['resource']['resourceType'] == resource_type
+        )
+
+    def test_fetches_only_the_missing_types_once(self):
+        with self.settings(SOCIAL_AUTH_SHAREMYHEALTH_HOST='http://127.0.0.1:%d' % self.server.server_port):
+            result = fetch_member_resources(self.member, 'sharemyhealth', ['Practitioner'])
+            self.assertEqual(result['fhir_data'].count('Practitioner'), self.count('Practitioner'))
+            self.assertEqual(len(result['fhir_data']), self.count('Practitioner'))
+            self.assertEqual(result['updated_at'], '2020-03-09 11:39:29.000000+0000')
+
+            # cached per type: only Condition is fetched now
+            result = fetch_member_resources(self.member, 'sharemyhealth', ['Practitioner', 'Condition'])
+            self.assertEqual(len(result['fhir_data']), self.count('Practitioner') + self.count('Condition'))
+            fetch_member_resources(self.member, 'sharemyhealth', ['Condition'])
+
+        self.assertEqual(
+            [query['_type'] for query in self.server.requests], [['Practitioner'], ['Condition']]
+        )
+
+    def test_eviction_removes_the_scoped_entries(self):
+        with self.settings(SOCIAL_AUTH_SHAREMYHEALTH_HOST='http://127.0.0.1:%d' % self.server.server_port):
+            fetch_member_resources(self.member, 'sharemyhealth', ['Practitioner'])
+            type_keys = list(member_type_keys(member_data_key(self.member, 'sharemyhealth'), ['Practitioner']))
+            evict_member_data(self.member, 'sharemyhealth')
+            # deleted, not only moved to an old generation
+            self.assertEqual(member_data_cache.get_many(type_keys), {})
+            fetch_member_resources(self.member, 'sharemyhealth', ['Practitioner'])
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_scoped_requests_refused_fetch_the_whole_bundle(self):
+        self.server.scoped_status = 400
+        with self.settings(SOCIAL_AUTH_SHAREMYHEALTH_HOST='http://127.0.0.1:%d' % self.server.server_port):
+            result = fetch_member_resources(self.member, 'sharemyhealth', ['Practitioner'])
+        self.assertEqual(len(result['fhir_data']), len(self.server.bundle['entry']))
+        self.assertEqual(['_type' in query for query in self.server.requests], [True, False])
+
+    def test_failures_are_backed_off_from(self):
+        self.server.status = self.server.scoped_status = 500
+        with self.settings(SOCIAL_AUTH_SHAREMYHEALTH_HOST='http://127.0.0.1:%d' % self.server.server_port):
+            result = fetch_member_resources(self.member, 'sharemyhealth', ['Practitioner'])
+            self.assertEqual(result['status'], 500)
+            self.assertIsNotNone(load_member_data_failure(member_data_key(self.member, 'sharemyhealth')))
+            # the negative entry is served, without asking sharemyhealth again
+            self.assertEqual(fetch_member_resources(self.member, 'sharemyhealth', ['Condition']), result)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_error_bodies_are_kept(self):
+        # a token that is rejected, and that cannot be refreshed (no refresh token)
+        self.server.status = self.server.scoped_status = 403
+        self.server.error_body = 'Accès refusé'.encode('utf-8')
+        with self.settings(SOCIAL_AUTH_SHAREMYHEALTH_HOST='http://127.0.0.1:%d' % self.server.server_port):
+            result = fetch_member_resources(self.member, 'sharemyhealth', ['Practitioner'])
+        self.assertEqual((result['status'], result['content']), (403, 'Accès refusé'))
+
+    def test_resource_popup_fetches_only_its_type(self):
+        self.member.set_password('password')
+        self.member.save()
+        self.client.login(username='scoped-member', password='password')
+        encounters = json.dumps([
+            entry for entry in self.server.bundle['entry'] if entry['resource']['resourceType'] == 'Encounter'
+        ])
+        practitioner = next(
+            entry['resource'] for entry in self.server.bundle['entry']
+            if entry['resource']['resourceType'] == 'Practitioner'
+            and '"Practitioner/%s"' % entry['resource']['id'] in encounters
+        )
+        url = reverse('member:data', args=[self.member.pk, 'Practitioner', practitioner['id']])
+        with self.settings(SOCIAL_AUTH_SHAREMYHEALTH_HOST='http://127.0.0.1:%d' % self.server.server_port):
+            response = self.client.get(url, {'pretty': 'true'})
+            self.assertEqual(response.status_code, 200)
+            # what references it is only known from the whole bundle
+            self.assertNotIn(b'Referenced by', response.content)
+            self.assertEqual([query.get('_type') for query in self.server.requests], [['Practitioner']])
+
+            fetch_member_data(self.member, 'sharemyhealth')
+            response = self.client.get(url, {'pretty': 'true'})
+            self.assertIn(b'Referenced by', response.content)
+        self.assertEqual(len(self.server.requests), 2)
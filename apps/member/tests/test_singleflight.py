@@ -0,0 +1,130 @@
+import threading
+import time
+
+from django.core.cache import caches
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+
+from ..models import FlightLock
+from ..singleflight import DatabaseLocks, SingleFlight
+
+
+class SingleFlightTests(TestCase):
+
+    def setUp(self):
+        self.cache = caches['default']
+        self.cache.clear()
+        self.flight = SingleFlight(self.cache, lock_timeout=10, wait_timeout=5, poll_interval=0.01)
+        self.calls = 0
+
+    def compute(self):
+        self.calls += 1
+        time.sleep(0.2)
+        self.cache.set('result', 'fetched')
+        return 'fetched'
+
+    def test_threads_share_one_call(self):
+        results = []
+
+        def call():
+            results.append(self.flight.do('result', lambda: self.cache.get('result'), self.compute))
+
+        threads = [threading.Thread(target=call) for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(results, ['fetched'] * 5)
+        self.assertIsNone(self.cache.get('result:lock'))
+
+    def test_waits_for_another_process(self):
+        # another worker holds the lock, stores its result and releases the lock
+        self.cache.add('result:lock', 'other', 10)
+
+        def other_worker():
+            time.sleep(0.2)
+            self.cache.set('result', 'from other worker')
+            self.cache.delete('result:lock')
+
+        threading.Thread(target=other_worker).start()
+        result = self.flight.do('result', lambda: self.cache.get('result'), self.compute)
+        self.assertEqual(result, 'from other worker')
+        self.assertEqual(self.calls, 0)
+
+    def test_takes_over_after_failed_leader(self):
+        # another worker releases the lock without storing a result
+        self.cache.add('result:lock', 'other', 10)
+        threading.Timer(0.1, self.cache.delete, ['result:lock']).start()
+        result = self.flight.do('result', lambda: self.cache.get('result'), self.compute)
+        self.assertEqual(result, 'fetched')
+        self.assertEqual(self.calls, 1)
+
+    def test_errors_are_shared_and_released(self):
+        def fail():
+            time.sleep(0.1)
+            raise RuntimeError('upstream down')
+
+        errors = []
+
+        def call():
+            try:
+                self.flight.do('result', lambda: None, fail)
+            except RuntimeError as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=call) for i in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(errors), 3)
+        self.assertIsNone(self.cache.get('result:lock'))
+        self.assertEqual(self.flight._calls, {})
+
+
+class DatabaseLocksTests(TransactionTestCase):
+
+    def setUp(self):
+        self.locks = DatabaseLocks()
+        self.cache = caches['default']
+        self.cache.clear()
+        self.calls = 0
+
+    def test_lock_is_taken_once_until_released_or_expired(self):
+        self.assertTrue(self.locks.add('result:lock', 'a', 10))
+        self.assertFalse(self.locks.add('result:lock', 'b', 10))
+        self.assertEqual(self.locks.get('result:lock'), 'a')
+        self.locks.delete('result:lock')
+        self.assertIsNone(self.locks.get('result:lock'))
+        # a lock left by a worker that died is taken over once it expires
+        self.assertTrue(self.locks.add('result:lock', 'dead', 0))
+        self.assertTrue(self.locks.add('result:lock', 'b', 10))
+        self.assertEqual(self.locks.get('result:lock'), 'b')
+        self.assertNotIn('result', FlightLock.objects.get().key)
+
+    def test_workers_share_one_call(self):
+        # each SingleFlight stands for a worker process, with its own calls in flight
+        results = []
+
+        def compute():
+            self.calls += 1
+            time.sleep(0.2)
+            self.cache.set('result', 'fetched')
+            return 'fetched'
+
+        def call():
+            flight = SingleFlight(self.locks, lock_timeout=10, wait_timeout=5, poll_interval=0.01)
+            try:
+                results.append(flight.do('result', lambda: self.cache.get('result'), compute))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=call) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(results, ['fetched'] * 4)
+        self.assertFalse(FlightLock.objects.exists())
@@ -0,0 +1,199 @@
+import json
+import os
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from social_django.models import UserSocialAuth
+
+from apps.notifications.models import Notification
+
+from ..fhir_index import BundleIndex
+from ..models import MemberBundleSnapshot
+from ..snapshots import decode_member_data, encode_member_data
+from smh_app import upstream
+
+from ..cache import member_cache_key, member_data_cache, member_data_key
+from ..utils import fetch_member_data
+from .test_member_data_cache import LOCMEM
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'madigan_fhir.json')
+
+
+class EverythingHandler(BaseHTTPRequestHandler):
+    """Serves server.body at Patient/$everything, with an ETag, honoring If-None-Match"""
+
+    def do_GET(self):
+        self.server.requests.append(dict(self.headers))
+        if self.headers.get('If-None-Match') == self.server.etag:
+            self.send_response(304)
+            self.send_header('ETag', self.server.etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(self.server.body)))
+        self.send_header('ETag', self.server.etag)
+        self.end_headers()
+        self.wfile.write(self.server.body)
+
+    def log_message(self, *args):
+        pass
+
+
+@override_settings(CACHES=LOCMEM, MEMBER_DATA_CACHE_TIMEOUT=0)
+class MemberBundleSnapshotTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        with open(FIXTURE) as f:
+            cls.bundle = json.load(f)
+        cls.server = HTTPServer(('127.0.0.1', 0), EverythingHandler)
+        cls.server.body = json.dumps(
+            {'fhir_data': cls.bundle, 'updated_at': '2020-03-09 11:39:29.000000+0000'}
+        ).encode('utf-8')
+        cls.server.etag = '"v1"'
+        cls.server.requests = []
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.server.requests.clear()
+        member_data_cache.clear()
+        self.member = get_user_model().objects.create(username='snapshot-member')
+        UserSocialAuth.objects.create(
+            user=self.member, provider='sharemyhealth', uid='snapshot-member',
+            extra_data={'access_token': 'token'},
+        )
+
+    def test_encode_decode(self):
+        result = {'fhir_data': BundleIndex(self.bundle), 'updated_at': 'ünïcode'}
+        data, sha256, size = encode_member_data(result)
+        self.assertLess(len(data), size / 5)
+        decoded = decode_member_data(data)
+        self.assertEqual(decoded['updated_at'], 'ünïcode')
+        self.assertEqual(decoded['fhir_data'].entries, result['fhir_data'].entries)
+        self.assertEqual(encode_member_data(decoded)[1], sha256)
+
+    def test_conditional_fetch_reuses_snapshot(self):
+        with self.settings(SOCIAL_AUTH_SHAREMYHEALTH_HOST='http://127.0.0.1:%d' % self.server.server_port):
+            first = fetch_member_data.uncached(self.member, 'sharemyhealth')
+            snapshot = MemberBundleSnapshot.objects.get(member=self.member)
+            self.assertEqual(snapshot.etag, '"v1"')
+            self.assertEqual(snapshot.resource_count, len(self.bundle['entry']))
+            self.assertTrue(snapshot.last_modified)
+
+            second = fetch_member_data.uncached(self.member, 'sharemyhealth')
+
+        self.assertNotIn('If-None-Match', self.server.requests[0])
+        self.assertEqual(self.server.requests[1]['If-None-Match'], '"v1"')
+        self.assertEqual(second['fhir_data'].entries, first['fhir_data'].entries)
+        self.assertEqual(second['updated_at'], first['updated_at'])
+
+    def test_fresh_snapshot_is_used_without_a_request(self):
+        with self.settings(SOCIAL_AUTH_SHAREMYHEALTH_HOST='http://127.0.0.1:%d' % self.server.server_port):
+            fetch_member_data.uncached(self.member, 'sharemyhealth')
+            with self.settings(MEMBER_DATA_CACHE_TIMEOUT=300):
+                result = fetch_member_data.uncached(self.member, 'sharemyhealth')
+                self.assertEqual(len(result['fhir_data']), len(self.bundle['entry']))
+                # but a refresh asks the data provider
+                fetch_member_data.uncached(self.member, 'sharemyhealth', refresh=True)
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_snapshot_is_not_served_without_an_access_token(self):
+        with self.settings(SOCIAL_AUTH_SHAREMYHEALTH_HOST='http://127.0.0.1:%d' % self.server.server_port):
+            fetch_member_data.uncached(self.member, 'sharemyhealth')
+            # e.g. the token expired and could not be refreshed
+            UserSocialAuth.objects.filter(user=self.member).update(extra_data={})
+            with self.settings(MEMBER_DATA_CACHE_TIMEOUT=300):
+                self.assertNotIn('fhir_data', fetch_member_data.uncached(self.member, 'sharemyhealth'))
+
+    def test_changed_resources_are_reported(self):
+        body, etag = self.server.body, self.server.etag
+        self.addCleanup(setattr, self.server, 'body', body)
+        self.addCleanup(setattr, self.server, 'etag', etag)
+        # (members are prompted to connect when they sign up)
+        notifications = Notification.objects.filter(notify_id=self.member.id, message__contains='updated')
+
+        with self.settings(SOCIAL_AUTH_SHAREMYHEALTH_HOST='http://127.0.0.1:%d' % self.server.server_port):
+            first = fetch_member_data.uncached(self.member, 'sharemyhealth')
+            self.assertNotIn('changes', first)
+            sha256 = MemberBundleSnapshot.objects.get(member=self.member).sha256
+
+            # the same bundle again: nothing to report or rewrite
+            self.server.etag = '"v2"'
+            second = fetch_member_data.uncached(self.member, 'sharemyhealth', refresh=True)
+            self.assertEqual(second['changes']['added'] + second['changes']['changed'], 0)
+            self.assertFalse(notifications.exists())
+
+            bundle = json.loads(body)
+            bundle['fhir_data']['entry'][0]['resource']['text'] = {'status': 'generated', 'div': '<div/>'}
+            self.server.body = json.dumps(bundle).encode('utf-8')
+            self.server.etag = '"v3"'
+            third = fetch_member_data.uncached(self.member, 'sharemyhealth', refresh=True)
+            self.assertEqual(notifications.count(), 1)
+
+            # changes found without a refresh (e.g. by a revalidation) are not notified
+            bundle['fhir_data']['entry'][1]['resource']['text'] = {'status': 'generated', 'div': '<div/>'}
+            self.server.body = json.dumps(bundle).encode('utf-8')
+            self.server.etag = '"v4"'
+            self.assertEqual(fetch_member_data.uncached(self.member, 'sharemyhealth')['changes']['changed'], 1)
+
+        self.assertEqual(third['changes']['changed'], 1)
+        self.assertEqual(notifications.count(), 1)
+        snapshot = MemberBundleSnapshot.objects.get(member=self.member)
+        self.assertNotEqual(snapshot.sha256, sha256)
+        self.assertEqual(snapshot.etag, '"v4"')
+
+    def test_unchanged_data_keeps_the_cached_entries(self):
+        body, etag = self.server.body, self.server.etag
+        self.addCleanup(setattr, self.server, 'body', body)
+        self.addCleanup(setattr, self.server, 'etag', etag)
+
+        with self.settings(SOCIAL_AUTH_SHAREMYHEALTH_HOST='http://127.0.0.1:%d' % self.server.server_port):
+            fetch_member_data(self.member, 'sharemyhealth')
+            derived = member_cache_key(self.member, 'timeline')
+            # not modified
+            fetch_member_data(self.member, 'sharemyhealth', refresh=True)
+            self.assertEqual(member_cache_key(self.member, 'timeline'), derived)
+            # the same bundle, sent again
+            self.server.etag = '"v2"'
+            fetch_member_data(self.member, 'sharemyhealth', refresh=True)
+            self.assertEqual(member_cache_key(self.member, 'timeline'), derived)
+
+            bundle = json.loads(body)
+            bundle['fhir_data']['entry'][0]['resource']['text'] = {'status': 'generated', 'div': '<div/>'}
+            self.server.body = json.dumps(bundle).encode('utf-8')
+            self.server.etag = '"v3"'
+            fetch_member_data(self.member, 'sharemyhealth', refresh=True)
+            self.assertNotEqual(member_cache_key(self.member, 'timeline'), derived)
+
+        self.assertEqual([request.get('If-None-Match') for request in self.server.requests],
+                         [None, '"v1"', '"v1"', '"v2"'])
+
+    def test_last_snapshot_is_served_while_the_upstream_is_down(self):
+        with self.settings(SOCIAL_AUTH_SHAREMYHEALTH_HOST='http://127.0.0.1:%d' % self.server.server_port):
+            fetch_member_data.uncached(self.member, 'sharemyhealth')
+
+        # nothing listens on the port any more
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            down = 'http://127.0.0.1:%d' % s.getsockname()[1]
+        with self.settings(SOCIAL_AUTH_SHAREMYHEALTH_HOST=down, UPSTREAM_RETRIES=0), \
+                self.assertLogs('smhapp_', 'WARNING'):
+            self.assertRaises(upstream.RequestException, upstream.get, down)
+            result = fetch_member_data(self.member, 'sharemyhealth')
+            self.assertTrue(result['stale'])
+            self.assertEqual(len(result['fhir_data']), len(self.bundle['entry']))
+            # served from the cache, and not fetched again until the backoff ends
+            self.assertTrue(fetch_member_data(self.member, 'sharemyhealth')['stale'])
+            failure = member_data_cache.get('%s:failure' % member_data_key(self.member, 'sharemyhealth'))
+            self.assertEqual(failure['failures'], 1)
@@ -13,6 +13,7 @@ from .views_new import (
     ProvidersView,
     ProviderDetailView,
     RecordsView,
+    RefreshStatusView,
     TimelineView,
     RequestAccessView,
     DeleteMemberView,
@@ -95,6 +96,11 @@ urlpatterns = [
     url(r'^(?P<pk>[0-9]+)/$', ProfileView.as_view(), name='member-profile'),
     url(r'^(?P<pk>[0-9]+)/delete/$', DeleteMemberView.as_view(), name='delete'),
     url(r'^(?P<pk>[0-9]+)/refresh_data/$', refresh_member_data, name='refresh-data'),
+    url(
+        r'^(?P<pk>[0-9]+)/refresh_data/status/$',
+        RefreshStatusView.as_view(),
+        name='refresh-data-status',
+    ),
     url(r'^notifications/$', NotificationsView.as_view(), name='notifications'),
     url(r'^$', DashboardView.as_view(), name='dashboard'),
     # Member/Org ResourceRequests
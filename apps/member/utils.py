@@ -1,8 +1,6 @@
 import logging
 import json
-import requests
 from django.conf import settings
-from memoize import memoize
 
 # from apps.data.models.allergy import AllergyIntolerance
 # from apps.data.models.medication import (
@@ -11,76 +9,315 @@ from memoize import memoize
 #     MedicationStatement,
 # )
 # from apps.data.models.practitioner import Practitioner
-from apps.users.utils import refresh_access_token
+from apps.users.utils import get_access_token, refresh_access_token
+from smh_app import upstream
+
+from .cache import (
+    cache_member_data,
+    load_member_data,
+    load_member_data_failure,
+    load_member_type_data,
+    member_data_flight,
+    member_data_key,
+    store_member_data_failure,
+    store_member_type_data,
+)
+from .constants import RESOURCES
+from .fhir_index import BundleIndex
+from .fhir_stream import iter_response_text, parse_member_data
+from .models import REFRESH_INDEXING
+from .paging import fetch_remaining_pages
+from .snapshots import (
+    confirm_snapshot,
+    conditional_headers,
+    decode_member_data,
+    get_snapshot,
+    is_fresh,
+    member_data_notifications,
+    save_snapshot,
+)
 
 logger = logging.getLogger(__name__)
 
+# how much of an error response's body is kept (in the member data's 'content')
+ERROR_CONTENT_BYTES = 64 * 1024
+
 
 def fetch_backend_api_responses(access_token):
     # Call the backend API response API so we can display errors from
     # InterSystems HealthShare
     url = "%s/hixny/api/back-end-api-responses" % (
         settings.SOCIAL_AUTH_SHAREMYHEALTH_HOST)
-    r = requests.get(
-        url, headers={'Authorization': 'Bearer %s' % access_token})
-    return json.loads(r.content)
+    try:
+        r = upstream.get(
+            url, headers={'Authorization': 'Bearer %s' % access_token})
+        # an error page (e.g. while sharemyhealth is down) is not JSON
+        return json.loads(r.content)
+    except (upstream.RequestException, ValueError):
+        return {}
+
+
+def everything_url():
+    return "%s/hixny/api/fhir/stu3/Patient/$everything" % (
+        settings.SOCIAL_AUTH_SHAREMYHEALTH_HOST)
+
+
+def get_everything(social_auth, access_token, params, headers=None):
+    """
+    GET the member's Patient/$everything from sharemyhealth, streamed. If the
+    access token is rejected, refresh it and repeat the request once.
+    Raises upstream.RequestException if sharemyhealth could not be reached.
+    :param social_auth: the member's sharemyhealth UserSocialAuth
+    :param access_token: get_access_token(social_auth)
+    :param params: query parameters
+    :param headers: other request headers (e.g. conditional ones)
+    :return: (requests.Response, the access token the request was made with)
+    """
+    def get(access_token):
+        return upstream.get(
+            everything_url(),
+            headers={'Authorization': 'Bearer %s' % access_token, **(headers or {})},
+            params=params,
+            stream=True,
+        )
 
+    r = get(access_token)
+    if r.status_code == 403:
+        refreshed = refresh_access_token(social_auth, access_token)
+        if refreshed:  # repeat the previous request
+            r.close()
+            access_token = social_auth.extra_data.get('access_token')
+            r = get(access_token)
+        # else the rejection is returned unread, for its error body
+    return r, access_token
 
-@memoize(timeout=300)
-def fetch_member_data(member, provider, refresh=False):
+
+def error_content(r):
+    """
+    :param r: streamed requests.Response, not yet read or closed
+    :return: the start of its body (up to ERROR_CONTENT_BYTES), as text
+    """
+    content = r.raw.read(ERROR_CONTENT_BYTES, decode_content=True) or b''
+    return content.decode(r.encoding or 'utf-8', errors='replace')
+
+
+@cache_member_data(timeout=settings.MEMBER_DATA_CACHE_TIMEOUT,
+                   max_age=settings.MEMBER_DATA_CACHE_MAX_AGE)
+def fetch_member_data(member, provider, refresh=False, progress=None, partial=None):
     '''Fetch FHIR data from HIXNY data provider (sharemyhealth)
     If refresh=True, it will instruct the api to refresh the patient data.
+    progress, if given, is called with REFRESH_INDEXING once the data starts to arrive.
+    If the bundle comes in pages, partial, if given, is called with the data
+    of the first page while the other pages are fetched.
     '''
-    url = "%s/hixny/api/fhir/stu3/Patient/$everything" % (
-        settings.SOCIAL_AUTH_SHAREMYHEALTH_HOST)
     params = {'refresh': refresh}
+    if settings.MEMBER_DATA_PAGE_SIZE:
+        params['_count'] = settings.MEMBER_DATA_PAGE_SIZE
     social_auth = member.social_auth.filter(provider=provider).first()
+    # without a token (e.g. its refresh failed), not even the snapshot is served
+    access_token = get_access_token(social_auth) if social_auth is not None else None
     # fallback
     result_data = {}
 
-    if social_auth is not None:
-        access_token = social_auth.extra_data.get('access_token')
-        if access_token is not None:
-            r = requests.get(
-                url,
-                headers={'Authorization': 'Bearer %s' % access_token},
-                params=params,
-            )
-            if r.status_code == 403:
-                refreshed = refresh_access_token(social_auth)
-                if refreshed:  # repeat the previous request
-                    access_token = social_auth.extra_data.get('access_token')
-                    r = requests.get(
-                        url, headers={
-                            'Authorization': 'Bearer %s' % access_token}
-                    )
-
-            if r.status_code == 200:
-                result_data = r.json()
-            else:
+    if access_token is not None:
+        snapshot = get_snapshot(member, provider)
+        if snapshot is not None and not refresh and is_fresh(snapshot):
+            # fetched or confirmed recently (e.g. before a deploy emptied the cache)
+            result_data = decode_member_data(snapshot.data)
+        else:
+            r = None
+            try:
+                r, access_token = get_everything(
+                    social_auth, access_token, params, conditional_headers(snapshot))
+                status_code = r.status_code
+                if status_code == 200:
+                    if progress is not None:
+                        progress(REFRESH_INDEXING)
+                    # parse the body as it arrives, indexing each resource as
+                    # it is read, rather than holding the whole text and the
+                    # whole decoded bundle at once
+                    result_data = parse_member_data(iter_response_text(r))
+                    if result_data['fhir_data'].link('next'):
+                        if partial is not None:
+                            partial(dict(result_data, partial=True))
+                        fetch_remaining_pages(
+                            result_data['fhir_data'], r.url,
+                            {'Authorization': 'Bearer %s' % access_token},
+                        )
+                    previous_sha256 = snapshot.sha256 if snapshot is not None else None
+                    snapshot, delta = save_snapshot(member, provider, result_data, r, snapshot)
+                    if snapshot.sha256 == previous_sha256:
+                        # the snapshot's data, again: see cache_member_data
+                        result_data['unchanged'] = True
+                    if delta is not None:
+                        # only what changed since the previous bundle is news
+                        result_data['changes'] = delta.summary()
+                        if refresh:
+                            member_data_notifications(member, provider, delta)
+                elif status_code == 304 and snapshot is not None:
+                    # not modified since the snapshot
+                    if progress is not None:
+                        progress(REFRESH_INDEXING)
+                    result_data = decode_member_data(snapshot.data)
+                    result_data['unchanged'] = True
+                    confirm_snapshot(snapshot, r)
+                    status_code = 200
+                else:
+                    content = error_content(r)
+            except (upstream.RequestException, ValueError) as e:
+                # sharemyhealth could not be reached, did not answer in time, or
+                # sent a body that is not valid JSON
+                status_code = 504 if isinstance(e, upstream.Timeout) else 502
+                content = str(e)
+            finally:
+                if r is not None:
+                    r.close()
+
+            if status_code >= 500 and snapshot is not None:
+                # sharemyhealth is down (or its circuit breaker is open): show
+                # the last data it sent, marked as possibly out of date
+                logger.warning('fetch_member_data(%r, %r): %s, using %s', member, provider, status_code, snapshot)
+                result_data = decode_member_data(snapshot.data)
+                result_data.update(stale=True, status=status_code)
+            elif status_code != 200:
                 result_data = {
                     'error': 'Could not access member data. '
                              'Please try again. [{status_code}]'.format(
-                                 status_code=r.status_code),
-                    'status': r.status_code,
-                    'content': r.text,
+                                 status_code=status_code),
+                    'status': status_code,
+                    'content': content,
                 }
 
     logging.debug(
-        "fetch_member_data(%r, %r, refresh=%r) = %s"
-        % (member, provider, refresh, json.dumps(result_data))
+        "fetch_member_data(%r, %r, refresh=%r) = %r"
+        % (member, provider, refresh, result_data.get('fhir_data', result_data.get('status')))
     )
     return result_data
 
 
+def fetch_member_types(member, provider, resource_types):
+    """
+    Fetch only the member's resources of resource_types from sharemyhealth
+    (Patient/$everything?_type=...), uncached
+    :param member: User
+    :param provider: provider name
+    :param resource_types: list of resourceType names
+    :return: member data, with 'fhir_data' as a BundleIndex; an error result
+        if sharemyhealth could not be reached or failed; or None if it did not
+        fetch just those types (e.g. it refused _type)
+    """
+    social_auth = member.social_auth.filter(provider=provider).first()
+    access_token = get_access_token(social_auth) if social_auth is not None else None
+    if access_token is None:
+        return None
+    r = None
+    try:
+        r, access_token = get_everything(social_auth, access_token, {'_type': ','.join(resource_types)})
+        status_code = r.status_code
+        if status_code == 200:
+            result_data = parse_member_data(iter_response_text(r))
+            fetch_remaining_pages(
+                result_data['fhir_data'], r.url, {'Authorization': 'Bearer %s' % access_token},
+            )
+            return result_data
+        logger.info('fetch_member_types(%r, %r, %r): %s', member, provider, resource_types, status_code)
+        if status_code < 500:
+            return None
+        content = error_content(r)
+    except (upstream.RequestException, ValueError) as e:
+        status_code = 504 if isinstance(e, upstream.Timeout) else 502
+        content = str(e)
+    finally:
+        if r is not None:
+            r.close()
+    return {
+        'error': 'Could not access member data. '
+                 'Please try again. [{status_code}]'.format(status_code=status_code),
+        'status': status_code,
+        'content': content,
+    }
+
+
+def cached_member_data(member, provider, key=None):
+    """
+    :param member: User
+    :param provider: provider name
+    :param key: the member's member_data_key(), if known
+    :return: the member's whole bundle from provider if it is cached (not
+        just its first page), else None. Nothing is fetched.
+    """
+    data = load_member_data(key or member_data_key(member, provider))
+    if data and data.get('fhir_data') and not data.get('partial'):
+        return data
+    return None
+
+
+def fetch_member_resources(member, provider, resource_types):
+    """
+    Get the member's resources of resource_types, for views that only need a
+    few types. If the member's whole bundle is cached, that is used; else
+    only the types that are not cached yet are fetched (in one request, at
+    most once at a time), and cached per type. If sharemyhealth can't fetch
+    just those types, the whole bundle is fetched after all. Failures are
+    backed off from like those of fetch_member_data().
+    :param member: User
+    :param provider: provider name
+    :param resource_types: list of resourceType names
+    :return: member data, with 'fhir_data' as a BundleIndex (of at least
+        those types), or the result of a failed fetch
+    """
+    key = member_data_key(member, provider)
+    data = cached_member_data(member, provider, key)
+    if data is not None:
+        return data
+    failure = load_member_data_failure(key)
+    if failure is not None:
+        return failure['result']
+    if not set(resource_types) <= set(RESOURCES):
+        return fetch_member_data(member, provider, data_key=key)
+
+    entries = load_member_type_data(key, resource_types)
+    missing = [t for t in resource_types if t not in entries]
+    if missing:
+        def load():
+            # what another worker fetched (and stored) meanwhile, if anything
+            failure = load_member_data_failure(key)
+            if failure is not None:
+                return {'failure': failure['result']}
+            fetched = load_member_type_data(key, missing)
+            if len(fetched) == len(missing):
+                return {'entries': fetched}
+            return None
+
+        def fetch():
+            result_data = fetch_member_types(member, provider, missing)
+            if result_data is None:
+                return None
+            if 'error' in result_data:
+                store_member_data_failure(key, result_data)
+                return {'failure': result_data}
+            return {'entries': store_member_type_data(key, missing, result_data)}
+
+        fetched = member_data_flight.do('%s:types:%s' % (key, ','.join(missing)), load, fetch)
+        if fetched is None:
+            return fetch_member_data(member, provider, data_key=key)
+        if 'failure' in fetched:
+            return fetched['failure']
+        entries.update(fetched['entries'])
+
+    index = BundleIndex()
+    for resource_type in resource_types:
+        index.merge(entries[resource_type]['fhir_data'])
+    return {
+        'fhir_data': index,
+        'updated_at': min(entries[t]['updated_at'] or '' for t in resource_types) or None,
+    }
+
+
 def get_resource_data(data, resource_types, constructor=dict, id=None):
-    if isinstance(resource_types, str):
-        resource_types = [resource_types]
     return [
-        constructor(item['resource'])
-        for item in (data or {}).get('entry', [])
-        if item['resource']['resourceType'] in resource_types
-        if id is None or item['resource'].get('id') == id
+        constructor(resource)
+        for resource in BundleIndex.of(data).resources(resource_types, id=id)
     ]
 
 
@@ -15,7 +15,6 @@ from django.urls import reverse_lazy
 from django.views.decorators.http import require_POST
 from django.views.generic.base import TemplateView, View
 from django.views.generic.edit import DeleteView
-from memoize import delete_memoized
 
 # from apps.data.models.condition import Condition
 # from apps.data.models.encounter import Encounter
@@ -152,10 +151,6 @@ class SummaryView(LoginRequiredMixin, SelfOrApprovedOrgMixin, TemplateView):
         # print(counts)
         #
         #####
-        if fhir_data is None or 'entry' not in fhir_data or not fhir_data['entry']:
-            delete_memoized(fetch_member_data, context[
-                            'member'], 'sharemyhealth')
-
         # all_records = RECORDS
         all_records = RECORDS_STU3
         summarized_records = []
@@ -219,10 +214,6 @@ class RecordsView(LoginRequiredMixin, SelfOrApprovedOrgMixin, TemplateView):
                 'entry') and len(fhir_data.get('entry')),
         )
 
-        if fhir_data is None or 'entry' not in fhir_data or not fhir_data['entry']:
-            delete_memoized(fetch_member_data, context[
-                            'member'], 'sharemyhealth')
-
         if resource_name == 'list':
             all_records = RECORDS_STU3
             summarized_records = []
@@ -330,10 +321,6 @@ class PrescriptionDetailModalView(
         if settings.DEBUG:
             context['data'] = fhir_data
 
-        if fhir_data is None or 'entry' not in fhir_data or not fhir_data['entry']:
-            delete_memoized(fetch_member_data, context[
-                            'member'], 'sharemyhealth')
-
         prescriptions = get_prescriptions(
             fhir_data, id=context[
                 'resource_id'], incl_practitioners=True, json=True
@@ -359,9 +346,6 @@ class DataView(LoginRequiredMixin, SelfOrApprovedOrgMixin, View):
         fhir_data = load_test_fhir_data(data)
         # fhir_data = data.get('fhir_data')
 
-        if fhir_data is None or 'entry' not in fhir_data or not fhir_data['entry']:
-            delete_memoized(fetch_member_data, member, 'sharemyhealth')
-
         if resource_type == 'prescriptions':
             response_data = get_prescriptions(
                 fhir_data, id=resource_id, incl_practitioners=True, json=True
@@ -422,10 +406,6 @@ class ProvidersView(LoginRequiredMixin, SelfOrApprovedOrgMixin, TemplateView):
                 'entry') and len(fhir_data.get('entry')),
         )
 
-        if fhir_data is None or 'entry' not in fhir_data or not fhir_data['entry']:
-            delete_memoized(fetch_member_data, context[
-                'member'], 'sharemyhealth')
-
         if resource_name == 'list':
             provider_related = []
             for r in RECORDS_STU3:
@@ -523,10 +503,6 @@ class ProviderDetailView(LoginRequiredMixin, SelfOrApprovedOrgMixin, TemplateVie
             )
         fhir_data = data.get('fhir_data')
 
-        if fhir_data is None or 'entry' not in fhir_data or not fhir_data['entry']:
-            delete_memoized(fetch_member_data, context[
-                            'member'], 'sharemyhealth')
-
         context['practitioner'] = next(
             iter(
                 get_resource_data(
@@ -877,7 +853,7 @@ def refresh_member_data(request, pk):
     """Only allow members to refresh their own data"""
     member = get_object_or_404(get_user_model().objects.filter(pk=pk))
     if member == request.user:
-        delete_memoized(fetch_member_data, member, 'sharemyhealth')
+        # replaces the cached data, and clears a failure being backed off from
         fetch_member_data(member, 'sharemyhealth', refresh=True)
     else:
         print(
@@ -8,14 +8,13 @@ from django.contrib.auth import get_user_model
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.templatetags.static import static
-from django.http.response import Http404, HttpResponse   # , JsonResponse
+from django.http.response import Http404, HttpResponse, JsonResponse
 from django.shortcuts import get_object_or_404, redirect, reverse
 from django.urls import reverse_lazy
 # from django.utils.html import mark_safe
 from django.views.decorators.http import require_POST
 from django.views.generic.base import TemplateView, View
 from django.views.generic.edit import DeleteView
-from memoize import delete_memoized
 
 # from apps.data.models.condition import Condition
 # from apps.data.models.encounter import Encounter
@@ -36,29 +35,30 @@ from apps.org.models import (
 from apps.users.models import UserProfile
 from apps.users.utils import get_id_token_payload
 
-from .constants import RECORDS_STU3, FIELD_TITLES, RESOURCES
+from .cache import evict_member_data, invalidate_member
+from .constants import FIELD_TITLES, RESOURCES, PRESCRIPTION_TYPES, REFERENCED_BY_EXCLUDE
+from .encounters import encounter_index
+from .jobs import enqueue_refresh, enqueue_warm_up
+from .models import MemberDataRefresh
 # , TIMELINE
 # , PROVIDER_RESOURCES,
 # , VITALSIGNS
 from .forms import ResourceRequestForm
-from .utils import (fetch_member_data, fetch_backend_api_responses)
+from .profiles import PROFILES, PROFILES_BY_NAME, RecordBuckets, get_profile, summarize_records, view_profiles
+from .references import reference_graph
+from .utils import (cached_member_data, fetch_member_data, fetch_member_resources, fetch_backend_api_responses)
 #     # get_allergies,
 #     get_prescriptions,
 #     get_resource_data,
 
 from .fhir_requests import (
     get_converted_fhir_resource,
-    get_lab_results,
-    get_vital_signs,
 )
 from .fhir_utils import (
-    resource_count,
     load_test_fhir_data,
-    find_index,
     find_list_entry,
     path_extract,
     # sort_json,
-    view_filter,
     groupsort,
     concatenate_lists,
     entry_check,
@@ -69,7 +69,8 @@ from .fhir_utils import (
     concatenate_output,
 )
 from ..common.templatetags.fhirtags import resourceview
-# from .practitioner_tools import practitioner_encounter, sort_extended_practitioner
+from .practitioner_tools import practitioner_encounter
+# from .practitioner_tools import sort_extended_practitioner
 
 logger = logging.getLogger(__name__)
 
@@ -121,8 +122,12 @@ class TimelineView(LoginRequiredMixin, SelfOrApprovedOrgMixin, TemplateView):
         # Get the data for the member, and set it in the context
         data = fetch_member_data(context['member'], 'sharemyhealth')
         context['updated_at'] = parse_timestamp(data.get('updated_at'))
+        context['data_stale'] = data.get('stale', False)
+        context['data_partial'] = data.get('partial', False)
         context['timestamp'] = data.get('updated_at', "No timestamp")
         context = context_updated_at(context)
+        context['refresh_job'] = MemberDataRefresh.objects.active().filter(
+            member=context['member'], refresh=True).last()
         return_to_view = "member:timeline"
         context.setdefault('return_to_view', return_to_view)
 
@@ -151,12 +156,9 @@ class TimelineView(LoginRequiredMixin, SelfOrApprovedOrgMixin, TemplateView):
         # print(counts)
         #
         #####
-        if fhir_data is None or 'entry' not in fhir_data or not fhir_data['entry']:
-            delete_memoized(fetch_member_data, context[
-                            'member'], 'sharemyhealth')
 
         # all_records = RECORDS
-        all_records = RECORDS_STU3
+        all_records = PROFILES
         context.setdefault('all_headers', all_records)
         # summarized_records = []
 
@@ -176,6 +178,8 @@ class SummaryView(LoginRequiredMixin, SelfOrApprovedOrgMixin, TemplateView):
         # Get the data for the member, and set it in the context
         data = fetch_member_data(context['member'], 'sharemyhealth')
         context['updated_at'] = parse_timestamp(data.get('updated_at'))
+        context['data_stale'] = data.get('stale', False)
+        context['data_partial'] = data.get('partial', False)
         context['timestamp'] = data.get('updated_at', "No timestamp")
         context = context_updated_at(context)
 
@@ -189,63 +193,25 @@ class SummaryView(LoginRequiredMixin, SelfOrApprovedOrgMixin, TemplateView):
         #
         # get resource bundles
         #
-        resource_list = RESOURCES
+        # one pass sorts the resources into every profile's bucket
+        buckets = RecordBuckets(fhir_data, PROFILES, keep_resources=True)
         # Observation mixes lab results and vital signs
-        resource_list.remove('Observation')
-
-        resources = get_converted_fhir_resource(fhir_data)
-        if len(resources.entry) > 0:
-            resources = resources.entry
-        else:
-            resources = []
+        resources = [r for r in buckets.resources if r['resourceType'] != 'Observation']
         context.setdefault('resources', resources)
-        labs = get_lab_results(fhir_data)
-        if len(labs.entry) > 0:
-            labs = labs.entry
-        else:
-            labs = []
+        labs = buckets.entries(PROFILES_BY_NAME['LabResults'])
         context.setdefault('labs', labs)
-        vitals = get_vital_signs(fhir_data)
-        if len(vitals.entry) > 0:
-            vitals = vitals.entry
-        else:
-            vitals = []
+        vitals = buckets.entries(PROFILES_BY_NAME['VitalSigns'])
         context.setdefault('vitals', vitals)
 
-        counts = resource_count(resources)
+        counts = {k: v for k, v in buckets.counts.items() if k != 'Observation'}
         context.setdefault('counts', counts)
         # print(counts)
         #
         #####
-        if fhir_data is None or 'entry' not in fhir_data or not fhir_data['entry']:
-            delete_memoized(fetch_member_data, context[
-                            'member'], 'sharemyhealth')
 
         # all_records = RECORDS
-        all_records = RECORDS_STU3
-        summarized_records = []
+        summarized_records = buckets.summaries()
         notes_headers = ['Agent Name', 'Organization', 'Date']
-        for record in all_records:
-
-            if record['call_type'].lower() == "fhir":
-                entries = get_converted_fhir_resource(
-                    fhir_data, record['resources'])
-                record['data'] = entries['entry']
-                record['count'] = len(entries['entry'])
-                summarized_records.append(record)
-            elif record['call_type'].lower() == 'custom':
-                if record['name'] == 'VitalSigns':
-                    entries = get_vital_signs(fhir_data)
-                    record['data'] = entries['entry']
-                    record['count'] = len(entries['entry'])
-                    summarized_records.append(record)
-                elif record['name'] == 'LabResults':
-                    entries = get_lab_results(fhir_data)
-                    record['data'] = entries['entry']
-                    record['count'] = len(entries['entry'])
-                    summarized_records.append(record)
-            else:   # skip
-                pass
 
         context.setdefault('summarized_records', summarized_records)
 
@@ -269,8 +235,12 @@ class RecordsView(LoginRequiredMixin, SelfOrApprovedOrgMixin, TemplateView):
         # Get the data for the member, and set it in the context
         data = fetch_member_data(context['member'], 'sharemyhealth')
         context['updated_at'] = parse_timestamp(data.get('updated_at'))
+        context['data_stale'] = data.get('stale', False)
+        context['data_partial'] = data.get('partial', False)
         context['timestamp'] = data.get('updated_at', "No timestamp")
         context = context_updated_at(context)
+        context['refresh_job'] = MemberDataRefresh.objects.active().filter(
+            member=context['member'], refresh=True).last()
         return_to_view = "member:records"
         context.setdefault('return_to_view', return_to_view)
 
@@ -282,47 +252,17 @@ class RecordsView(LoginRequiredMixin, SelfOrApprovedOrgMixin, TemplateView):
         if settings.DEBUG:
             context['data'] = data
 
-        logging.debug(
-            "fhir_data records: %r",
-            fhir_data and fhir_data.get(
-                'entry') and len(fhir_data.get('entry')),
-        )
-
-        if fhir_data is None or 'entry' not in fhir_data or not fhir_data['entry']:
-            delete_memoized(fetch_member_data, context[
-                            'member'], 'sharemyhealth')
+        logging.debug("fhir_data records: %r", len(fhir_data))
 
         if resource_name == 'list':
-            # all_records = RECORDS_STU3
-            all_records = view_filter(RECORDS_STU3, 'record')
-            summarized_records = []
-            for record in all_records:
-                if record['call_type'].lower() == "fhir":
-                    # print("record processing for ", record['name'])
-                    entries = get_converted_fhir_resource(
-                        fhir_data, record['resources'])
-                    record['data'] = entries['entry']
-                    record['count'] = len(entries['entry'])
-                    summarized_records.append(record)
-                elif record['call_type'].lower() == 'custom':
-                    if record['name'] == 'VitalSigns':
-                        entries = get_vital_signs(fhir_data, record)
-                        record['data'] = entries['entry']
-                        record['count'] = len(entries['entry'])
-                        summarized_records.append(record)
-                    elif record['name'] == 'LabResults':
-                        entries = get_lab_results(fhir_data, record)
-                        record['data'] = entries['entry']
-                        record['count'] = len(entries['entry'])
-                        summarized_records.append(record)
-                else:  # skip
-                    pass
-
+            # per-request summaries: the shared profiles are never modified
+            summarized_records = summarize_records(fhir_data, view_profiles('record'))
             context.setdefault('all_records', summarized_records)
 
         else:
-            resource_profile = RECORDS_STU3[
-                find_index(RECORDS_STU3, "slug", resource_name)]
+            resource_profile = get_profile(resource_name)
+            if resource_profile is None:
+                raise Http404()
 
             # print("Resource Profile", resource_profile)
 
@@ -340,10 +280,12 @@ class RecordsView(LoginRequiredMixin, SelfOrApprovedOrgMixin, TemplateView):
 
             title = resource_profile['display']
             if resource_profile['call_type'] == 'custom':
-                if resource_profile['slug'] == 'labresults':
-                    entries = get_lab_results(fhir_data, resource_profile)
-                elif resource_profile['slug'] == 'vitalsigns':
-                    entries = get_vital_signs(fhir_data, resource_profile)
+                # lab results or vital signs, split as on the list page
+                buckets = RecordBuckets(fhir_data, [resource_profile])
+                entries = {
+                    'entry': buckets.entries(resource_profile) or [],
+                    'folded': buckets.folded.get(resource_profile['slug'], 0),
+                }
             elif resource_profile['call_type'] == 'skip':
                 entries = {'entry': []}
             else:
@@ -372,6 +314,10 @@ class RecordsView(LoginRequiredMixin, SelfOrApprovedOrgMixin, TemplateView):
             context.setdefault('exclude', exclude)
             # context.setdefault('content_list', content_list)
             context.setdefault('resource_profile', resource_profile)
+            # the duplicates left out of the records (on the profile's 'unique')
+            context.setdefault('folded', entries.get('folded', 0))
+            # to name the references that have no display
+            context.setdefault('graph', reference_graph(fhir_data))
             # sorted_content = sort_json(content_list, sort_field)
             # context.setdefault('content_list', sorted_content)
             dated_resources = sort_date(content_list, resource_profile)
@@ -399,8 +345,10 @@ class PrescriptionDetailModalView(
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['member'] = self.get_member()
-        data = fetch_member_data(context['member'], 'sharemyhealth')
+        data = fetch_member_resources(context['member'], 'sharemyhealth', PRESCRIPTION_TYPES)
         context['updated_at'] = parse_timestamp(data.get('updated_at'))
+        context['data_stale'] = data.get('stale', False)
+        context['data_partial'] = data.get('partial', False)
         context = context_updated_at(context)
         ###
         # this will only pull a local fhir file if VPC_ENV is not
@@ -410,10 +358,6 @@ class PrescriptionDetailModalView(
         if settings.DEBUG:
             context['data'] = fhir_data
 
-        if fhir_data is None or 'entry' not in fhir_data or not fhir_data['entry']:
-            delete_memoized(fetch_member_data, context[
-                            'member'], 'sharemyhealth')
-
         prescriptions = []
         # prescriptions = get_prescriptions(
         #     fhir_data, id=context[
@@ -434,41 +378,53 @@ class DataView(LoginRequiredMixin, SelfOrApprovedOrgMixin, View):
         print(member.pk)
         resource_type = kwargs['resource_type']
         resource_id = kwargs['resource_id']
-        data = fetch_member_data(member, 'sharemyhealth')
         pretty = False
         pretty_text = request.GET.get('pretty')
         if pretty_text:
             if pretty_text.lower() == "true":
                 pretty = True
 
-        ###
-        # this will only pull a local fhir file if VPC_ENV is not
-        # prod|stage|dev
-        fhir_data = load_test_fhir_data(data)
-        # fhir_data = data.get('fhir_data')
-
-        if fhir_data is None or 'entry' not in fhir_data or not fhir_data['entry']:
-            delete_memoized(fetch_member_data, member, 'sharemyhealth')
-
         # if resource_type == 'prescriptions':
         #     response_data = get_prescriptions(
         #         fhir_data, id=resource_id, incl_practitioners=True, json=True
         #     )
-        elif resource_type in RESOURCES:
-            resource_profile = RECORDS_STU3[find_index(
-                RECORDS_STU3, "slug", resource_type.lower())]
+        if resource_type in RESOURCES:
+            resource_profile = get_profile(resource_type.lower())
+            data = None
             if resource_profile:
-                bundle = get_converted_fhir_resource(
-                    fhir_data, [resource_profile['name']])
-                for entry in bundle['entry']:
-                    if 'id' in entry:
-                        if entry['id'] == resource_id:
-                            data = entry
+                # only the one resource type is needed, not the whole bundle
+                data = fetch_member_resources(member, 'sharemyhealth', [resource_profile['name']])
+                ###
+                # this will only pull a local fhir file if VPC_ENV is not
+                # prod|stage|dev
+                fhir_data = load_test_fhir_data(data)
+                data = fhir_data.get(resource_profile['name'], resource_id)
+            if data is None:
+                raise Http404()
+            data = dict(data)
             if not pretty:
                 response_data = json.dumps(data, indent=settings.JSON_INDENT)
             else:
+                # the resources referencing this one may be of any type: they
+                # are shown if the whole bundle is cached, but not fetched for
+                bundle = cached_member_data(member, 'sharemyhealth')
+                graph = reference_graph(load_test_fhir_data(bundle) if bundle is not None else fhir_data)
                 response_data = "<table>" + \
-                    resourceview(data, member.pk) + "</table><hr/>"
+                    resourceview(data, member.pk, graph=graph) + "</table><hr/>"
+                # the records that reference this one (e.g. a Practitioner's encounters)
+                referenced_by = [
+                    r for r in graph.referenced_by(data)
+                    if r['resourceType'] not in REFERENCED_BY_EXCLUDE
+                ]
+                if referenced_by:
+                    response_data += "<h5>Referenced by</h5><table>"
+                    resource_type = None
+                    for r in referenced_by:
+                        # a copy: resourceview() formats the fields in place
+                        response_data += resourceview(
+                            dict(r), member.pk, changed=r['resourceType'] != resource_type, graph=graph) or ""
+                        resource_type = r['resourceType']
+                    response_data += "</table><hr/>"
                 # response_data += json.dumps(data, indent=settings.JSON_INDENT)
                 # print(response_data)
 
@@ -498,6 +454,8 @@ class ProvidersView(LoginRequiredMixin, SelfOrApprovedOrgMixin, TemplateView):
         # Get the data for the member, and set it in the context
         data = fetch_member_data(context['member'], 'sharemyhealth')
         context['updated_at'] = parse_timestamp(data.get('updated_at'))
+        context['data_stale'] = data.get('stale', False)
+        context['data_partial'] = data.get('partial', False)
         context['timestamp'] = data.get('updated_at', "No timestamp")
         context = context_updated_at(context)
         return_to_view = "member:providers"
@@ -511,53 +469,23 @@ class ProvidersView(LoginRequiredMixin, SelfOrApprovedOrgMixin, TemplateView):
         if settings.DEBUG:
             context['data'] = data
 
-        logging.debug(
-            "fhir_data records: %r",
-            fhir_data and fhir_data.get(
-                'entry') and len(fhir_data.get('entry')),
-        )
-
-        if fhir_data is None or 'entry' not in fhir_data or not fhir_data['entry']:
-            delete_memoized(fetch_member_data, context[
-                            'member'], 'sharemyhealth')
+        logging.debug("fhir_data records: %r", len(fhir_data))
 
         if resource_name == 'list':
-            # all_records = RECORDS_STU3
-            all_records = view_filter(RECORDS_STU3, 'provider')
-
-            summarized_records = []
-            for record in all_records:
-                if record['call_type'].lower() == "fhir":
-                    # print("record processing for ", record['name'])
-                    entries = get_converted_fhir_resource(
-                        fhir_data, record['resources'])
-                    if 'unique' in record:
-                        print("", record['name'], " has ", record['unique'])
-                        # We need to filter duplicates
-                        entries = filter_unique(entries['entry'], record)
-                    record['data'] = entries['entry']
-                    record['count'] = len(entries['entry'])
-                    summarized_records.append(record)
-                elif record['call_type'].lower() == 'custom':
-                    if record['name'] == 'VitalSigns':
-                        entries = get_vital_signs(fhir_data, record)
-                        record['data'] = entries['entry']
-                        record['count'] = len(entries['entry'])
-                        summarized_records.append(record)
-                    elif record['name'] == 'LabResults':
-                        entries = get_lab_results(fhir_data, record)
-                        record['data'] = entries['entry']
-                        record['count'] = len(entries['entry'])
-                        summarized_records.append(record)
-                else:  # skip
-                    pass
+            # per-request summaries: the shared profiles are never modified
+            summarized_records = summarize_records(fhir_data, view_profiles('provider'))
+            for summary in summarized_records:
+                if summary['name'] == 'Practitioner':
+                    # when and where the member saw each practitioner
+                    practitioner_encounter(summary.data, encounter_index(fhir_data))
 
             context.setdefault('return_to_view', return_to_view)
             context.setdefault('all_records', summarized_records)
 
         else:
-            resource_profile = RECORDS_STU3[
-                find_index(RECORDS_STU3, "slug", resource_name)]
+            resource_profile = get_profile(resource_name)
+            if resource_profile is None:
+                raise Http404()
 
             # print("Resource Profile", resource_profile)
 
@@ -575,10 +503,12 @@ class ProvidersView(LoginRequiredMixin, SelfOrApprovedOrgMixin, TemplateView):
 
             title = resource_profile['display']
             if resource_profile['call_type'] == 'custom':
-                if resource_profile['slug'] == 'labresults':
-                    entries = get_lab_results(fhir_data, resource_profile)
-                elif resource_profile['slug'] == 'vitalsigns':
-                    entries = get_vital_signs(fhir_data, resource_profile)
+                # lab results or vital signs, split as on the list page
+                buckets = RecordBuckets(fhir_data, [resource_profile])
+                entries = {
+                    'entry': buckets.entries(resource_profile) or [],
+                    'folded': buckets.folded.get(resource_profile['slug'], 0),
+                }
             elif resource_profile['call_type'] == 'skip':
                 entries = {'entry': []}
             else:
@@ -601,6 +531,9 @@ class ProvidersView(LoginRequiredMixin, SelfOrApprovedOrgMixin, TemplateView):
                     print("", record['name'], " has ", record['unique'])
                     # We need to filter duplicates
                     entries = filter_unique(entries['entry'], record)
+                if resource_profile['name'] == 'Practitioner':
+                    # when and where the member saw each practitioner
+                    practitioner_encounter(entries['entry'], encounter_index(fhir_data))
 
             content_list = path_extract(entries['entry'], resource_profile)
             context.setdefault('friendly_fields', find_list_entry(
@@ -610,6 +543,10 @@ class ProvidersView(LoginRequiredMixin, SelfOrApprovedOrgMixin, TemplateView):
             context.setdefault('exclude', exclude)
             # context.setdefault('content_list', content_list)
             context.setdefault('resource_profile', resource_profile)
+            # the duplicates left out of the records (on the profile's 'unique')
+            context.setdefault('folded', entries.get('folded', 0))
+            # to name the references that have no display
+            context.setdefault('graph', reference_graph(fhir_data))
             # sorted_content = sort_json(content_list, sort_field)
             # context.setdefault('content_list', sorted_content)
             context.setdefault('content_list', content_list)
@@ -624,21 +561,19 @@ class ProviderDetailView(LoginRequiredMixin, SelfOrApprovedOrgMixin, TemplateVie
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['member'] = self.get_member()
-        data = fetch_member_data(context['member'], 'sharemyhealth')
+        data = fetch_member_resources(context['member'], 'sharemyhealth', ['Practitioner'])
         context['updated_at'] = parse_timestamp(data.get('updated_at'))
+        context['data_stale'] = data.get('stale', False)
+        context['data_partial'] = data.get('partial', False)
         context = context_updated_at(context)
         ###
         # this will only pull a local fhir file if VPC_ENV is local
         fhir_data = load_test_fhir_data(data)
         # fhir_data = data.get('fhir_data')
 
-        if fhir_data is None or 'entry' not in fhir_data or not fhir_data['entry']:
-            delete_memoized(fetch_member_data, context[
-                'member'], 'sharemyhealth')
-
         # all_records = view_filter(RECORDS_STU3, 'provider')
         practitioner_set = get_converted_fhir_resource(
-            fhir_data, " Practitioner")
+            fhir_data, "Practitioner")
         context['practitioner'] = practitioner_set['entry']
 
         if not context['practitioner']:
@@ -680,10 +615,10 @@ class DataSourcesView(LoginRequiredMixin, SelfOrApprovedOrgMixin, TemplateView):
                 access_token = social_auth.extra_data.get('access_token')
                 backend_api_responses = fetch_backend_api_responses(
                     access_token)
-                if "YOUR SEARCH CRITERIA YIELDED MULTIPLE MATCHES" in backend_api_responses['patient_search_response']:
+                if "YOUR SEARCH CRITERIA YIELDED MULTIPLE MATCHES" in backend_api_responses.get('patient_search_response', ''):
                     context["search_error"] = """YOUR SEARCH CRITERIA FOR HIXNY YIELDED MULTIPLE MATCHES.
                                                  PLEASE PROVIDE ADDITIONAL INFORMATION TO GET AN EXACT MATCH."""
-                elif "NO MATCH FOUND" in backend_api_responses['patient_search_response']:
+                elif "NO MATCH FOUND" in backend_api_responses.get('patient_search_response', ''):
                     context["search_error"] = """NO MATCH FOUND IN HIXNY."""
                 else:
                     context["search_error"] = ""
@@ -774,6 +709,16 @@ class DeleteMemberView(LoginRequiredMixin, SelfOrApprovedOrgMixin, DeleteView):
 
         return context
 
+    def delete(self, request, *args, **kwargs):
+        member = self.get_object()
+        # drop the member's cached data from every provider (which also
+        # invalidates the rest), while their connections are still known
+        for provider in set(member.social_auth.values_list('provider', flat=True)):
+            evict_member_data(member, provider)
+        response = super().delete(request, *args, **kwargs)
+        invalidate_member(member)
+        return response
+
     def get_success_url(self):
         return reverse('logout') + '?next=' + settings.REMOTE_ACCOUNT_DELETE_ENDPOINT
 
@@ -840,6 +785,8 @@ def approve_resource_request(request, pk):
         resource_class_path=resource_request.resource_class_path,
         resource_request=resource_request,
     )
+    # the organization's agents will look at the member's data next
+    enqueue_warm_up(resource_request.member)
 
     if request.GET.get('next'):
         return redirect(request.GET['next'])
@@ -870,6 +817,7 @@ def revoke_resource_request(request, pk):
     # ResourceGrant, if any
     if getattr(resource_request, 'resourcegrant', None):
         resource_request.resourcegrant.delete()
+        invalidate_member(resource_request.member)
 
     if request.GET.get('next'):
         return redirect(request.GET['next'])
@@ -933,6 +881,7 @@ def resource_request_response(request):
                 resource_class_path=resource_request.resource_class_path,
                 resource_request=resource_request,
             ).delete()
+            invalidate_member(resource_request.member)
         elif resource_request.status == REQUEST_APPROVED:
             # make sure there is a ResourceGrant object associated with this
             # ResourceRequest
@@ -942,6 +891,7 @@ def resource_request_response(request):
                 resource_class_path=resource_request.resource_class_path,
                 resource_request=resource_request,
             )
+            enqueue_warm_up(resource_request.member)
     else:
         return HttpResponse(json.dumps(form.errors), status=422)
 
@@ -954,11 +904,15 @@ def resource_request_response(request):
 @require_POST
 @login_required(login_url='home')
 def refresh_member_data(request, pk):
-    """Only allow members to refresh their own data"""
+    """
+    Only allow members to refresh their own data. The refresh is queued (see
+    apps.member.jobs) and its progress is polled from refresh-data-status.
+    """
     member = get_object_or_404(get_user_model().objects.filter(pk=pk))
     if member == request.user:
-        delete_memoized(fetch_member_data, member, 'sharemyhealth')
-        fetch_member_data(member, 'sharemyhealth', refresh=True)
+        job = enqueue_refresh(member, 'sharemyhealth')
+        if request.is_ajax():
+            return JsonResponse(job.as_dict(), status=202)
     else:
         print(
             "refresh not allowed: request.user %r != member %r" % (
@@ -969,3 +923,13 @@ def refresh_member_data(request, pk):
         return redirect(request.POST['next'])
     else:
         return redirect(reverse('member:records', member.id))
+
+
+class RefreshStatusView(LoginRequiredMixin, SelfOrApprovedOrgMixin, View):
+    """JSON status of the member's latest data refresh, polled by the records and timeline pages"""
+
+    def get(self, request, *args, **kwargs):
+        job = MemberDataRefresh.objects.filter(member=self.get_member(), refresh=True).last()
+        if job is None:
+            return JsonResponse({'status': None, 'active': False})
+        return JsonResponse(job.as_dict())
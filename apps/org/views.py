@@ -1,7 +1,6 @@
 import json
 import uuid
 
-import requests
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.mixins import LoginRequiredMixin
@@ -16,8 +15,9 @@ from django.views.generic.edit import FormView
 from social_django.models import UserSocialAuth
 
 from apps.notifications.models import Notification
-from apps.users.utils import refresh_access_token
+from apps.users.utils import get_access_token, refresh_access_token
 from libs.qrcode import make_qr_code
+from smh_app import upstream
 
 from .forms import (
     CreateNewMemberAtOrgForm,
@@ -74,6 +74,32 @@ class OrgCreateMemberMixin:
             username=username,
         )
 
+    def vmi_request(self, method, url, social_auth, **kwargs):
+        """
+        Make a request to VMI with social_auth's access token, refreshed
+        first if it is about to expire. If VMI rejects the token anyway,
+        refresh it and repeat the request once.
+        Raises upstream.RequestException if VMI could not be reached.
+        """
+        access_token = get_access_token(social_auth)
+        headers = {'Authorization': "Bearer {}".format(access_token)}
+        response = upstream.request(method, url, headers=headers, **kwargs)
+        if response.status_code in [401, 403]:
+            refreshed = refresh_access_token(social_auth, access_token)
+            if refreshed:  # repeat the previous request
+                headers = {'Authorization': "Bearer {}".format(social_auth.access_token)}
+                response = upstream.request(method, url, headers=headers, **kwargs)
+        return response
+
+    def vmi_unavailable(self):
+        """Show the user that VMI could not be reached."""
+        self.errors = {
+            'vmi': 'Could not reach {}. Please try again.'.format(
+                'verifymyidentity-openidconnect'
+            )
+        }
+        return self.render_to_response(self.get_context_data())
+
     def get_context_data(self, **kwargs):
         """Get the context data for the template."""
         kwargs.setdefault('organization', self.organization)
@@ -163,19 +189,11 @@ class OrgCreateMemberView(LoginRequiredMixin, OrgCreateMemberMixin, FormView):
         }
         # POST the data to VMI
         url = settings.SOCIAL_AUTH_VERIFYMYIDENTITY_OPENIDCONNECT_HOST + '/api/v1/user/'
-        headers = {
-            'Authorization': "Bearer {}".format(request_user_social_auth.access_token)
-        }
-        response = requests.post(url=url, data=data, headers=headers)
-        if response.status_code in [401, 403]:
-            refreshed = refresh_access_token(request_user_social_auth)
-            if refreshed:  # repeat the previous request
-                headers = {
-                    'Authorization': "Bearer {}".format(
-                        request_user_social_auth.access_token
-                    )
-                }
-                response = requests.post(url=url, data=data, headers=headers)
+        try:
+            response = self.vmi_request(
+                'post', url, request_user_social_auth, data=data)
+        except upstream.RequestException:
+            return self.vmi_unavailable()
 
         # 3.) Create a new Member with the response from VMI.
         # If the request successfully created a user in VMI, then use that data
@@ -287,20 +305,11 @@ class OrgCreateMemberBasicInfoView(LoginRequiredMixin, OrgCreateMemberMixin, For
         url = '{}/api/v1/user/{}/'.format(
             settings.SOCIAL_AUTH_VERIFYMYIDENTITY_OPENIDCONNECT_HOST, member_social_auth.uid
         )
-        headers = {
-            'Authorization': "Bearer {}".format(request_user_social_auth.access_token)
-        }
-        response = requests.put(url=url, data=data, headers=headers)
-
-        if response.status_code in [401, 403]:
-            refreshed = refresh_access_token(request_user_social_auth)
-            if refreshed:  # repeat the previous request
-                headers = {
-                    'Authorization': "Bearer {}".format(
-                        request_user_social_auth.access_token
-                    )
-                }
-                response = requests.put(url=url, data=data, headers=headers)
+        try:
+            response = self.vmi_request(
+                'put', url, request_user_social_auth, data=data)
+        except upstream.RequestException:
+            return self.vmi_unavailable()
 
         # 4.) Update a new Member with the response from VMI.
         # If the request successfully updated a user in VMI, then use that data
@@ -387,11 +396,6 @@ class OrgCreateMemberVerifyIdentityView(
                 }
                 return self.render_to_response(self.get_context_data())
 
-            headers = {
-                'Authorization': "Bearer {}".format(
-                    request_user_social_auth.access_token
-                )
-            }
             # 4.) Make a request to VMI to update the user's identity assurance
             url = '{}/api/v1/user/{}/id-assurance/'.format(
                 settings.SOCIAL_AUTH_VERIFYMYIDENTITY_OPENIDCONNECT_HOST, member_social_auth.uid
@@ -400,18 +404,11 @@ class OrgCreateMemberVerifyIdentityView(
             data = {'subject_user': member_social_auth.uid, **form_data}
 
             # POST the data to the VMI endpoint for identity verification
-            response = requests.post(url=url, json=data, headers=headers)
-
-            if response.status_code in [401, 403]:
-                refreshed = refresh_access_token(request_user_social_auth)
-                if refreshed:  # repeat the previous request
-                    headers = {
-                        'Authorization': "Bearer {}".format(
-                            request_user_social_auth.access_token
-                        )
-                    }
-                    response = requests.post(
-                        url=url, json=data, headers=headers)
+            try:
+                response = self.vmi_request(
+                    'post', url, request_user_social_auth, json=data)
+            except upstream.RequestException:
+                return self.vmi_unavailable()
 
             if response.status_code != 201:
                 # The request to update a user in VMI did not succeed, so show
@@ -638,20 +635,11 @@ class OrgCreateMemberCompleteView(OrgCreateMemberMixin, FormView):
         url = '{}/api/v1/user/{}/'.format(
             settings.SOCIAL_AUTH_VERIFYMYIDENTITY_OPENIDCONNECT_HOST, request_user_social_auth.uid
         )
-        headers = {
-            'Authorization': "Bearer {}".format(org_user_social_auth.access_token)
-        }
-        response = requests.put(url=url, data=data, headers=headers)
-
-        if response.status_code in [401, 403]:
-            refreshed = refresh_access_token(org_user_social_auth)
-            if refreshed:  # repeat the previous request
-                headers = {
-                    'Authorization': "Bearer {}".format(
-                        org_user_social_auth.access_token
-                    )
-                }
-                response = requests.put(url=url, data=data, headers=headers)
+        try:
+            response = self.vmi_request(
+                'put', url, org_user_social_auth, data=data)
+        except upstream.RequestException:
+            return self.vmi_unavailable()
 
         if response.status_code == 200:
             response_data_dict = json.loads(response.content)
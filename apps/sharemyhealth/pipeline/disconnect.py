@@ -3,20 +3,29 @@
 # vim: ai ts=4 sts=4 et sw=4
 
 from social_django.models import UserSocialAuth
-import requests
 from django.conf import settings
 import logging
-from memoize import delete_memoized
-from ...member.utils import fetch_member_data
+from smh_app import upstream
+from ...member.cache import evict_member_data
+from ...member.snapshots import delete_snapshots
 __author__ = "Alan Viars"
 
 logger = logging.getLogger('smhapp_.%s' % __name__)
 
 
 def delete_memory(backend, user, *args, **kwargs):
-    """This should prevent a view of data after disconnect"""
+    """This should prevent a view of data after disconnect (in every worker: the cache is shared)"""
     if backend.name == 'sharemyhealth':
-        delete_memoized(fetch_member_data, user, backend.name)
+        evict_member_data(user, backend.name)
+        delete_snapshots(user, backend.name)
+
+
+def post_revocation(url, post_data):
+    """POST a token revocation; returns the response, or None if url could not be reached"""
+    try:
+        return upstream.post(url, data=post_data)
+    except upstream.RequestException:
+        return None
 
 
 def remote_revoke(backend, user, *args, **kwargs):
@@ -31,17 +40,17 @@ def remote_revoke(backend, user, *args, **kwargs):
                          "client_secret": settings.SOCIAL_AUTH_SHAREMYHEALTH_SECRET,
                          "token": usa.extra_data['access_token']}
 
-            request_response_access_token = requests.post(
-                backend.REVOKE_TOKEN_URL, data=post_data)
+            request_response_access_token = post_revocation(
+                backend.REVOKE_TOKEN_URL, post_data)
 
             logger.info("access_token revocation to %s returned %s status for user  %s %s." % (backend.REVOKE_TOKEN_URL,
-                                                                                               request_response_access_token.status_code,
+                                                                                               getattr(request_response_access_token, 'status_code', None),
                                                                                                user.first_name.title(),
                                                                                                user.last_name.title(),))
 
-            if request_response_access_token.status_code != 200:
+            if getattr(request_response_access_token, 'status_code', None) != 200:
                 logger.error("access_token revocation to %s returned %s status for user  %s %s." % (backend.REVOKE_TOKEN_URL,
-                                                                                                    request_response_access_token.status_code,
+                                                                                                    getattr(request_response_access_token, 'status_code', None),
                                                                                                     user.first_name.title(),
                                                                                                     user.last_name.title(),))
 
@@ -50,17 +59,17 @@ def remote_revoke(backend, user, *args, **kwargs):
                          "client_secret": settings.SOCIAL_AUTH_SHAREMYHEALTH_SECRET,
                          "token": usa.extra_data['refresh_token']}
 
-            request_response_refresh_token = requests.post(
-                backend.REVOKE_TOKEN_URL, data=post_data)
+            request_response_refresh_token = post_revocation(
+                backend.REVOKE_TOKEN_URL, post_data)
 
             logger.info("refresh token revocation to %s returned %s status for user  %s %s." % (backend.REVOKE_TOKEN_URL,
-                                                                                                request_response_refresh_token.status_code,
+                                                                                                getattr(request_response_refresh_token, 'status_code', None),
                                                                                                 user.first_name.title(),
                                                                                                 user.last_name.title(),))
 
-            if request_response_refresh_token.status_code != 200:
+            if getattr(request_response_refresh_token, 'status_code', None) != 200:
                 logger.error("refresh token revocation to %s returned %s status for user  %s %s." % (backend.REVOKE_TOKEN_URL,
-                                                                                                     request_response_refresh_token.status_code,
+                                                                                                     getattr(request_response_refresh_token, 'status_code', None),
                                                                                                      user.first_name.title(),
                                                                                                      user.last_name.title(),))
 
@@ -1,7 +1,9 @@
 from django.conf import settings
-from requests_oauthlib import OAuth2Session
 from social_django.models import UserSocialAuth
 
+from apps.users.utils import get_access_token, refresh_access_token
+from smh_app import upstream
+
 
 class Resource(object):
     """A python wrapper around the social_django.models.UserSocialAuth class."""
@@ -33,33 +35,14 @@ class Resource(object):
 
     def get(self, record_type):
         """GET the data from the self.url_for_data."""
-        # A dictioary of token data for this resource
-        token_dict = {
-            'access_token': self.db_object.access_token,
-            'refresh_token': self.db_object.extra_data['refresh_token'],
-            'token_type': 'Bearer',
-            'expires_in': 3600,
-        }
-        if self.db_object.extra_data.get('auth_time', False):
-            # TODO: the 3600 expires_in should also be gleaned from the returned token
-            token_dict['expires_at'] = self.db_object.extra_data['auth_time'] + 3600
-
-        # Other data sent as a part of the request
-        extra = {'client_id': self.client_id, 'client_secret': self.client_secret}
         # The URL for the request
         url = self.url_for_data.format(record_type=record_type)
 
-        client = OAuth2Session(
-            self.client_id,
-            token=token_dict,
-            auto_refresh_url=self.url_token_refresh,
-            auto_refresh_kwargs=extra,
-            token_updater=self.token_saver,
-        )
-        response = client.get(url)
+        # refreshed ahead of its expiry, and again if it is rejected anyway
+        access_token = get_access_token(self.db_object)
+        response = upstream.get(url, headers={'Authorization': 'Bearer %s' % access_token})
+        if response.status_code in [401, 403] and refresh_access_token(self.db_object, access_token):
+            response = upstream.get(
+                url, headers={'Authorization': 'Bearer %s' % self.db_object.access_token}
+            )
         return response
-
-    def token_saver(self, token):
-        """Save the token to the self.db_object."""
-        self.db_object.access_token = token
-        self.db_object.save()
@@ -0,0 +1,137 @@
+import hashlib
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from time import time
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from social_django.models import UserSocialAuth
+
+from apps.member.models import FlightLock
+from apps.member.singleflight import DatabaseLocks
+
+from ..utils import get_access_token, refresh_access_token, token_expiring
+
+
+class TokenHandler(BaseHTTPRequestHandler):
+    """Serves a new access token at /o/token/, counting the refreshes"""
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.server.refreshes += 1
+        body = json.dumps({
+            'access_token': 'access-%d' % self.server.refreshes,
+            'refresh_token': 'refresh-%d' % self.server.refreshes,
+            'expires_in': 3600,
+        }).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TokenRefreshTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = HTTPServer(('127.0.0.1', 0), TokenHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.server.refreshes = 0
+        self.social_auth = UserSocialAuth.objects.create(
+            user=get_user_model().objects.create(username='token-member'),
+            provider='sharemyhealth',
+            uid='token-member',
+            extra_data={
+                'access_token': 'access-0',
+                'refresh_token': 'refresh-0',
+                'auth_time': int(time()) - 3590,
+                'expires': 3600,
+            },
+        )
+        host = 'http://127.0.0.1:%d' % self.server.server_port
+        self.settings_override = self.settings(SOCIAL_AUTH_SHAREMYHEALTH_HOST=host, TOKEN_REFRESH_MARGIN=60)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+    def test_expiring_token_is_refreshed_first(self):
+        self.assertTrue(token_expiring(self.social_auth))
+        self.assertEqual(get_access_token(self.social_auth), 'access-1')
+        self.assertFalse(token_expiring(self.social_auth))
+        self.assertEqual(get_access_token(self.social_auth), 'access-1')
+        self.assertEqual(self.server.refreshes, 1)
+        self.social_auth.refresh_from_db()
+        self.assertEqual(self.social_auth.extra_data['refresh_token'], 'refresh-1')
+
+    def test_token_without_expiry_is_used_as_is(self):
+        del self.social_auth.extra_data['expires']
+        self.assertEqual(get_access_token(self.social_auth), 'access-0')
+        self.assertEqual(self.server.refreshes, 0)
+
+    def test_one_refresh_per_token(self):
+        # another request holding the same row refreshes the token first
+        other = UserSocialAuth.objects.get(pk=self.social_auth.pk)
+        self.assertTrue(refresh_access_token(other, 'access-0'))
+
+        self.assertTrue(refresh_access_token(self.social_auth, 'access-0'))
+        self.assertEqual(self.social_auth.extra_data['access_token'], 'access-1')
+        self.assertEqual(self.server.refreshes, 1)
+
+    def test_token_refreshed_meanwhile_is_kept(self):
+        def refreshed_meanwhile(provider, extra_data):
+            # another worker stores its token while this one asks for one
+            UserSocialAuth.objects.filter(pk=self.social_auth.pk).update(
+                extra_data=dict(extra_data, access_token='access-other'))
+            return {'access_token': 'access-mine', 'refresh_token': 'refresh-mine', 'auth_time': time()}
+
+        with mock.patch('apps.users.utils.request_token_refresh', refreshed_meanwhile):
+            self.assertTrue(refresh_access_token(self.social_auth, 'access-0'))
+        self.assertEqual(self.social_auth.extra_data['access_token'], 'access-other')
+        self.social_auth.refresh_from_db()
+        self.assertEqual(self.social_auth.extra_data['access_token'], 'access-other')
+
+
+class TokenRefreshLockTests(TransactionTestCase):
+
+    def setUp(self):
+        self.social_auth = UserSocialAuth.objects.create(
+            user=get_user_model().objects.create(username='locked-token-member'),
+            provider='sharemyhealth',
+            uid='locked-token-member',
+            extra_data={'access_token': 'access-0', 'refresh_token': 'refresh-0'},
+        )
+
+    def test_refresh_by_another_worker_is_waited_for(self):
+        # another worker holds the lock of the token in the database
+        key = 'token_refresh:%s:%s:lock' % (
+            self.social_auth.pk, hashlib.sha256(b'access-0').hexdigest())
+        locks = DatabaseLocks()
+        self.assertTrue(locks.add(key, 'other', 10))
+        self.assertFalse(any('access-0' in key for key in FlightLock.objects.values_list('key', flat=True)))
+
+        def other_worker():
+            UserSocialAuth.objects.filter(pk=self.social_auth.pk).update(
+                extra_data={'access_token': 'access-other', 'refresh_token': 'refresh-other'})
+            locks.delete(key)
+            connection.close()
+
+        threading.Timer(0.2, other_worker).start()
+        with mock.patch('apps.users.utils.request_token_refresh') as request_token_refresh:
+            self.assertTrue(refresh_access_token(self.social_auth, 'access-0'))
+        request_token_refresh.assert_not_called()
+        self.assertEqual(self.social_auth.extra_data['access_token'], 'access-other')
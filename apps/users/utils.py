@@ -1,13 +1,28 @@
+import hashlib
 import logging
 from time import time
 
-import requests
 from django.conf import settings
+from django.db import transaction
 from jwkest.jwt import JWT
 
+from apps.member.singleflight import DatabaseLocks, SingleFlight
+from smh_app import upstream
+
 log = logging.getLogger(__name__)
 
 
+# refreshes of the same token, coalesced within and across workers. The locks
+# are in the database: with single-use refresh tokens, two workers refreshing
+# at once (which a cache lock without an atomic add() allows) would leave one
+# of them with invalid_grant.
+token_refresh_flight = SingleFlight(
+    DatabaseLocks(),
+    lock_timeout=settings.TOKEN_REFRESH_LOCK_TIMEOUT,
+    wait_timeout=settings.TOKEN_REFRESH_LOCK_TIMEOUT,
+)
+
+
 def get_id_token_payload(user):
     # Get the ID Token and parse it, return a JSON string.
     try:
@@ -24,11 +39,112 @@ def get_id_token_payload(user):
     return parsed_id_token
 
 
-def refresh_access_token(social_auth):
+def token_expires_at(social_auth):
+    """
+    :param social_auth: UserSocialAuth
+    :return: when the access token expires (epoch seconds), or None if that is not known
+    """
+    extra_data = social_auth.extra_data or {}
+    expires = extra_data.get('expires_in') or extra_data.get('expires')
+    if not expires:
+        return None
+    expires = int(expires)
+    if expires > time():
+        # already a timestamp
+        return expires
+    auth_time = extra_data.get('auth_time')
+    if not auth_time:
+        return None
+    return auth_time + expires
+
+
+def token_expiring(social_auth, margin=None):
+    """
+    :param social_auth: UserSocialAuth
+    :param margin: seconds before the expiry to count as expiring (default: settings.TOKEN_REFRESH_MARGIN)
+    :return: whether the access token expires within margin seconds
+    """
+    if margin is None:
+        margin = settings.TOKEN_REFRESH_MARGIN
+    expires_at = token_expires_at(social_auth)
+    return expires_at is not None and expires_at - margin <= time()
+
+
+def get_access_token(social_auth):
+    """
+    Get social_auth's access token, refreshing it first if it is about to
+    expire, so that requests made with it are not rejected.
+    :param social_auth: UserSocialAuth
+    :return: the access token, or None
+    """
+    if token_expiring(social_auth) and 'refresh_token' in social_auth.extra_data:
+        refresh_access_token(social_auth)
+    return social_auth.extra_data.get('access_token')
+
+
+def refresh_access_token(social_auth, access_token=None):
+    """
+    Refresh social_auth's access token, one refresh at a time per
+    UserSocialAuth: concurrent refreshes (in any worker) are coalesced
+    (token_refresh_flight), and a token that another request refreshed in the
+    meantime is used rather than refreshed again (the refresh token may be
+    single-use). The row is only locked to read and to write the token, not
+    while the provider is asked for a new one.
+    :param social_auth: UserSocialAuth; its extra_data is updated
+    :param access_token: the token that was rejected or is expiring (default: the current one)
+    :return: whether social_auth has a new access token
+    """
     log.debug(f'refresh_access_token() {social_auth.user} {social_auth.provider}')
-    if 'refresh_token' in social_auth.extra_data:
-        refresh_token = social_auth.extra_data['refresh_token']
-        provider_upper = social_auth.provider.upper()
+    if access_token is None:
+        access_token = social_auth.extra_data.get('access_token')
+    model = type(social_auth)
+
+    def load():
+        # the token that another worker refreshed, if it has
+        extra_data = model.objects.get(pk=social_auth.pk).extra_data
+        if extra_data.get('access_token') != access_token:
+            return extra_data
+        return None
+
+    def refresh():
+        with transaction.atomic():
+            extra_data = model.objects.select_for_update().get(pk=social_auth.pk).extra_data
+        if extra_data.get('access_token') != access_token:
+            log.debug(f"refreshed=True (concurrently) {social_auth.user} {social_auth.provider}")
+            return extra_data
+        token = request_token_refresh(social_auth.provider, extra_data)
+        if token is None:
+            return None
+        with transaction.atomic():
+            locked = model.objects.select_for_update().get(pk=social_auth.pk)
+            # only replace the token that was refreshed
+            if locked.extra_data.get('access_token') == access_token:
+                locked.extra_data.update(token)
+                locked.save(update_fields=['extra_data'])
+        return locked.extra_data
+
+    # the token itself is not written anywhere (e.g. in logs)
+    token_hash = hashlib.sha256((access_token or '').encode('utf-8')).hexdigest()
+    extra_data = token_refresh_flight.do(
+        'token_refresh:%s:%s' % (social_auth.pk, token_hash), load, refresh)
+    if extra_data is None:
+        return False
+    social_auth.extra_data = extra_data
+    return True
+
+
+def request_token_refresh(provider, extra_data):
+    """
+    Ask the provider for a new access token with the refresh token in
+    extra_data. Use refresh_access_token() rather than calling this directly.
+    :param provider: UserSocialAuth.provider, e.g. 'sharemyhealth'
+    :param extra_data: UserSocialAuth.extra_data
+    :return: the new token ({'access_token', 'refresh_token', 'expires_in',
+        'auth_time'}), or None if it could not be refreshed
+    """
+    if 'refresh_token' in extra_data:
+        refresh_token = extra_data['refresh_token']
+        provider_upper = provider.upper()
         host = getattr(settings, f"SOCIAL_AUTH_{provider_upper}_HOST", None)
         if host:
             refresh_url = f"{host}/o/token/"
@@ -42,10 +158,13 @@ def refresh_access_token(social_auth):
                 'client_id': client_id,
                 'client_secret': client_secret,
             }
-            refresh_response = requests.post(refresh_url, data=refresh_data)
+            try:
+                refresh_response = upstream.post(refresh_url, data=refresh_data)
+            except upstream.RequestException:
+                return None
             if refresh_response.status_code == 200:
                 log.debug(f"refreshed=True {refresh_response.json()}")
-                social_auth.extra_data.update(
+                return dict(
                     auth_time=time(),
                     **{
                         k: v
@@ -53,5 +172,4 @@ def refresh_access_token(social_auth):
                         if k in ['access_token', 'refresh_token', 'expires_in']
                     },
                 )
-                social_auth.save()
-                return True
+    return None
@@ -6,10 +6,10 @@ from django.contrib.auth.decorators import login_required
 from django.http import HttpResponseRedirect
 from django.shortcuts import redirect, render, reverse
 from django.utils.translation import ugettext_lazy as _
-from requests_oauthlib import OAuth2Session
 from social_django.models import UserSocialAuth
 
-from apps.users.utils import refresh_access_token
+from apps.users.utils import get_access_token, refresh_access_token
+from smh_app import upstream
 
 logger = logging.getLogger('smhapp_.%s' % __name__)
 
@@ -20,19 +20,17 @@ def mylogout(request):
             # Attempt a remote logout.
             social = request.user.social_auth.get(
                 provider='verifymyidentity-openidconnect')
-            token = social.extra_data['access_token']
-            oas = OAuth2Session(token=token)
-            oas.access_token = token
+            token = get_access_token(social)
             remote_logout = settings.REMOTE_LOGOUT_ENDPOINT
-            response = oas.get(remote_logout)
+            response = upstream.get(
+                remote_logout, headers={'Authorization': 'Bearer %s' % token})
             print(response.status_code, response.content)
             if response.status_code in [401, 403]:
-                refreshed = refresh_access_token(social)
+                refreshed = refresh_access_token(social, token)
                 if refreshed:
                     token = social.extra_data['access_token']
-                    oas = OAuth2Session(token=token)
-                    oas.access_token = token
-                    response = oas.get(remote_logout)
+                    response = upstream.get(
+                        remote_logout, headers={'Authorization': 'Bearer %s' % token})
                     print(response.status_code, response.content)
 
             logger.info(
@@ -41,6 +39,12 @@ def mylogout(request):
             )
         except UserSocialAuth.DoesNotExist:
             pass
+        except upstream.RequestException:
+            # the local logout below still happens
+            logger.info(
+                _("%s remote logout of %s failed: could not reach the endpoint")
+                % (request.user, settings.REMOTE_LOGOUT_ENDPOINT)
+            )
         except UserSocialAuth.MultipleObjectsReturned:
             logger.info(
                 _("%s remote logout of %s failed: Multiple Objects Returned")
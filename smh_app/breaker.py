@@ -0,0 +1,187 @@
+# Circuit breakers for the upstream hosts (sharemyhealth, VMI)
+#
+# When an upstream host is down or overloaded, every request to it waits for
+# the connect/read timeouts (and retries) before failing, and web workers pile
+# up behind it. Each host gets a breaker that counts the failures of requests
+# to it (connection errors, timeouts, 502/503/504 responses: not other 5xx,
+# which the host answers when it is up). After
+# UPSTREAM_BREAKER_THRESHOLD failures within UPSTREAM_BREAKER_WINDOW seconds it
+# opens: requests to the host fail at once with CircuitOpen for
+# UPSTREAM_BREAKER_RESET_TIMEOUT seconds. Then a single request is let through
+# as a probe (half-open); if it succeeds the breaker closes, and if it fails
+# the breaker opens again.
+#
+# The state is kept in the shared cache (UPSTREAM_BREAKER_CACHE_ALIAS), so
+# that every worker sees it, and can be inspected with
+# `manage.py upstream_status`. Failures are counted per window-long time
+# bucket, under a key of its own: cache.incr() on some backends (e.g. the
+# file-based cache) sets the key again with the default timeout, which must not
+# extend the window.
+import logging
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger('smhapp_.%s' % __name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+class CircuitOpen(requests.ConnectionError):
+    """Raised instead of making a request to a host whose breaker is open"""
+
+
+class CircuitBreaker(object):
+    """A circuit breaker whose state is kept in a (shared) cache"""
+
+    def __init__(self, name, cache_alias, threshold, window, reset_timeout):
+        """
+        :param name: what the breaker protects, e.g. 'https://sharemy.health'
+        :param cache_alias: the cache that holds the state
+        :param threshold: failures within window that open the breaker (0: never open)
+        :param window: seconds over which failures are counted
+        :param reset_timeout: seconds the breaker stays open before a probe is let through
+        """
+        self.name = name
+        self.cache_alias = cache_alias
+        self.threshold = threshold
+        self.window = window
+        self.reset_timeout = reset_timeout
+
+    def __repr__(self):
+        return '<CircuitBreaker %s>' % self.name
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def key(self, part):
+        return 'breaker:%s:%s' % (self.name, part)
+
+    def failures_key(self, now=None):
+        """
+        :param now: time.time() (default: now)
+        :return: the key of the failures counted in the current window
+        """
+        if now is None:
+            now = time.time()
+        return self.key('failures:%d' % (now // max(self.window, 1)))
+
+    def state(self):
+        """
+        :return: CLOSED, OPEN or HALF_OPEN
+        """
+        entries = self.cache.get_many([self.key('open'), self.key('tripped')])
+        if self.key('open') in entries:
+            return OPEN
+        if self.key('tripped') in entries:
+            return HALF_OPEN
+        return CLOSED
+
+    def allow(self):
+        """
+        :return: whether a request may be made now (when half-open, only one
+            request per reset_timeout is allowed, as the probe)
+        """
+        if not self.threshold:
+            return True
+        state = self.state()
+        if state == OPEN:
+            return False
+        if state == HALF_OPEN:
+            return self.cache.add(self.key('probe'), time.time(), self.reset_timeout)
+        return True
+
+    def record_success(self):
+        """A request succeeded: close the breaker if it was half-open"""
+        if self.threshold and self.state() == HALF_OPEN:
+            self.cache.delete_many([self.key('tripped'), self.key('probe'), self.failures_key()])
+            logger.warning('%r closed', self)
+
+    def record_failure(self):
+        """A request failed: open the breaker if it was half-open or failed threshold times"""
+        if not self.threshold:
+            return
+        if self.state() == HALF_OPEN:
+            self.trip()
+            return
+        # a new key each window: its timeout does not matter (see above)
+        key = self.failures_key()
+        self.cache.add(key, 0, self.window)
+        try:
+            failures = self.cache.incr(key)
+        except ValueError:
+            # expired between add() and incr()
+            failures = 1
+            self.cache.set(key, failures, self.window)
+        if failures >= self.threshold:
+            self.trip()
+
+    def trip(self):
+        """Open the breaker for reset_timeout seconds"""
+        now = time.time()
+        self.cache.set(self.key('open'), now + self.reset_timeout, self.reset_timeout)
+        # half-open after the reset timeout, until a probe succeeds
+        self.cache.set(self.key('tripped'), now, self.reset_timeout * 10)
+        self.cache.delete_many([self.key('probe'), self.failures_key()])
+        logger.warning('%r opened for %ds', self, self.reset_timeout)
+
+    def reset(self):
+        """Close the breaker and forget the failures"""
+        self.cache.delete_many(
+            [self.key('open'), self.key('tripped'), self.key('probe'), self.failures_key()]
+        )
+
+    def status(self):
+        """
+        :return: dict of the state, for monitoring
+        """
+        failures_key = self.failures_key()
+        entries = self.cache.get_many([self.key('open'), self.key('tripped'), failures_key])
+        state = OPEN if self.key('open') in entries else HALF_OPEN if self.key('tripped') in entries else CLOSED
+        return {
+            'name': self.name,
+            'state': state,
+            'failures': entries.get(failures_key, 0),
+            'threshold': self.threshold,
+            'tripped_at': entries.get(self.key('tripped')),
+            'open_until': entries.get(self.key('open')),
+        }
+
+
+def base_url(url):
+    """
+    :return: scheme://host[:port] of url
+    """
+    parts = urlsplit(url)
+    return '%s://%s' % (parts.scheme, parts.netloc)
+
+
+def get_breaker(url):
+    """
+    :param url: a URL on the host
+    :return: the CircuitBreaker of the host of url
+    """
+    name = base_url(url)
+    breaker = _breakers.get(name)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.get(name)
+            if breaker is None:
+                breaker = _breakers[name] = CircuitBreaker(
+                    name,
+                    cache_alias=settings.UPSTREAM_BREAKER_CACHE_ALIAS,
+                    threshold=settings.UPSTREAM_BREAKER_THRESHOLD,
+                    window=settings.UPSTREAM_BREAKER_WINDOW,
+                    reset_timeout=settings.UPSTREAM_BREAKER_RESET_TIMEOUT,
+                )
+    return breaker
@@ -0,0 +1,33 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from smh_app.breaker import get_breaker
+
+
+class Command(BaseCommand):
+    help = 'Show the circuit breaker state of the upstream hosts (sharemyhealth, VMI), as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'urls', nargs='*',
+            help='URLs of the hosts (default: sharemyhealth and VMI)',
+        )
+        parser.add_argument(
+            '--reset', action='store_true',
+            help='Close the breakers and forget their failures',
+        )
+
+    def handle(self, *args, **options):
+        urls = options['urls'] or [
+            settings.SOCIAL_AUTH_SHAREMYHEALTH_HOST,
+            settings.SOCIAL_AUTH_VERIFYMYIDENTITY_OPENIDCONNECT_HOST,
+        ]
+        statuses = []
+        for url in urls:
+            breaker = get_breaker(url)
+            if options['reset']:
+                breaker.reset()
+            statuses.append(breaker.status())
+        self.stdout.write(json.dumps(statuses, indent=2))
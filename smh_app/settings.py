@@ -11,12 +11,13 @@ https://docs.djangoproject.com/en/2.1/ref/settings/
 """
 
 import os
+import tempfile
 
 import dj_database_url
 from django.contrib.messages import constants as messages
 from getenv import env
 
-from .utils import bool_env
+from .utils import bool_env, int_env
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -59,8 +60,9 @@ INSTALLED_APPS = [
     'apps.users',
     'apps.notifications',
     'apps.data',
+    # for its management commands (upstream_status)
+    'smh_app',
     'social_django',
-    'memoize',
 ]
 
 MIDDLEWARE = [
@@ -129,6 +131,96 @@ DATABASES = {
     )
 }
 
+# Caches
+# https://docs.djangoproject.com/en/3.0/topics/cache/
+#
+# 'member_data' holds the FHIR bundles fetched from sharemyhealth (HIXNY). It
+# must be shared by every worker process, or each worker keeps (and fetches)
+# its own copy of every member's data. The file-based default is shared by the
+# workers on one host; to share it between hosts use a memcached or database
+# backend, e.g.
+#   MEMBER_DATA_CACHE_BACKEND=django.core.cache.backends.db.DatabaseCache
+#   MEMBER_DATA_CACHE_LOCATION=member_data_cache  (then: manage.py createcachetable)
+# The cached bundles are PHI: keep file-based locations on a private volume.
+MEMBER_DATA_CACHE_ALIAS = 'member_data'
+# Cached member data is served for up to MEMBER_DATA_CACHE_MAX_AGE seconds;
+# once it is older than MEMBER_DATA_CACHE_TIMEOUT it is refreshed in the
+# background (by up to MEMBER_DATA_REVALIDATE_WORKERS threads per worker) while
+# the stale copy is still served.
+MEMBER_DATA_CACHE_TIMEOUT = int_env(env('MEMBER_DATA_CACHE_TIMEOUT', 300))
+MEMBER_DATA_CACHE_MAX_AGE = int_env(env('MEMBER_DATA_CACHE_MAX_AGE', 3600))
+MEMBER_DATA_REVALIDATE_WORKERS = int_env(env('MEMBER_DATA_REVALIDATE_WORKERS', 2))
+# Cached member data is stored as compressed JSON ('zlib', see
+# apps/member/codec.py), about a tenth the size of the pickled data, or
+# pickled as is ('pickle'), which is faster to read but takes far more memory.
+MEMBER_DATA_CACHE_CODEC = env('MEMBER_DATA_CACHE_CODEC', 'zlib')
+# Each worker keeps the member data it decoded most recently, up to about
+# MEMBER_DATA_MEMORY_CACHE_BYTES of memory (0: decode on every read), plus
+# the indexes derived from it. Not used with the 'pickle' codec.
+MEMBER_DATA_MEMORY_CACHE_BYTES = int_env(env('MEMBER_DATA_MEMORY_CACHE_BYTES', 64 * 1024 * 1024))
+# A fetch that fails or finds no data is not repeated for
+# MEMBER_DATA_FAILURE_TIMEOUT seconds, doubling with each failure in a row up
+# to MEMBER_DATA_FAILURE_MAX_TIMEOUT. A member's refresh or reconnect resets it.
+MEMBER_DATA_FAILURE_TIMEOUT = int_env(env('MEMBER_DATA_FAILURE_TIMEOUT', 30))
+MEMBER_DATA_FAILURE_MAX_TIMEOUT = int_env(env('MEMBER_DATA_FAILURE_MAX_TIMEOUT', 900))
+# Concurrent fetches of the same member's data are coalesced into one: the
+# others wait up to MEMBER_DATA_FETCH_WAIT_TIMEOUT seconds for its result. A
+# lock left by a worker that died mid-fetch expires after ..._LOCK_TIMEOUT.
+MEMBER_DATA_FETCH_LOCK_TIMEOUT = int_env(env('MEMBER_DATA_FETCH_LOCK_TIMEOUT', 120))
+MEMBER_DATA_FETCH_WAIT_TIMEOUT = int_env(env('MEMBER_DATA_FETCH_WAIT_TIMEOUT', 90))
+# A running member data job (apps.member.jobs) records a heartbeat every
+# MEMBER_DATA_JOB_HEARTBEAT seconds; a job without one for four heartbeats is
+# taken for abandoned (its worker stopped) and failed.
+MEMBER_DATA_JOB_HEARTBEAT = int_env(env('MEMBER_DATA_JOB_HEARTBEAT', 15))
+# Bundles that come in pages (link[relation=next]) are fetched up to
+# MEMBER_DATA_MAX_PAGES pages, by up to MEMBER_DATA_PAGE_WORKERS threads at once
+# when the pages can be addressed by offset. MEMBER_DATA_PAGE_SIZE, if set, is
+# sent as _count to ask for pages of that many resources.
+MEMBER_DATA_PAGE_SIZE = int_env(env('MEMBER_DATA_PAGE_SIZE', 0))
+MEMBER_DATA_PAGE_WORKERS = int_env(env('MEMBER_DATA_PAGE_WORKERS', 4))
+MEMBER_DATA_MAX_PAGES = int_env(env('MEMBER_DATA_MAX_PAGES', 200))
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    MEMBER_DATA_CACHE_ALIAS: {
+        'BACKEND': env('MEMBER_DATA_CACHE_BACKEND',
+                       'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': env('MEMBER_DATA_CACHE_LOCATION',
+                        os.path.join(tempfile.gettempdir(), 'smh_app_member_data')),
+        'TIMEOUT': MEMBER_DATA_CACHE_MAX_AGE,
+        'KEY_PREFIX': 'smh',
+    },
+}
+
+# Upstream HTTP client (smh_app.upstream), used for every call to sharemyhealth
+# and VMI: per-host keep-alive connection pools, (connect, read) timeouts in
+# seconds, and retries with exponential backoff for connect errors only.
+UPSTREAM_CONNECT_TIMEOUT = float(env('UPSTREAM_CONNECT_TIMEOUT', 3.05))
+UPSTREAM_READ_TIMEOUT = float(env('UPSTREAM_READ_TIMEOUT', 60))
+UPSTREAM_RETRIES = int_env(env('UPSTREAM_RETRIES', 2))
+UPSTREAM_RETRY_BACKOFF = float(env('UPSTREAM_RETRY_BACKOFF', 0.5))
+UPSTREAM_POOL_MAXSIZE = int_env(env('UPSTREAM_POOL_MAXSIZE', 10))
+
+# OAuth access tokens (sharemyhealth, VMI) are refreshed when they expire
+# within TOKEN_REFRESH_MARGIN seconds, rather than after they are rejected.
+TOKEN_REFRESH_MARGIN = int_env(env('TOKEN_REFRESH_MARGIN', 60))
+# Concurrent refreshes of a token are coalesced with a lock in the database
+# (apps.member.singleflight.DatabaseLocks). A lock left by a dead worker expires
+# after TOKEN_REFRESH_LOCK_TIMEOUT seconds, longer than a token request can take.
+TOKEN_REFRESH_LOCK_TIMEOUT = int_env(env('TOKEN_REFRESH_LOCK_TIMEOUT', 75))
+
+# Circuit breakers (smh_app.breaker): after UPSTREAM_BREAKER_THRESHOLD failed
+# requests (connection errors, timeouts, 502/503/504) to a host within
+# UPSTREAM_BREAKER_WINDOW seconds, requests to it fail at once for
+# UPSTREAM_BREAKER_RESET_TIMEOUT seconds, then one is tried. 0 disables them.
+# The state is kept in the shared member data cache so all workers see it.
+UPSTREAM_BREAKER_THRESHOLD = int_env(env('UPSTREAM_BREAKER_THRESHOLD', 5))
+UPSTREAM_BREAKER_WINDOW = int_env(env('UPSTREAM_BREAKER_WINDOW', 30))
+UPSTREAM_BREAKER_RESET_TIMEOUT = int_env(env('UPSTREAM_BREAKER_RESET_TIMEOUT', 30))
+UPSTREAM_BREAKER_CACHE_ALIAS = MEMBER_DATA_CACHE_ALIAS
+
 MESSAGE_TAGS = {
     messages.DEBUG: 'debug',
     messages.INFO: 'info',
@@ -213,7 +305,9 @@ SOCIAL_AUTH_SHAREMYHEALTH_PIPELINE = [
     'social_core.pipeline.social_auth.associate_user',
     'social_core.pipeline.social_auth.load_extra_data',
     'social_core.pipeline.user.user_details',
+    'apps.member.pipeline.reset_member_data',
     'apps.member.pipeline.connection_notifications',
+    'apps.member.pipeline.warm_member_data',
 ]
 
 if DEBUG:
@@ -0,0 +1,166 @@
+import shutil
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import requests
+from django.test import SimpleTestCase, override_settings
+
+from smh_app import upstream
+from smh_app.breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+
+LOCMEM = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'member_data': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                    'LOCATION': 'breaker_tests'},
+}
+
+
+@override_settings(CACHES=LOCMEM)
+class CircuitBreakerTests(SimpleTestCase):
+
+    def setUp(self):
+        self.breaker = CircuitBreaker(
+            'http://upstream.test', 'default', threshold=3, window=30, reset_timeout=30,
+        )
+        self.addCleanup(self.breaker.reset)
+
+    def test_opens_after_threshold_failures(self):
+        for i in range(2):
+            self.breaker.record_failure()
+        self.assertEqual(self.breaker.state(), CLOSED)
+        self.assertTrue(self.breaker.allow())
+
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state(), OPEN)
+        self.assertFalse(self.breaker.allow())
+        self.assertEqual(self.breaker.status()['state'], OPEN)
+
+    def test_half_open_lets_one_probe_through(self):
+        self.breaker.trip()
+        # the reset timeout passes
+        self.breaker.cache.delete(self.breaker.key('open'))
+        self.assertEqual(self.breaker.state(), HALF_OPEN)
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.breaker.allow())
+
+        # the probe fails: open again
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state(), OPEN)
+
+        self.breaker.cache.delete(self.breaker.key('open'))
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state(), CLOSED)
+        self.assertTrue(self.breaker.allow())
+
+    def test_disabled(self):
+        breaker = CircuitBreaker('http://upstream.test', 'default', threshold=0, window=30, reset_timeout=30)
+        for i in range(10):
+            breaker.record_failure()
+        self.assertTrue(breaker.allow())
+
+
+class FileBasedCircuitBreakerTests(SimpleTestCase):
+    """The default member_data cache is file-based, whose incr() resets a key's timeout"""
+
+    def setUp(self):
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location)
+        caches = dict(LOCMEM, member_data={
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location,
+        })
+        patcher = override_settings(CACHES=caches)
+        patcher.enable()
+        self.addCleanup(patcher.disable)
+        self.breaker = CircuitBreaker(
+            'http://upstream.test', 'member_data', threshold=3, window=30, reset_timeout=30,
+        )
+
+    def test_failures_are_only_counted_within_the_window(self):
+        now = 30000.0
+        with mock.patch('time.time', lambda: now):
+            self.breaker.record_failure()
+            self.breaker.record_failure()
+            self.assertEqual(self.breaker.status()['failures'], 2)
+            now += 31
+            self.breaker.record_failure()
+            self.assertEqual(self.breaker.state(), CLOSED)
+            self.breaker.record_failure()
+            self.breaker.record_failure()
+            self.assertEqual(self.breaker.state(), OPEN)
+
+
+@override_settings(CACHES=LOCMEM)
+class UpstreamFailureTests(SimpleTestCase):
+
+    url = 'http://upstream.test/api'
+
+    def setUp(self):
+        self.breaker = CircuitBreaker(
+            'http://upstream.test', 'default', threshold=1, window=30, reset_timeout=30,
+        )
+        self.addCleanup(self.breaker.reset)
+        self.session = mock.Mock()
+        for name, value in (('get_session', self.session), ('get_breaker', self.breaker)):
+            patcher = mock.patch.object(upstream, name, return_value=value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_server_errors_of_one_request_are_not_host_failures(self):
+        self.session.request.return_value = mock.Mock(status_code=500)
+        upstream.get(self.url)
+        self.assertEqual(self.breaker.state(), CLOSED)
+
+    def test_unavailable_host_is_a_failure(self):
+        self.session.request.return_value = mock.Mock(status_code=503)
+        upstream.get(self.url)
+        self.assertEqual(self.breaker.state(), OPEN)
+
+    def test_timeouts_are_failures(self):
+        self.session.request.side_effect = requests.ReadTimeout()
+        with self.assertRaises(upstream.Timeout):
+            upstream.get(self.url)
+        self.assertEqual(self.breaker.state(), OPEN)
+
+
+class SlowHandler(BaseHTTPRequestHandler):
+    """Answers server.status after server.delay seconds, counting the requests"""
+
+    def do_GET(self):
+        self.server.requests += 1
+        time.sleep(self.server.delay)
+        self.send_response(self.server.status)
+        self.send_header('Content-Length', '0')
+        self.send_header('Retry-After', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@override_settings(CACHES=LOCMEM, UPSTREAM_RETRIES=2, UPSTREAM_RETRY_BACKOFF=0, UPSTREAM_BREAKER_THRESHOLD=0)
+class UpstreamRetryTests(SimpleTestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), SlowHandler)
+        self.server.requests = 0
+        self.server.delay = 0
+        self.server.status = 200
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = 'http://127.0.0.1:%d/' % self.server.server_port
+
+    def test_read_timeouts_are_not_retried(self):
+        self.server.delay = 0.5
+        with self.assertRaises(upstream.Timeout):
+            upstream.get(self.url, timeout=(1, 0.1))
+        self.assertEqual(self.server.requests, 1)
+
+    def test_unavailable_responses_are_not_retried(self):
+        self.server.status = 503
+        self.assertEqual(upstream.get(self.url).status_code, 503)
+        self.assertEqual(self.server.requests, 1)
@@ -0,0 +1,147 @@
+# HTTP client for the upstream services (sharemyhealth, VMI, their token endpoints)
+#
+# A bare requests.get/post opens a new TCP connection (and TLS session) for
+# every call and waits forever if the other end stops answering. Calls made
+# through this module share one requests.Session per upstream host, so
+# connections are pooled and kept alive between requests, and every request
+# has a connect/read timeout and a bounded number of retries of its
+# connection with backoff.
+# Requests to a host that keeps failing are cut short by its circuit breaker
+# (see breaker.py).
+import logging
+import os
+import threading
+from http.cookiejar import DefaultCookiePolicy
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .breaker import CircuitOpen, get_breaker
+
+logger = logging.getLogger('smhapp_.%s' % __name__)
+
+# re-exported so that callers only need to import this module
+RequestException = requests.RequestException
+Timeout = requests.Timeout
+
+# Responses that count as failures of the host for its circuit breaker: it
+# is down or overloaded (other 5xx are errors of one request, e.g. one member's data)
+BREAKER_STATUSES = frozenset([502, 503, 504])
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_timeout():
+    """
+    :return: (connect timeout, read timeout) in seconds
+    """
+    return (settings.UPSTREAM_CONNECT_TIMEOUT, settings.UPSTREAM_READ_TIMEOUT)
+
+
+def get_retry():
+    """
+    :return: urllib3 Retry for the upstream connection pools
+    """
+    # Only connect errors are retried: the request never reached the server.
+    # A read timeout or a 502/503/504 means it was made, and repeating it would
+    # wait again as long (a member's $everything can take most of the read
+    # timeout); the timeout is raised as is, and the response returned.
+    return Retry(
+        total=settings.UPSTREAM_RETRIES,
+        connect=settings.UPSTREAM_RETRIES,
+        read=False,
+        # nor a 503 with a Retry-After
+        respect_retry_after_header=False,
+        backoff_factor=settings.UPSTREAM_RETRY_BACKOFF,
+    )
+
+
+def new_session(base_url):
+    """
+    Create a session with a keep-alive connection pool mounted for base_url
+    :param base_url: scheme://host[:port]
+    :return: requests.Session
+    """
+    session = requests.Session()
+    # The session is shared by every member's requests: never store cookies
+    # from one response and send them with another member's request.
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=settings.UPSTREAM_POOL_MAXSIZE,
+        max_retries=get_retry(),
+    )
+    session.mount(base_url + '/', adapter)
+    return session
+
+
+def get_session(url):
+    """
+    Get the pooled session for the host of url
+    :param url:
+    :return: requests.Session
+    """
+    parts = urlsplit(url)
+    base_url = '%s://%s' % (parts.scheme, parts.netloc)
+    # keyed on the pid too, so that forked workers don't share sockets
+    key = (os.getpid(), base_url)
+    session = _sessions.get(key)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(key)
+            if session is None:
+                session = _sessions[key] = new_session(base_url)
+    return session
+
+
+def request(method, url, **kwargs):
+    """
+    Make a request through the pooled session for the host of url.
+    Takes the same arguments as requests.request; timeout defaults to
+    get_timeout(). Raises RequestException if the host could not be reached,
+    or CircuitOpen (a RequestException) if its circuit breaker is open.
+    :param method:
+    :param url:
+    :return: requests.Response
+    """
+    kwargs.setdefault('timeout', get_timeout())
+    breaker = get_breaker(url)
+    if not breaker.allow():
+        logger.warning('%s %s not made: %r is open', method.upper(), url, breaker)
+        raise CircuitOpen('%s is not being called: too many failures' % breaker.name)
+    try:
+        response = get_session(url).request(method, url, **kwargs)
+    except RequestException as e:
+        logger.warning('%s %s failed: %r', method.upper(), url, e)
+        if isinstance(e, (requests.ConnectionError, requests.Timeout)):
+            breaker.record_failure()
+        raise
+    if response.status_code in BREAKER_STATUSES:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+    return response
+
+
+def get(url, **kwargs):
+    return request('get', url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request('post', url, **kwargs)
+
+
+def put(url, **kwargs):
+    return request('put', url, **kwargs)
+
+
+def close_sessions():
+    """Close all pooled sessions (and their connections)"""
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
@@ -1,8 +1,9 @@
 from decimal import Decimal
 
-import requests
 from django.conf import settings
 
+from . import upstream
+
 TRUE_LIST = [1, "1", "true", "True", "TRUE", "YES", "Yes", "yes", True]
 FALSE_LIST = [0, "0", "False", "FALSE", "false", "NO", "No", "no", False]
 
@@ -30,10 +31,18 @@ def int_env(env_val):
 
 def get_vmi_user_data(request):
     """ Makes a call to the VMI user_profile endpoint and returns a response """
+    # imported here because the settings import this module
+    from apps.users.utils import get_access_token, refresh_access_token
+
     user_endpoint = settings.SOCIAL_AUTH_VERIFYMYIDENTITY_OPENIDCONNECT_HOST + '/api/v1/user/'
-    social_auth_extra_data = request.user.social_auth.values().first()['extra_data']
-    token = social_auth_extra_data['access_token'] if social_auth_extra_data else None
-    response = requests.get(
+    social_auth = request.user.social_auth.filter(provider='verifymyidentity-openidconnect').first()
+    token = get_access_token(social_auth) if social_auth else None
+    response = upstream.get(
         url=user_endpoint, headers={'Authorization': "Bearer {}".format(token)}
     )
+    if response.status_code in [401, 403] and social_auth and refresh_access_token(social_auth, token):
+        response = upstream.get(
+            url=user_endpoint,
+            headers={'Authorization': "Bearer {}".format(social_auth.extra_data['access_token'])},
+        )
     return response